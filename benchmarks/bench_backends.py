@@ -0,0 +1,219 @@
+"""
+Inference backend comparison: detector (and optionally ReID) latency and accuracy per runtime.
+
+Every available backend runs on the same frames, from a recorded session,
+a video or the synthetic clip. Accuracy is agreement with the PyTorch FP32
+model: a detection matches a reference detection of the same class at
+IoU >= 0.5, and recall, precision and the mean confidence change are taken
+over all frames. Missing runtimes are skipped; exports are made (and cached
+in models/) on first use. Use a session recorded on the deployment camera,
+since the synthetic clip has no real people in it.
+
+    python -m benchmarks.bench_backends --source sessions/yard --frames 100 --int8 --reid
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from benchmarks.fixtures import read_clip, synthetic_clip
+from watergun.common.mjpeg_server import read_video
+from watergun.common.session import SessionReader, is_session
+from watergun.control.backends import (DETECTOR_WEIGHTS, REID_WEIGHTS, RUNTIMES, export_detector, export_reid,
+                                       runtime_available)
+
+DEFAULT_OUTPUT = os.path.join(os.path.dirname(__file__), "results", "backends.json")
+MATCH_IOU = 0.5
+
+
+def load_frames(source, count):
+    if source is None:
+        return read_clip(synthetic_clip())[:count]
+    if is_session(source):
+        reader = SessionReader(source)
+        return [reader.frame(i) for i in np.linspace(0, len(reader) - 1, min(count, len(reader))).astype(int)]
+    return read_video(source, count)
+
+
+def iou(a, b):
+    """
+    :return: IoU matrix between the xyxy boxes in a and b
+    """
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def match(reference, candidate):
+    """
+    Greedily pair detections of the same class, highest IoU first.
+
+    :param reference: (N, 6) array of x1, y1, x2, y2, conf, cls
+    :return: list of (reference index, candidate index, IoU)
+    """
+    if not len(reference) or not len(candidate):
+        return []
+    overlaps = iou(reference[:, :4], candidate[:, :4])
+    overlaps[reference[:, 5, None] != candidate[None, :, 5]] = 0
+    pairs = []
+    while True:
+        i, j = np.unravel_index(np.argmax(overlaps), overlaps.shape)
+        if overlaps[i, j] < MATCH_IOU:
+            return pairs
+        pairs.append((i, j, overlaps[i, j]))
+        overlaps[i, :] = 0
+        overlaps[:, j] = 0
+
+
+def run_detector(path, frames, imgsz, warmup=3):
+    from ultralytics import YOLO
+    model = YOLO(path, task='detect')
+    for frame in frames[:warmup]:
+        model(frame, imgsz=imgsz, verbose=False)
+    times = []
+    detections = []
+    for frame in frames:
+        start = time.perf_counter()
+        results = model(frame, imgsz=imgsz, verbose=False)
+        times.append(time.perf_counter() - start)
+        boxes = results[0].boxes
+        detections.append(np.hstack([boxes.xyxy.cpu().numpy(), boxes.conf.cpu().numpy()[:, None],
+                                     boxes.cls.cpu().numpy()[:, None]]).reshape(-1, 6))
+    return np.array(times) * 1000, detections
+
+
+def agreement(reference, detections):
+    reference_count = sum(len(r) for r in reference)
+    candidate_count = sum(len(d) for d in detections)
+    matched = 0
+    conf_deltas = []
+    ious = []
+    for ref, det in zip(reference, detections):
+        for i, j, overlap in match(ref, det):
+            matched += 1
+            conf_deltas.append(abs(ref[i, 4] - det[j, 4]))
+            ious.append(overlap)
+    return {
+        "detections": candidate_count,
+        "recall": matched / reference_count if reference_count else None,
+        "precision": matched / candidate_count if candidate_count else None,
+        "mean_iou": float(np.mean(ious)) if ious else None,
+        "mean_conf_delta": float(np.mean(conf_deltas)) if conf_deltas else None,
+    }
+
+
+def run_reid(path, frames, detections, max_crops=64):
+    """
+    :return: (milliseconds per frame, (N, D) features of every detection crop)
+    """
+    from pathlib import Path
+    from boxmot import DeepOCSORT
+    reid = DeepOCSORT(model_weights=Path(path), device='cpu', fp16=False).model
+    times = []
+    features = []
+    for frame, dets in zip(frames, detections):
+        if not len(dets):
+            continue
+        start = time.perf_counter()
+        features.append(np.asarray(reid.get_features(dets[:, :4], frame)))
+        times.append(time.perf_counter() - start)
+        if sum(len(f) for f in features) >= max_crops:
+            break
+    features = np.vstack(features) if features else np.zeros((0, 1))
+    return np.array(times) * 1000, features
+
+
+def cosine(a, b):
+    a = a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-9)
+    b = b / np.maximum(np.linalg.norm(b, axis=1, keepdims=True), 1e-9)
+    return np.sum(a * b, axis=1)
+
+
+def latency(times):
+    if not len(times):
+        return {}
+    p50, p99 = np.percentile(times, [50, 99])
+    return {"p50_ms": float(p50), "p99_ms": float(p99), "mean_ms": float(times.mean())}
+
+
+def fmt(value, spec):
+    return format(value, spec) if value is not None else "-"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", help="Session directory or video; defaults to the synthetic clip")
+    parser.add_argument("--frames", type=int, default=100, help="Frames to run each backend on")
+    parser.add_argument("--weights", default=DETECTOR_WEIGHTS)
+    parser.add_argument("--imgsz", type=int, default=640, help="Detector input size")
+    parser.add_argument("--int8", action="store_true", help="Also compare an INT8 OpenVINO export")
+    parser.add_argument("--calibration", help="Session directory or video for INT8 calibration; defaults to --source")
+    parser.add_argument("--reid", action="store_true", help="Also compare the ReID backends")
+    parser.add_argument("--reid-weights", default=REID_WEIGHTS)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.weights):
+        raise SystemExit(f"{args.weights} not found")
+    frames = load_frames(args.source, args.frames)
+    if not frames:
+        raise SystemExit(f"No frames in {args.source}")
+    configs = [("pytorch", False), ("onnx", False), ("openvino", False)]
+    if args.int8:
+        configs.append(("openvino", True))
+    calibration = args.calibration or args.source or synthetic_clip()
+
+    report = {"source": args.source or "synthetic", "frames": len(frames), "imgsz": args.imgsz, "detector": {},
+              "reid": {}}
+    print(f"{len(frames)} {frames[0].shape[1]}x{frames[0].shape[0]} frames from {report['source']}, "
+          f"imgsz {args.imgsz}")
+    print(f"{'detector':<16}{'p50 ms':>9}{'p99 ms':>9}{'dets':>7}{'recall':>8}{'prec':>8}{'IoU':>7}{'dconf':>8}")
+    reference = None
+    for backend, int8 in configs:
+        name = f"{backend}-int8" if int8 else backend
+        if not runtime_available(backend):
+            print(f"{name:<16}skipped, {RUNTIMES[backend]} is not installed")
+            continue
+        path = args.weights if backend == "pytorch" else export_detector(
+            args.weights, backend, args.imgsz, int8, calibration if int8 else None)
+        times, detections = run_detector(path, frames, args.imgsz)
+        if reference is None:
+            reference = detections
+        result = {"path": path, **latency(times), **agreement(reference, detections)}
+        report["detector"][name] = result
+        print(f"{name:<16}{result['p50_ms']:>9.1f}{result['p99_ms']:>9.1f}{result['detections']:>7}"
+              f"{fmt(result['recall'], '.3f'):>8}{fmt(result['precision'], '.3f'):>8}"
+              f"{fmt(result['mean_iou'], '.3f'):>7}{fmt(result['mean_conf_delta'], '.3f'):>8}")
+
+    if args.reid and reference is not None:
+        print(f"{'reid':<16}{'p50 ms':>9}{'p99 ms':>9}{'crops':>7}{'cos min':>9}{'cos mean':>9}")
+        reference_features = None
+        for backend in ("pytorch", "onnx", "openvino"):
+            if not runtime_available(backend):
+                print(f"{backend:<16}skipped, {RUNTIMES[backend]} is not installed")
+                continue
+            path = args.reid_weights if backend == "pytorch" else export_reid(args.reid_weights, backend)
+            times, features = run_reid(path, frames, reference)
+            if reference_features is None:
+                reference_features = features
+            similarity = cosine(reference_features, features) if len(features) else np.zeros(0)
+            result = {"path": path, **latency(times), "crops": len(features),
+                      "min_cosine": float(similarity.min()) if len(similarity) else None,
+                      "mean_cosine": float(similarity.mean()) if len(similarity) else None}
+            report["reid"][backend] = result
+            print(f"{backend:<16}{result.get('p50_ms', float('nan')):>9.1f}{result.get('p99_ms', float('nan')):>9.1f}"
+                  f"{result['crops']:>7}{fmt(result['min_cosine'], '.4f'):>9}{fmt(result['mean_cosine'], '.4f'):>9}")
+
+    os.makedirs(os.path.dirname(args.output), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"accuracy is agreement with the PyTorch FP32 model; report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
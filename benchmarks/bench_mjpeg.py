@@ -0,0 +1,81 @@
+"""
+MJPEG ingest benchmark: cv2.VideoCapture against MJPEGReader at each decode scale.
+
+A local MJPEGTestServer streams the synthetic clip (upscaled to the Pi
+camera's resolution) and a consumer takes the newest frame at the
+processing rate, like the tracking loop does. Reported per reader: frames
+consumed, how old they were when consumed, decode time and process CPU.
+
+    python -m benchmarks.bench_mjpeg --duration 5 --fps 30 --size 1280x720
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.fixtures import read_clip, synthetic_clip
+from watergun.common.capture import FrameGrabber
+from watergun.common.metrics import METRICS
+from watergun.common.mjpeg import MJPEGReader
+from watergun.common.mjpeg_server import MJPEGTestServer, encode_frames
+
+
+def consume(grabber, duration, rate):
+    """
+    Take the newest frame `rate` times a second and return the frame ages in milliseconds.
+    """
+    ages = []
+    seq = 0
+    start = time.monotonic()
+    next_time = start
+    while time.monotonic() - start < duration:
+        frame, timestamp, new_seq = grabber.read()
+        if frame is not None and new_seq != seq:
+            seq = new_seq
+            ages.append((time.monotonic() - timestamp) * 1000)
+        next_time += 1.0 / rate
+        time.sleep(max(0.0, next_time - time.monotonic()))
+    return np.array(ages)
+
+
+def bench(name, make_grabber, duration, rate):
+    METRICS.histograms.pop("decode", None)
+    cpu_start = time.process_time()
+    grabber = make_grabber().start()
+    ages = consume(grabber, duration, rate)
+    stats = grabber.stats()
+    grabber.stop()
+    cpu = (time.process_time() - cpu_start) / duration
+    decode = METRICS.histograms.get("decode")
+    decode_ms = decode.quantile(0.5) * 1000 if decode is not None and decode.count else float("nan")
+    age_p50, age_p99 = np.percentile(ages, [50, 99]) if len(ages) else (float("nan"), float("nan"))
+    print(f"{name:<20}{len(ages):>8}{stats['captured']:>10}{age_p50:>10.1f}{age_p99:>10.1f}"
+          f"{decode_ms:>12.2f}{cpu:>8.0%}   {grabber.frame_width}x{grabber.frame_height}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per reader")
+    parser.add_argument("--fps", type=float, default=30.0, help="Server frame rate")
+    parser.add_argument("--rate", type=float, default=15.0, help="Consumer frames per second")
+    parser.add_argument("--size", default="1280x720", help="Streamed frame size")
+    args = parser.parse_args()
+
+    size = tuple(int(v) for v in args.size.split("x"))
+    frames = [cv2.resize(frame, size) for frame in read_clip(synthetic_clip())]
+    server = MJPEGTestServer(encode_frames(frames), fps=args.fps).start()
+    print(f"streaming {len(frames)} {size[0]}x{size[1]} frames at {args.fps:g} FPS from {server.url}, "
+          f"consuming at {args.rate:g} FPS")
+    print(f"{'reader':<20}{'used':>8}{'received':>10}{'age p50':>10}{'age p99':>10}{'decode p50':>12}{'cpu':>8}")
+
+    bench("cv2.VideoCapture", lambda: FrameGrabber(server.url), args.duration, args.rate)
+    for scale in (1, 2, 4, 8):
+        bench(f"MJPEGReader 1/{scale}", lambda: MJPEGReader(server.url, scale=scale), args.duration, args.rate)
+    server.close()
+    print("ages in ms from receipt to use; decode is on the consumer thread for MJPEGReader, "
+          "inside the capture thread for cv2.VideoCapture")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Serial transport benchmark against the simulated Arduino on a pseudo-terminal.
+
+Commands are written as fast as the caller can produce them; the transport
+coalesces whatever the 115200 baud link can't carry. Reports command-to-
+actuation latency, actuation rate, and receive-buffer overflows with and
+without ack-based flow control.
+
+    python -m benchmarks.bench_serial_transport --duration 3
+"""
+import argparse
+import time
+
+import numpy as np
+
+from watergun.common.duino_sim import DuinoSimulator
+from watergun.common.protocol import encode_command
+from watergun.common.serial_transport import SerialTransport
+
+
+def run(duration, ack, baudrate):
+    duino = DuinoSimulator(send_acks=True)
+    transport = SerialTransport(duino.attach_pty(baudrate, boot_time=0.2), baudrate, ack=ack)
+    while not transport.ready:
+        time.sleep(0.01)
+
+    start = time.monotonic()
+    seq = 0
+    while time.monotonic() - start < duration:
+        transport.write(encode_command(90 + 45 * np.sin(seq / 500), 45, False, seq=seq))
+        seq += 1
+        time.sleep(0.0001)
+    time.sleep(0.2)
+    transport.close()
+    duino.close()
+
+    latencies = np.array([(actuated_at * 1000 - timestamp) % 2**32
+                          for actuated_at, _, _, _, _, timestamp in duino.actuations], dtype=np.float64)
+    print(f"ack={ack}: submitted {seq}, written {transport.stats['written']}, "
+          f"coalesced {transport.stats['coalesced']}, actuated {len(latencies)} "
+          f"({len(latencies) / duration:.0f}/s), rx overflow bytes {duino.stats['rx_overflow_bytes']}")
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f"  command->actuation latency ms: p50 {p50:.1f} p95 {p95:.1f} p99 {p99:.1f} max {latencies.max():.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=3.0)
+    parser.add_argument("--baud", type=int, default=115200)
+    args = parser.parse_args()
+
+    for ack in (False, True):
+        run(args.duration, ack, args.baud)
+
+
+if __name__ == "__main__":
+    main()
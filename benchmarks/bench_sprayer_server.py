@@ -0,0 +1,88 @@
+"""
+Latency/throughput benchmark for the sprayer server in watergun/control/outdoor.py.
+
+A fake client sends binary commands over TCP while the server forwards them to
+a simulated Arduino on a pseudo-terminal. Latency is the time from the client
+stamping a command to the simulator actuating the servos.
+
+    python -m benchmarks.bench_sprayer_server --duration 5 --client-rate 200
+"""
+import argparse
+import asyncio
+import socket
+import time
+
+import numpy as np
+
+from watergun.common.duino_sim import DuinoSimulator
+from watergun.common.protocol import encode_command
+from watergun.common.serial_transport import SerialTransport
+from watergun.control.outdoor import SprayerServer
+
+
+def run_client(port, rate, duration, sent):
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    interval = 1.0 / rate
+    start = time.monotonic()
+    next_send = start
+    seq = 0
+    while time.monotonic() - start < duration:
+        sock.sendall(encode_command(90 + 45 * np.sin(seq / 50), 45, seq % 60 < 30, seq=seq))
+        seq += 1
+        next_send += interval
+        time.sleep(max(0.0, next_send - time.monotonic()))
+    sent.append(seq)
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--client-rate", type=float, default=200.0, help="Commands per second from the fake client")
+    parser.add_argument("--rate", type=float, default=30.0, help="Server serial tick rate")
+    parser.add_argument("--ack", action="store_true", help="Use ack-based serial flow control")
+    args = parser.parse_args()
+
+    duino = DuinoSimulator()
+    ser = SerialTransport(duino.attach_pty(115200, boot_time=0.2), 115200, ack=args.ack)
+    while not ser.ready:
+        time.sleep(0.01)
+
+    sent = []
+
+    server = SprayerServer({("127.0.0.1", 0): 0}, rate=args.rate, serial=ser)
+
+    async def bench():
+        task = asyncio.create_task(server.run())
+        while not server.servers:
+            await asyncio.sleep(0.01)
+        port = server.bound_ports()[0]
+        await asyncio.to_thread(run_client, port, args.client_rate, args.duration, sent)
+        await asyncio.sleep(0.2)
+        task.cancel()
+
+    try:
+        asyncio.run(bench())
+    except asyncio.CancelledError:
+        pass
+    server.close()
+    ser.close()
+    duino.close()
+
+    latencies = np.array([(actuated_at * 1000 - timestamp) % 2**32
+                          for actuated_at, _, _, _, _, timestamp in duino.actuations], dtype=np.float64)
+    frame_bytes = len(encode_command(0, 0, False))
+    print(f"client sent {sent[0]} commands ({sent[0] / args.duration:.0f}/s)")
+    print(f"server received {server.stats['received']}, forwarded {server.stats['forwarded']} "
+          f"({server.stats['forwarded'] / args.duration:.1f}/s), late ticks {server.stats['late_ticks']}")
+    print(f"serial bytes {server.stats['forwarded'] * frame_bytes} "
+          f"({server.stats['forwarded'] * frame_bytes * 10 / args.duration / 115200:.1%} of 115200 baud)")
+    print(f"serial transport {ser.stats}, simulator {duino.stats}")
+    if len(latencies):
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f"command->actuation latency ms: p50 {p50:.1f} p95 {p95:.1f} p99 {p99:.1f} max {latencies.max():.1f}")
+
+
+if __name__ == "__main__":
+    main()
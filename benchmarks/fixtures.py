@@ -0,0 +1,123 @@
+"""
+Deterministic inputs for the benchmarks: a synthetic clip and detector-shaped results.
+
+Nothing here needs a camera, network access or model weights.
+"""
+import os
+
+import cv2
+import numpy as np
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+CLIP_SIZE = (640, 480)
+CLIP_FRAMES = 90
+
+
+def synthetic_clip(path=None, frames=CLIP_FRAMES, size=CLIP_SIZE, fps=30):
+    """
+    Write (once) a short MJPEG clip of person-sized blobs walking across a textured floor.
+
+    :return: path of the clip
+    """
+    path = path or os.path.join(DATA_DIR, f"synthetic_{size[0]}x{size[1]}_{frames}.avi")
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    rng = np.random.default_rng(0)
+    width, height = size
+    background = cv2.GaussianBlur(rng.integers(60, 120, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    walkers = [(rng.uniform(0, width), rng.uniform(height * 0.3, height * 0.8), rng.uniform(-4, 4), rng.uniform(-1, 1))
+               for _ in range(4)]
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, size)
+    for i in range(frames):
+        frame = background.copy()
+        for j, (x, y, vx, vy) in enumerate(walkers):
+            cx = int((x + vx * i) % width)
+            cy = int(np.clip(y + vy * i, 60, height - 1))
+            cv2.rectangle(frame, (cx - 20, cy - 110), (cx + 20, cy), (40 + 50 * j, 200 - 40 * j, 180), -1)
+            cv2.circle(frame, (cx, cy - 125), 15, (90, 140, 220), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+
+def read_clip(path):
+    vid = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = vid.read()
+        if not ret:
+            break
+        frames.append(frame)
+    vid.release()
+    return frames
+
+
+class FakeTensor:
+    """
+    The slice of the torch.Tensor API that the result post-processing touches.
+    """
+
+    def __init__(self, array):
+        self.array = np.asarray(array, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+    def __getitem__(self, index):
+        return FakeTensor(self.array[index])
+
+    def __len__(self):
+        return len(self.array)
+
+
+class FakeBox:
+    def __init__(self, row):
+        self.xyxy = FakeTensor(row[None, :4])
+        self.conf = FakeTensor(row[None, 4])
+        self.cls = FakeTensor(row[None, 5])
+
+
+class FakeBoxes:
+    """
+    Looks like ultralytics' Boxes both when iterated box by box and when used as whole tensors.
+    """
+
+    def __init__(self, rows):
+        rows = np.asarray(rows, dtype=np.float32).reshape(-1, 6)
+        self.data = FakeTensor(rows)
+        self.xyxy = FakeTensor(rows[:, :4])
+        self.conf = FakeTensor(rows[:, 4])
+        self.cls = FakeTensor(rows[:, 5])
+        self._boxes = [FakeBox(row) for row in rows]
+
+    def __iter__(self):
+        return iter(self._boxes)
+
+    def __len__(self):
+        return len(self._boxes)
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.boxes = FakeBoxes(rows)
+
+
+def fake_yolo_results(n_boxes, size=CLIP_SIZE, seed=0):
+    """
+    One frame's worth of detector output with n_boxes random boxes of mixed sizes and classes.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    x1 = rng.uniform(0, width * 0.9, n_boxes)
+    y1 = rng.uniform(0, height * 0.9, n_boxes)
+    w = rng.uniform(2, width * 0.3, n_boxes)
+    h = rng.uniform(2, height * 0.6, n_boxes)
+    rows = np.stack([x1, y1, np.minimum(x1 + w, width), np.minimum(y1 + h, height),
+                     rng.uniform(0.25, 1.0, n_boxes), rng.integers(0, 80, n_boxes)], axis=1)
+    return [FakeResult(rows)]
@@ -0,0 +1,282 @@
+"""
+Hot-path benchmark suite.
+
+Times the aiming math, crosshair drawing, detector post-processing, tracker
+update and full per-frame processing on a synthetic clip, reports latency
+percentiles and throughput, writes the results as JSON and compares them
+with a saved baseline. Cases whose dependencies or model weights are
+missing are reported as skipped rather than failing the run, so it works
+on any CPU-only box without a camera or network.
+
+    python -m benchmarks.run_benchmarks                       # run, compare with benchmarks/baseline.json if present
+    python -m benchmarks.run_benchmarks --save-baseline       # run and store the results as the new baseline
+    python -m benchmarks.run_benchmarks --only pixel_to_meter calculate_pan_tilt
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmarks.fixtures import CLIP_SIZE, fake_yolo_results, read_clip, synthetic_clip
+
+BENCH_DIR = os.path.dirname(__file__)
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, "results", "latest.json")
+
+YOLO_WEIGHTS = "models/yolov8n.pt"
+REID_WEIGHTS = "models/osnet_x0_25_msmt17.pt"
+
+
+class Skip(Exception):
+    pass
+
+
+def _perspective_transform():
+    # Same homography as load_floor_corners, without importing the model-heavy pipeline module
+    width, height = CLIP_SIZE
+    floor_corners = np.load(os.getenv('FLOOR_CORNERS_FILE', 'assets/floor_corners.npy')).astype(np.float32)
+    src_pts = np.array([[0, 0], [width-1, 0], [width-1, height-1], [0, height-1]], dtype=np.float32)
+    return cv2.getPerspectiveTransform(src_pts, floor_corners)
+
+
+def _calibration_params():
+    with open("calibration_results.json") as f:
+        results = json.load(f)
+    return [results["height"], results["initial_pan"], results["initial_tilt"], results["initial_roll"]]
+
+
+def _random_pixels(n=1024):
+    rng = np.random.default_rng(0)
+    return rng.uniform([0, 0], CLIP_SIZE, (n, 2))
+
+
+def _require(path):
+    if not os.path.exists(path):
+        raise Skip(f"{path} not found (weights are not downloaded during benchmarks)")
+
+
+def _import_pipeline():
+    try:
+        from watergun.control import pipeline
+    except ImportError as e:
+        raise Skip(f"pipeline dependencies missing: {e}")
+    return pipeline
+
+
+def case_pixel_to_meter():
+    from watergun.common import pixel_to_meter
+    M = _perspective_transform()
+    points = itertools.cycle(_random_pixels().tolist())
+    return lambda: pixel_to_meter(*next(points), M)
+
+
+def case_calculate_pan_tilt():
+    from watergun.common import calculate_pan_tilt
+    params = _calibration_params()
+    points = itertools.cycle((_random_pixels() / 100).tolist())
+    return lambda: calculate_pan_tilt(*next(points), 0, params)
+
+
+def case_pixels_to_pan_tilt_batch64():
+    from watergun.common import CalibratedTransform
+    transform = CalibratedTransform(_calibration_params(), _perspective_transform())
+    batch = _random_pixels(64)
+    return lambda: transform.pixels_to_pan_tilt(batch)
+
+
+def case_pan_tilt_table_lookup():
+    import tempfile
+    from watergun.common import CalibratedTransform
+    from watergun.common.lut import PanTiltTable
+    transform = CalibratedTransform(_calibration_params(), _perspective_transform())
+    table = PanTiltTable.load_or_build(transform, *CLIP_SIZE, cache_dir=tempfile.mkdtemp())
+    points = itertools.cycle(_random_pixels().tolist())
+    return lambda: table.lookup(*next(points))
+
+
+def case_draw_crosshair():
+    try:
+        from watergun.common.draw import draw_crosshair
+    except Exception as e:
+        raise Skip(f"draw module failed to import: {e}")
+    frames = read_clip(synthetic_clip())
+    frame = frames[0].copy()
+    points = itertools.cycle(_random_pixels().astype(int).tolist())
+
+    def run():
+        draw_crosshair(frame, *next(points))
+    try:
+        run()
+    except Exception as e:
+        raise Skip(f"draw_crosshair failed: {e!r}")
+    return run
+
+
+def case_process_yolo_results():
+    from watergun.common.detections import DetectionFilter
+    detection_filter = DetectionFilter(*CLIP_SIZE)
+    results = itertools.cycle([fake_yolo_results(40, seed=seed) for seed in range(16)])
+    return lambda: detection_filter(next(results))
+
+
+def case_tracker_update():
+    _import_pipeline()
+    _require(REID_WEIGHTS)
+    from pathlib import Path
+    from boxmot import DeepOCSORT
+    tracker = DeepOCSORT(model_weights=Path(REID_WEIGHTS), device='cpu', fp16=False)
+    frames = read_clip(synthetic_clip())
+    rng = np.random.default_rng(0)
+    base = np.array([[100, 100, 160, 300, 0.9, 0], [300, 150, 350, 320, 0.8, 0], [450, 120, 500, 330, 0.85, 0]],
+                    dtype=np.float32)
+    inputs = itertools.cycle([(frame, base + np.r_[rng.normal(0, 2, 4), 0, 0].astype(np.float32) + [i, 0, i, 0, 0, 0])
+                              for i, frame in enumerate(frames)])
+
+    def run():
+        frame, dets = next(inputs)
+        tracker.update(dets, frame)
+    return run
+
+
+def case_process_frame():
+    pipeline = _import_pipeline()
+    _require(YOLO_WEIGHTS)
+    _require(REID_WEIGHTS)
+    try:
+        from watergun.common.draw import draw_crosshair
+    except Exception as e:
+        raise Skip(f"draw module failed to import: {e}")
+    tracking = pipeline.TrackingPipeline(*CLIP_SIZE)
+    tracking.wait_until_ready()
+    frames = itertools.cycle(read_clip(synthetic_clip()))
+
+    def run():
+        frame = next(frames).copy()
+        tracking.update_tracks(frame, time.monotonic())
+        target = tracking.select_target(5.0)
+        if target is not None:
+            draw_crosshair(frame, *target)
+            tracking.send(*tracking.aim(*target), 0)
+    return run
+
+
+def case_clip_decode():
+    path = synthetic_clip()
+    state = {"vid": cv2.VideoCapture(path)}
+
+    def run():
+        ret, _ = state["vid"].read()
+        if not ret:
+            state["vid"].release()
+            state["vid"] = cv2.VideoCapture(path)
+            state["vid"].read()
+    return run
+
+
+CASES = {name[len("case_"):]: fn for name, fn in globals().items() if name.startswith("case_")}
+
+
+def measure(fn, min_time=1.0, min_iterations=20, max_iterations=100000, warmup=5):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < max_iterations and (len(timings) < min_iterations or time.perf_counter() - start < min_time):
+        t0 = time.perf_counter_ns()
+        fn()
+        timings.append(time.perf_counter_ns() - t0)
+    timings = np.array(timings, dtype=np.float64) / 1000.0
+    p50, p90, p99 = np.percentile(timings, [50, 90, 99])
+    return {
+        "iterations": len(timings),
+        "mean_us": float(timings.mean()),
+        "p50_us": float(p50),
+        "p90_us": float(p90),
+        "p99_us": float(p99),
+        "ops_per_s": float(1e6 / timings.mean()),
+    }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    :return: list of (case, ratio) for cases whose p50 got slower than baseline by more than tolerance
+    """
+    regressions = []
+    print(f"\n{'case':<28}{'baseline p50':>14}{'now p50':>12}{'ratio':>8}")
+    for name, result in results.items():
+        before = baseline.get("results", {}).get(name)
+        if "p50_us" not in result or not before or "p50_us" not in before:
+            continue
+        ratio = result["p50_us"] / before["p50_us"]
+        flag = "  REGRESSION" if ratio > 1 + tolerance else ""
+        print(f"{name:<28}{before['p50_us']:>12.2f}us{result['p50_us']:>10.2f}us{ratio:>8.2f}{flag}")
+        if flag:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the tracking hot paths")
+    parser.add_argument("--only", nargs="+", choices=sorted(CASES), help="Run only these cases")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds to spend per case")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Where to write the JSON results")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Also write the results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed p50 slowdown before a case counts as a regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    print(f"{'case':<28}{'p50':>10}{'p90':>10}{'p99':>10}{'ops/s':>12}")
+    for name in args.only or sorted(CASES):
+        try:
+            result = measure(CASES[name](), min_time=args.min_time)
+            print(f"{name:<28}{result['p50_us']:>8.2f}us{result['p90_us']:>8.2f}us{result['p99_us']:>8.2f}us"
+                  f"{result['ops_per_s']:>12.0f}")
+        except Skip as e:
+            result = {"skipped": str(e)}
+            print(f"{name:<28}skipped: {e}")
+        results[name] = result
+
+    report = {"environment": environment(), "results": results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -21,6 +21,21 @@
 #define MIN_ANGLE 0
 #define MAX_ANGLE 180
 
+// Binary command frame (see watergun/common/protocol.py)
+#define FRAME_MAGIC 0xA5
+#define FRAME_VERSION 1
+#define FRAME_SIZE 16
+#define FLAG_TRIGGER 0x01
+#define FLAG_RED_BUTTON 0x02
+
+// Single-byte replies: READY_BYTE once after boot, ACK_BYTE after each applied command
+#define READY_BYTE 'R'
+#define ACK_BYTE 'K'
+#define SEND_ACKS 1
+
+// Legacy ASCII "pan,tilt,trigger,red_button\n" lines
+#define LINE_BUFFER_SIZE 32
+
 Servo panServo;
 Servo tiltServo;
 
@@ -30,6 +45,14 @@ bool hBridgeDirection = true;
 bool lastTriggerState = false;
 bool lastRedButtonState = false;
 
+uint8_t frameBuffer[FRAME_SIZE];
+uint8_t frameLength = 0;
+char lineBuffer[LINE_BUFFER_SIZE];
+uint8_t lineLength = 0;
+bool lineValid = true;
+uint16_t lastSeq = 0;
+bool haveSeq = false;
+
 void setup() {
   Serial.begin(BAUD_RATE);
   panServo.attach(PAN_SERVO_PIN);
@@ -38,24 +61,125 @@ void setup() {
   pinMode(H_BRIDGE_PIN_2, OUTPUT);
   digitalWrite(H_BRIDGE_PIN_1, LOW);
   digitalWrite(H_BRIDGE_PIN_2, LOW);
+  Serial.write(READY_BYTE);
 }
 
 void loop() {
-  if (Serial.available() > 0) {
-    panAngle = Serial.parseInt();
-    tiltAngle = Serial.parseInt();
-    trigger = Serial.parseInt() != 0;  // Convert to bool
-    redButton = Serial.parseInt() != 0;  // Convert to bool
-    
-    // Clear any remaining data in the buffer
-    while (Serial.available() > 0) {
-      Serial.read();
+  // Consume bytes as they arrive instead of blocking in parseInt timeouts
+  while (Serial.available() > 0) {
+    uint8_t b = Serial.read();
+
+    // The magic byte never appears in ASCII lines, so it always starts a new frame
+    if (frameLength == 0 && b == FRAME_MAGIC) {
+      lineLength = 0;
+      lineValid = true;
+    }
+    if (frameLength > 0 || b == FRAME_MAGIC) {
+      frameBuffer[frameLength++] = b;
+      if (frameLength == FRAME_SIZE) {
+        if (handleFrame()) {
+          frameLength = 0;
+          lineValid = true;
+        } else {
+          resyncFrame();
+        }
+      }
+    } else if (b == '\n') {
+      lineBuffer[lineLength] = '\0';
+      if (lineValid && lineLength > 0) {
+        handleLine();
+      }
+      lineLength = 0;
+      lineValid = true;
+    } else if (b != '\r' && (b < 0x20 || b > 0x7E)) {
+      lineValid = false;  // Binary garbage, e.g. the tail of a corrupt frame; never parse it as angles
+    } else if (lineLength < LINE_BUFFER_SIZE - 1) {
+      lineBuffer[lineLength++] = (char)b;
+    } else {
+      lineValid = false;  // Overlong line, drop it up to the newline
     }
-    
-    updateOutputs();
   }
 }
 
+// Slide one byte past a bad frame's magic byte to the next magic byte, rather than throwing away
+// all FRAME_SIZE bytes, so one corrupted byte costs at most the frame it hit
+void resyncFrame() {
+  uint8_t start = 1;
+  while (start < frameLength && frameBuffer[start] != FRAME_MAGIC) {
+    start++;
+  }
+  memmove(frameBuffer, frameBuffer + start, frameLength - start);
+  frameLength -= start;
+  // Skipped bytes are frame garbage; ignore whatever follows them up to the next newline too
+  lineLength = 0;
+  lineValid = false;
+}
+
+uint16_t fletcher16(const uint8_t *data, uint8_t length) {
+  uint16_t sum1 = 0;
+  uint16_t sum2 = 0;
+  for (uint8_t i = 0; i < length; i++) {
+    sum1 = (sum1 + data[i]) % 255;
+    sum2 = (sum2 + sum1) % 255;
+  }
+  return (sum2 << 8) | sum1;
+}
+
+// Returns false if the buffer does not hold a valid frame (wrong version or checksum)
+bool handleFrame() {
+  uint16_t checksum = frameBuffer[14] | ((uint16_t)frameBuffer[15] << 8);
+  if (frameBuffer[1] != FRAME_VERSION || checksum != fletcher16(frameBuffer, FRAME_SIZE - 2)) {
+    return false;
+  }
+
+  // Drop duplicated or out-of-order commands (sequence number wraps at 16 bits).
+  // Sequence 0 starts a new session, e.g. after the host restarts.
+  uint16_t seq = frameBuffer[2] | ((uint16_t)frameBuffer[3] << 8);
+  if (haveSeq && seq != 0 && (uint16_t)((uint16_t)(seq - lastSeq) - 1) >= 0x7FFF) {
+    // Still acknowledged: the host counts unacknowledged bytes against the receive buffer
+    acknowledge();
+    return true;
+  }
+  lastSeq = seq;
+  haveSeq = true;
+
+  int16_t panCentidegrees = frameBuffer[8] | ((int16_t)frameBuffer[9] << 8);
+  int16_t tiltCentidegrees = frameBuffer[10] | ((int16_t)frameBuffer[11] << 8);
+  panAngle = (panCentidegrees + (panCentidegrees < 0 ? -50 : 50)) / 100;
+  tiltAngle = (tiltCentidegrees + (tiltCentidegrees < 0 ? -50 : 50)) / 100;
+  trigger = frameBuffer[12] & FLAG_TRIGGER;
+  redButton = frameBuffer[12] & FLAG_RED_BUTTON;
+
+  applyCommand();
+  return true;
+}
+
+void handleLine() {
+  char *field = strtok(lineBuffer, ",");
+  if (field == NULL) return;
+  panAngle = (int)atof(field);
+  field = strtok(NULL, ",");
+  if (field == NULL) return;
+  tiltAngle = (int)atof(field);
+  field = strtok(NULL, ",");
+  trigger = field != NULL && atoi(field) != 0;
+  field = strtok(NULL, ",");
+  redButton = field != NULL && atoi(field) != 0;
+
+  applyCommand();
+}
+
+void applyCommand() {
+  updateOutputs();
+  acknowledge();
+}
+
+void acknowledge() {
+#if SEND_ACKS
+  Serial.write(ACK_BYTE);
+#endif
+}
+
 void updateOutputs() {
   // Apply gear reduction and zero offsets to servo angles
   int adjustedPanAngle = constrain((panAngle * PAN_GEAR_RATIO) + PAN_ZERO_OFFSET, MIN_ANGLE, MAX_ANGLE);
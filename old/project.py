@@ -4,36 +4,31 @@ import logging
 from dotenv import load_dotenv
 import os
 
+from watergun.common.draw import CrosshairCompositor
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Load environment variables
 load_dotenv()
 
 # Global variables
-crosshair_img = None
+compositor = CrosshairCompositor()
 floor_corners = None
 image_offset = [0, 0]  # [x, y] offset in meters
 pixels_per_meter = int(os.getenv('PIXELS_PER_METER', 100))
 crosshair_scale = float(os.getenv('CROSSHAIR_SCALE', 1.0))
 
 def load_crosshair(crosshair_file):
-    global crosshair_img
-    crosshair = cv2.imread(crosshair_file, cv2.IMREAD_UNCHANGED)
+    global compositor
+    compositor = CrosshairCompositor(crosshair_file)
+    crosshair = compositor.image
     if crosshair is None:
         logging.error(f"Failed to load crosshair image: {crosshair_file}")
         return None
-    
-    max_size = 100
-    h, w = crosshair.shape[:2]
-    if max(h, w) > max_size:
-        scale = max_size / max(h, w)
-        crosshair = cv2.resize(crosshair, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
-        logging.info(f"Resized crosshair to fit within {max_size}x{max_size}")
-    
+
     crosshair_size_meters = (crosshair.shape[1] / pixels_per_meter * crosshair_scale, 
                             crosshair.shape[0] / pixels_per_meter * crosshair_scale)
     logging.info(f"Crosshair size: {crosshair_size_meters[0]:.2f}m x {crosshair_size_meters[1]:.2f}m")
-    crosshair_img = crosshair
 
 def load_floor_corners(floor_corners_file):
     global floor_corners
@@ -43,46 +38,13 @@ def load_floor_corners(floor_corners_file):
         logging.error(f"Failed to load floor corners: {e}")
 
 def project_crosshair(frame):
-    if crosshair_img is None or floor_corners is None:
+    if compositor.image is None or floor_corners is None:
         return frame
 
-    h, w = frame.shape[:2]
-    crosshair_h, crosshair_w = crosshair_img.shape[:2]
-
-    crosshair_frame = np.zeros((h, w, 4), dtype=np.uint8)
-
-    x = (w - crosshair_w) // 2
-    y = (h - crosshair_h) // 2
-
-    if crosshair_img.shape[2] == 4:
-        crosshair_frame[y:y+crosshair_h, x:x+crosshair_w] = crosshair_img
-    else:
-        crosshair_frame[y:y+crosshair_h, x:x+crosshair_w, :3] = crosshair_img
-        crosshair_frame[y:y+crosshair_h, x:x+crosshair_w, 3] = 255
-
     offset_x = int(image_offset[0] * pixels_per_meter)
     offset_y = int(image_offset[1] * pixels_per_meter)
-
-    src_pts = np.array([[0, 0], [w-1, 0], [w-1, h-1], [0, h-1]], dtype=np.float32)
-
-    src_center = np.mean(src_pts, axis=0)
-    dst_center = np.mean(floor_corners, axis=0)
-    translation = dst_center - src_center
-    src_pts += translation
-
-    src_pts += np.array([offset_x, offset_y])
-
-    dst_pts = floor_corners.astype(np.float32)
-
-    M = cv2.getPerspectiveTransform(src_pts, dst_pts)
-
-    warped = cv2.warpPerspective(crosshair_frame, M, (w, h))
-
-    alpha = warped[:,:,3] / 255.0
-    for c in range(3):
-        frame[:,:,c] = frame[:,:,c] * (1 - alpha) + warped[:,:,c] * alpha
-
-    return frame
+    # CROSSHAIR_SCALE only sizes the logged crosshair; the sprite has always been drawn at its native size
+    return compositor.draw_on_floor(frame, floor_corners, offset_x, offset_y, 1.0)
 
 def process_stream():
     cap = cv2.VideoCapture(os.getenv('MJPG_STREAM_URL'))
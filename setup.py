@@ -36,6 +36,6 @@ setup(
     python_requires='>=3.6',
     include_package_data=True,
     package_data={
-        # 'watergun': ['assets/*'],
+        'watergun': ['assets/*'],
     },
 )
\ No newline at end of file
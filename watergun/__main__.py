@@ -0,0 +1,90 @@
+import argparse
+
+from dotenv import load_dotenv
+
+# Imported before anything heavy so startup milestones are measured from process start
+import watergun.common.metrics  # noqa: F401
+
+from watergun.common.sender import parse_address
+
+
+def main(argv=None):
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(prog="watergun", description="Computer vision water gun control")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the tracker headless against a camera, stream, video file "
+                                                    "or recorded session")
+    run_parser.add_argument("source", help="Camera index, MJPEG/RTSP URL, video file or session directory; "
+                                           "sessions are replayed and their commands diffed")
+    run_parser.add_argument("--sprayer", type=parse_address, default=None,
+                            help="Sprayer server as host:port; angles are only computed when omitted")
+    run_parser.add_argument("--realtime", action="store_true",
+                            help="Pace files to their frame rate and drop stale live frames instead of "
+                                 "processing every frame as fast as possible")
+    run_parser.add_argument("--max-frames", type=int, default=None, help="Stop after this many frames")
+    run_parser.add_argument("--fire", action="store_true", help="Open the valve while a target is tracked")
+    run_parser.add_argument("--target-hold-time", type=float, default=5.0,
+                            help="Seconds to stay on one target before switching")
+    run_parser.add_argument("--record", metavar="DIR", help="Record frames, detections, tracks and commands "
+                                                            "into a session directory")
+
+    gui_parser = subparsers.add_parser("gui", help="Open the Tk control app")
+    gui_parser.add_argument("source", nargs="?", default="0",
+                            help="Camera index, MJPEG/RTSP URL, video file or session directory")
+    gui_parser.add_argument("--record", metavar="DIR", help="Record the session into this directory")
+
+    serve_parser = subparsers.add_parser("serve", help="Run several camera/sprayer pairs with one shared detector")
+    serve_parser.add_argument("config", help="JSON file listing the turrets")
+    serve_parser.add_argument("--max-frames", type=int, default=None,
+                              help="Stop after this many frames across all cameras")
+
+    diff_parser = subparsers.add_parser("diff", help="Compare the commands of two recorded sessions")
+    diff_parser.add_argument("expected", help="Reference session directory")
+    diff_parser.add_argument("actual", help="Session directory to check against it")
+    diff_parser.add_argument("--tolerance", type=float, default=1e-6, help="Largest pan/tilt difference in degrees "
+                                                                          "counted as a match")
+
+    export_parser = subparsers.add_parser("export", help="Export the detector and ReID models to a CPU runtime, "
+                                                          "cached in models/ for INFERENCE_BACKEND")
+    export_parser.add_argument("--backend", choices=("openvino", "onnx"), default="openvino")
+    export_parser.add_argument("--imgsz", type=int, default=640, help="Detector input size")
+    export_parser.add_argument("--int8", action="store_true", help="Quantize the detector to INT8 (openvino only)")
+    export_parser.add_argument("--calibration", metavar="SOURCE",
+                               help="Session directory or video to draw INT8 calibration frames from")
+    export_parser.add_argument("--reid", action="store_true", help="Also export the OSNet ReID model")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        from watergun.control.headless import run
+        run(args.source, sprayer=args.sprayer, realtime=args.realtime, max_frames=args.max_frames,
+            fire=args.fire, target_hold_time=args.target_hold_time, record=args.record)
+    elif args.command == "gui":
+        import tkinter as tk
+        from watergun.control.headless import parse_source
+        from watergun.control.indoor import VideoTrackingApp
+        root = tk.Tk()
+        app = VideoTrackingApp(root, parse_source(args.source), record=args.record)
+        root.mainloop()
+        app.vid.stop()
+        app.sender.close()
+        if app.pipeline.recorder is not None:
+            app.pipeline.recorder.close()
+    elif args.command == "serve":
+        from watergun.control.service import TurretService
+        TurretService.from_file(args.config).start().run(max_frames=args.max_frames)
+    elif args.command == "diff":
+        from watergun.common.session import SessionReader, diff_commands, format_diff
+        expected, actual = SessionReader(args.expected), SessionReader(args.actual)
+        print(format_diff(diff_commands(expected.commands, actual.commands, tolerance=args.tolerance)))
+    elif args.command == "export":
+        from watergun.control.backends import export_detector, export_reid
+        print(export_detector(backend=args.backend, imgsz=args.imgsz, int8=args.int8, calibration=args.calibration))
+        if args.reid:
+            print(export_reid(backend=args.backend))
+
+
+if __name__ == "__main__":
+    main()
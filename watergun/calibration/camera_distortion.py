@@ -1,23 +1,40 @@
-import cv2 
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
+import time
+
+import cv2
 import numpy as np
-def calibrate_camera():
-    # Set up camera
-    cap = cv2.VideoCapture('http://192.168.1.161:8000/stream.mjpg')
+
+from watergun.common.mjpeg import open_grabber
+
+CHESSBOARD_SIZE = (9, 6)
+SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+DEFAULT_STREAM_URL = 'http://192.168.1.161:8000/stream.mjpg'
+
+def calibrate_camera(source=None):
+    # Set up camera; the grabber keeps only the newest frame so the preview never lags behind the board
+    cap = open_grabber(source if source is not None else os.getenv('MJPG_STREAM_URL', DEFAULT_STREAM_URL)).start()
+    seq = 0
 
     # Chessboard parameters
-    chessboard_size = (9, 6)
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    chessboard_size = CHESSBOARD_SIZE
+    criteria = SUBPIX_CRITERIA
 
     # Prepare object points
-    objp = np.zeros((chessboard_size[0] * chessboard_size[1], 3), np.float32)
-    objp[:, :2] = np.mgrid[0:chessboard_size[0], 0:chessboard_size[1]].T.reshape(-1, 2)
+    objp = board_points(chessboard_size)
 
     # Arrays to store object points and image points
     objpoints = []
     imgpoints = []
+    gray = None
 
     while True:
-        ret, frame = cap.read()
+        frame, _, seq = cap.wait(seq, timeout=5.0)
+        if frame is None:
+            break
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
         # Find chessboard corners
@@ -36,14 +53,219 @@ def calibrate_camera():
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
 
-    cap.release()
+    cap.stop()
     cv2.destroyAllWindows()
+    if gray is None:
+        raise ValueError(f"No frames received from {cap.video_source}")
+    if not imgpoints:
+        raise ValueError(f"No {chessboard_size[0]}x{chessboard_size[1]} chessboard found in the frames "
+                         f"from {cap.video_source}")
 
     # Calibrate camera
     ret, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, gray.shape[::-1], None, None)
 
     # Save calibration data
     np.save('dist_calibration_data.npy', {'camera_matrix': mtx, 'dist_coeffs': dist})
-    print("Camera calibration saved to 'calibration_data.npy'")
+    print("Camera calibration saved to 'dist_calibration_data.npy'")
+
+    return mtx, dist
+
+def board_points(chessboard_size=CHESSBOARD_SIZE):
+    objp = np.zeros((chessboard_size[0] * chessboard_size[1], 3), np.float32)
+    objp[:, :2] = np.mgrid[0:chessboard_size[0], 0:chessboard_size[1]].T.reshape(-1, 2)
+    return objp
+
+def iter_gray_frames(source, step=1):
+    """
+    Yield (index, grayscale frame) from a video file or a directory of images.
+
+    :param step: only use every step-th frame; neighbouring video frames are near-duplicates
+    """
+    if os.path.isdir(source):
+        names = sorted(n for n in os.listdir(source) if n.lower().endswith(IMAGE_EXTENSIONS))
+        for index, name in enumerate(names[::step]):
+            gray = cv2.imread(os.path.join(source, name), cv2.IMREAD_GRAYSCALE)
+            if gray is not None:
+                yield index * step, gray
+        return
+
+    cap = cv2.VideoCapture(source)
+    index = 0
+    while True:
+        # grab() skips decoding the frames we are not going to use
+        if index % step:
+            if not cap.grab():
+                break
+        else:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield index, cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        index += 1
+    cap.release()
+
+def find_corners(gray, chessboard_size=CHESSBOARD_SIZE, detect_width=640):
+    """
+    Find chessboard corners on a downscaled copy, then refine them at full resolution.
+
+    findChessboardCorners is the slow part and its cost grows with image
+    size, while the downscaled estimate is well inside cornerSubPix's search
+    window, so the accuracy is the same as detecting at full resolution.
+
+    :return: corners of shape (N, 1, 2) in full-resolution pixels, or None if no board was found
+    """
+    scale = min(1.0, detect_width / gray.shape[1])
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    flags = cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE + cv2.CALIB_CB_FAST_CHECK
+    found, corners = cv2.findChessboardCorners(small, chessboard_size, flags=flags)
+    if not found:
+        return None
+    corners = corners / scale
+    # Search window grows with the downscale factor so it still covers the coarse estimate's error
+    window = int(max(5, round(2 / scale)))
+    return cv2.cornerSubPix(gray, corners.astype(np.float32), (window, window), (-1, -1), SUBPIX_CRITERIA)
+
+def _find_corners_job(job):
+    index, gray, chessboard_size, detect_width = job
+    return index, find_corners(gray, chessboard_size, detect_width)
+
+def view_bin(corners, image_size, chessboard_size=CHESSBOARD_SIZE, position_bins=4, scale_bins=3, tilt_bins=3):
+    """
+    Coarse pose/coverage signature of a detected board.
+
+    Views in the same bin show the board in about the same place, at about
+    the same size and with about the same tilt, so they add little to the
+    calibration beyond the first one.
+
+    :return: tuple usable as a dict key
+    """
+    width, height = image_size
+    points = corners.reshape(-1, 2)
+    cols, rows = chessboard_size
+    top_left, top_right = points[0], points[cols - 1]
+    bottom_left, bottom_right = points[(rows - 1) * cols], points[-1]
+
+    cx, cy = points.mean(axis=0)
+    area = cv2.contourArea(np.array([top_left, top_right, bottom_right, bottom_left], dtype=np.float32))
+    size = np.sqrt(area / (width * height))
+    # Perspective foreshortening shows up as opposite edges of different lengths
+    tilt_x = np.log(np.linalg.norm(top_right - bottom_right) / np.linalg.norm(top_left - bottom_left))
+    tilt_y = np.log(np.linalg.norm(bottom_left - bottom_right) / np.linalg.norm(top_left - top_right))
+
+    def bucket(value, lo, hi, n):
+        return int(np.clip((value - lo) / (hi - lo) * n, 0, n - 1))
+
+    return (bucket(cx, 0, width, position_bins), bucket(cy, 0, height, position_bins),
+            bucket(size, 0.1, 0.7, scale_bins),
+            bucket(tilt_x, -0.3, 0.3, tilt_bins), bucket(tilt_y, -0.3, 0.3, tilt_bins))
+
+def select_views(detections, image_size, max_views=40, chessboard_size=CHESSBOARD_SIZE):
+    """
+    Keep one view per pose/coverage bin, spread evenly over the bins if there are more than max_views.
+
+    :param detections: list of (index, corners)
+    :return: list of (index, corners)
+    """
+    by_bin = {}
+    for index, corners in detections:
+        by_bin.setdefault(view_bin(corners, image_size, chessboard_size), (index, corners))
+    views = sorted(by_bin.values(), key=lambda view: view[0])
+    if len(views) > max_views:
+        keep = np.linspace(0, len(views) - 1, max_views).round().astype(int)
+        views = [views[i] for i in keep]
+    return views
+
+def reprojection_errors(objpoints, imgpoints, mtx, dist, rvecs, tvecs):
+    """
+    :return: array of per-view RMS reprojection errors in pixels
+    """
+    errors = []
+    for objp, corners, rvec, tvec in zip(objpoints, imgpoints, rvecs, tvecs):
+        projected, _ = cv2.projectPoints(objp, rvec, tvec, mtx, dist)
+        errors.append(np.sqrt(np.mean(np.sum((projected.reshape(-1, 2) - corners.reshape(-1, 2)) ** 2, axis=1))))
+    return np.array(errors)
+
+def calibrate_camera_offline(source, step=5, max_views=40, workers=None, detect_width=640,
+                             chessboard_size=CHESSBOARD_SIZE, output='dist_calibration_data.npy'):
+    """
+    Calibrate from a recorded video or image directory instead of the live stream.
+
+    Frames are searched for the board across a process pool, near-duplicate
+    views are dropped by pose/coverage binning, and only the remaining
+    diverse views go to calibrateCamera.
+
+    :param source: video file or directory of images
+    :param step: use every step-th frame of a video
+    :param max_views: most views handed to calibrateCamera
+    :param workers: detection processes, defaults to the CPU count
+    :param detect_width: width frames are downscaled to for the board search
+    :param output: where to save the calibration, or None to skip saving
+    :return: dict with camera_matrix, dist_coeffs, rms_error, view_errors, view_indices and frame/detection counts
+    """
+    start = time.perf_counter()
+    image_size = None
+    detections = []
+    frames = 0
+
+    def collect(future):
+        index, corners = future.result()
+        if corners is not None:
+            detections.append((index, corners))
+
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Executor.map would decode and queue every frame up front; a bounded window keeps memory flat
+        pending = deque()
+        for index, gray in iter_gray_frames(source, step):
+            image_size = image_size or gray.shape[::-1]
+            frames += 1
+            if len(pending) >= 2 * workers:
+                collect(pending.popleft())
+            pending.append(pool.submit(_find_corners_job, (index, gray, chessboard_size, detect_width)))
+        while pending:
+            collect(pending.popleft())
+    if not detections:
+        raise ValueError(f"No {chessboard_size[0]}x{chessboard_size[1]} chessboard found in {frames} frames of {source}")
+
+    views = select_views(detections, image_size, max_views, chessboard_size)
+    objp = board_points(chessboard_size)
+    objpoints = [objp] * len(views)
+    imgpoints = [corners for _, corners in views]
+    rms, mtx, dist, rvecs, tvecs = cv2.calibrateCamera(objpoints, imgpoints, image_size, None, None)
+
+    result = {
+        'camera_matrix': mtx,
+        'dist_coeffs': dist,
+        'rms_error': float(rms),
+        'view_errors': reprojection_errors(objpoints, imgpoints, mtx, dist, rvecs, tvecs),
+        'view_indices': [index for index, _ in views],
+        'n_frames': frames,
+        'n_detections': len(detections),
+        'seconds': time.perf_counter() - start,
+    }
+    if output:
+        np.save(output, {'camera_matrix': mtx, 'dist_coeffs': dist})
+        print(f"Camera calibration saved to '{output}'")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chessboard camera calibration")
+    parser.add_argument("source", nargs="?",
+                        help="Video file or image directory for offline calibration; omit to use the live stream")
+    parser.add_argument("--step", type=int, default=5, help="Use every Nth video frame")
+    parser.add_argument("--max-views", type=int, default=40, help="Most views used for calibration")
+    parser.add_argument("--workers", type=int, help="Detection processes (default: CPU count)")
+    parser.add_argument("--detect-width", type=int, default=640, help="Frame width used for the board search")
+    parser.add_argument("--output", default="dist_calibration_data.npy", help="Where to save the calibration")
+    args = parser.parse_args()
 
-    return mtx, dist
\ No newline at end of file
+    if args.source is None:
+        calibrate_camera()
+    else:
+        fit = calibrate_camera_offline(args.source, step=args.step, max_views=args.max_views, workers=args.workers,
+                                       detect_width=args.detect_width, output=args.output)
+        print(f"Board found in {fit['n_detections']} of {fit['n_frames']} frames, "
+              f"calibrated on {len(fit['view_indices'])} views in {fit['seconds']:.1f}s")
+        print(f"RMS reprojection error: {fit['rms_error']:.3f} px")
+        for index, error in zip(fit['view_indices'], fit['view_errors']):
+            print(f"  frame {index:>6}: {error:.3f} px")
@@ -1,6 +1,10 @@
-from scipy.optimize import minimize
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import minimize, least_squares
 import json 
-from watergun.common import calculate_pan_tilt
+import os
+import numpy as np
+from watergun.common import CalibratedTransform, calculate_pan_tilt_batch
+from watergun.common.ballistics import BallisticTable
 'http://192.168.1.161:8000/stream.mjpg'
 
 def error_function(params, calibration_points, measured_angles):
@@ -12,11 +16,8 @@ def error_function(params, calibration_points, measured_angles):
     :param measured_angles: list of (pan, tilt) angles measured for each calibration point
     :return: total squared error
     """
-    total_error = 0
-    for (x, y, z), (measured_pan, measured_tilt) in zip(calibration_points, measured_angles):
-        calculated_pan, calculated_tilt = calculate_pan_tilt(x, y, z, params)
-        total_error += (calculated_pan - measured_pan)**2 + (calculated_tilt - measured_tilt)**2
-    return total_error
+    calculated_angles = calculate_pan_tilt_batch(calibration_points, params)
+    return np.sum((calculated_angles - np.asarray(measured_angles, dtype=np.float64))**2)
 
 def calibrate_system(calibration_points, measured_angles, initial_guess):
     """
@@ -30,6 +31,184 @@ def calibrate_system(calibration_points, measured_angles, initial_guess):
     result = minimize(error_function, initial_guess, args=(calibration_points, measured_angles),
                       method='Nelder-Mead')
     return result.x
+
+def residuals(params, calibration_points, measured_angles):
+    """
+    Per-point angle errors for all calibration points in one vectorized pass.
+
+    :param params: list of [height, initial_pan, initial_tilt, initial_roll]
+    :param calibration_points: array-like of shape (N, 3) holding (x, y, z) coordinates
+    :param measured_angles: array-like of shape (N, 2) holding measured (pan, tilt) angles
+    :return: flat array of 2N residuals in degrees, pan errors wrapped to [-180, 180)
+    """
+    diff = calculate_pan_tilt_batch(calibration_points, params) - measured_angles
+    diff[:, 0] = (diff[:, 0] + 180) % 360 - 180
+    return diff.ravel()
+
+def residual_jacobian(params, calibration_points, measured_angles, eps=1e-6):
+    """
+    Jacobian of residuals with respect to params by central differences.
+
+    Each column is two batched residual evaluations, so the cost is eight
+    vectorized passes regardless of the number of points.
+
+    :return: array of shape (2N, 4)
+    """
+    params = np.asarray(params, dtype=np.float64)
+    jac = np.empty((2 * len(calibration_points), len(params)))
+    for i in range(len(params)):
+        step = eps * max(1.0, abs(params[i]))
+        forward = params.copy()
+        backward = params.copy()
+        forward[i] += step
+        backward[i] -= step
+        jac[:, i] = (residuals(forward, calibration_points, measured_angles) -
+                     residuals(backward, calibration_points, measured_angles)) / (2 * step)
+    return jac
+
+PARAM_NAMES = ("height", "initial_pan", "initial_tilt", "initial_roll")
+BALLISTIC_PARAM_NAMES = PARAM_NAMES + ("nozzle_velocity", "drag")
+# The sprayer is mounted above the floor; a negative height mirrors the same angles
+BOUNDS = ([1e-3, -np.inf, -np.inf, -np.inf], [np.inf] * 4)
+BALLISTIC_BOUNDS = (BOUNDS[0] + [1.0, 0.0], BOUNDS[1] + [100.0, 2.0])
+
+def _at_bounds(params, bounds, names, active_mask, rtol=1e-2, atol=1e-4):
+    """
+    :return: names of the parameters on (or, since 'trf' stays strictly inside, within tolerance of) a bound;
+             the fit is degenerate if there are any
+    """
+    pinned = []
+    for name, value, lower, upper, active in zip(names, params, bounds[0], bounds[1], active_mask):
+        near = [abs(value - bound) <= atol + rtol * abs(bound) for bound in (lower, upper) if np.isfinite(bound)]
+        if active != 0 or any(near):
+            pinned.append(name)
+    return pinned
+
+def _warn_at_bounds(at_bounds):
+    if at_bounds:
+        print(f"Warning: {', '.join(at_bounds)} pinned at a bound; the calibration is likely degenerate, "
+              f"check the measured points before using it")
+
+def corrected_aic(rms_error, n_residuals, n_params):
+    """
+    Small-sample corrected Akaike information criterion of a least-squares fit; lower is better.
+
+    Extra parameters always lower the RMS, so fits with different parameter
+    counts are compared on this instead, which charges for each parameter.
+
+    :return: AICc, or inf when there are too few residuals to judge n_params parameters
+    """
+    if n_residuals - n_params - 1 <= 0:
+        return np.inf
+    rss = max(rms_error ** 2 * n_residuals, 1e-12)
+    return (n_residuals * np.log(rss / n_residuals) + 2 * n_params
+            + 2 * n_params * (n_params + 1) / (n_residuals - n_params - 1))
+
+def _fit_from_start(start, calibration_points, measured_angles):
+    start = np.array(start, dtype=np.float64)
+    start[0] = max(start[0], BOUNDS[0][0])
+    result = least_squares(residuals, start, jac=residual_jacobian, method='trf', bounds=BOUNDS,
+                           args=(calibration_points, measured_angles))
+    return result.x, result.cost, result.active_mask
+
+def _multi_start_guesses(initial_guess, n_starts, seed):
+    rng = np.random.default_rng(seed)
+    guesses = np.empty((n_starts, 4))
+    guesses[0] = initial_guess
+    guesses[1:, 0] = initial_guess[0] * rng.uniform(0.5, 2.0, n_starts - 1)
+    guesses[1:, 1:] = rng.uniform(-180, 180, (n_starts - 1, 3))
+    return guesses
+
+def calibrate_system_least_squares(calibration_points, measured_angles, initial_guess, n_starts=16,
+                                   workers=None, seed=0):
+    """
+    Fit the calibration by least squares from several starting points and keep the best.
+
+    :param calibration_points: list of (x, y, z) coordinates for calibration points
+    :param measured_angles: list of (pan, tilt) angles measured for each calibration point
+    :param initial_guess: initial guess for [height, initial_pan, initial_tilt, initial_roll]
+    :param n_starts: number of starting points, the first being initial_guess
+    :param workers: processes to spread the starts over, 1 to fit in this process
+    :param seed: seed for the random starting points
+    :return: dict with the fitted params, RMS residual in degrees, per-parameter standard deviation and
+             at_bounds, the names of parameters pinned at a bound (a warning is printed if there are any)
+    """
+    calibration_points = np.asarray(calibration_points, dtype=np.float64)
+    measured_angles = np.asarray(measured_angles, dtype=np.float64)
+    guesses = _multi_start_guesses(np.asarray(initial_guess, dtype=np.float64), max(1, n_starts), seed)
+
+    workers = workers or min(len(guesses), os.cpu_count() or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            fits = list(pool.map(_fit_from_start, guesses,
+                                 [calibration_points] * len(guesses), [measured_angles] * len(guesses)))
+    else:
+        fits = [_fit_from_start(g, calibration_points, measured_angles) for g in guesses]
+
+    params, cost, active_mask = min(fits, key=lambda fit: fit[1])
+    params[1:] = (params[1:] + 180) % 360 - 180
+
+    # Covariance from the Gauss-Newton approximation, scaled by the residual variance
+    jac = residual_jacobian(params, calibration_points, measured_angles)
+    dof = max(1, jac.shape[0] - jac.shape[1])
+    residual_variance = 2 * cost / dof
+    covariance = np.linalg.pinv(jac.T @ jac) * residual_variance
+    at_bounds = _at_bounds(params, BOUNDS, PARAM_NAMES, active_mask)
+    _warn_at_bounds(at_bounds)
+
+    return {
+        "params": params,
+        "rms_error": float(np.sqrt(2 * cost / jac.shape[0])),
+        "stddev": np.sqrt(np.abs(np.diag(covariance))),
+        "n_points": len(calibration_points),
+        "n_starts": len(guesses),
+        "at_bounds": at_bounds,
+    }
+
+# Coarser than the table used for aiming; it is rebuilt on every residual evaluation
+FIT_TABLE_OPTIONS = dict(range_step=0.05, n_heights=8, n_elevations=361, dt=0.01)
+
+def ballistic_residuals(params, calibration_points, measured_angles):
+    """
+    Per-point angle errors when aiming along the water's arc instead of a straight ray.
+
+    :param params: list of [height, initial_pan, initial_tilt, initial_roll, nozzle_velocity, drag]
+    :return: flat array of 2N residuals in degrees, pan errors wrapped to [-180, 180)
+    """
+    ballistics = BallisticTable.build(params[0], params[4], params[5], **FIT_TABLE_OPTIONS)
+    diff = CalibratedTransform(params[:4], ballistics=ballistics).pan_tilt(calibration_points) - measured_angles
+    diff[:, 0] = (diff[:, 0] + 180) % 360 - 180
+    return diff.ravel()
+
+def calibrate_system_ballistic(calibration_points, measured_angles, initial_guess, velocity_guess=10.0,
+                               drag_guess=0.05):
+    """
+    Refine a straight-ray calibration with the nozzle exit velocity and drag of a ballistic stream.
+
+    :param initial_guess: [height, initial_pan, initial_tilt, initial_roll], usually the straight-ray fit
+    :param velocity_guess: starting nozzle exit velocity in m/s
+    :param drag_guess: starting quadratic drag coefficient in 1/m
+    :return: dict with the fitted params [height, initial_pan, initial_tilt, initial_roll, nozzle_velocity, drag],
+             the RMS residual in degrees and at_bounds, the names of parameters pinned at a bound
+    """
+    calibration_points = np.asarray(calibration_points, dtype=np.float64)
+    measured_angles = np.asarray(measured_angles, dtype=np.float64)
+    start = np.array([max(initial_guess[0], BOUNDS[0][0]), *initial_guess[1:4], velocity_guess, drag_guess])
+    # Residuals come through an interpolated table, so finite differences need steps wider than its grid
+    result = least_squares(ballistic_residuals, start, method='trf', diff_step=1e-3,
+                           bounds=BALLISTIC_BOUNDS,
+                           args=(calibration_points, measured_angles))
+    params = result.x
+    params[1:4] = (params[1:4] + 180) % 360 - 180
+    at_bounds = _at_bounds(params, BALLISTIC_BOUNDS, BALLISTIC_PARAM_NAMES, result.active_mask)
+    _warn_at_bounds(at_bounds)
+    return {
+        "params": params,
+        "rms_error": float(np.sqrt(2 * result.cost / len(result.fun))),
+        "n_points": len(calibration_points),
+        "at_bounds": at_bounds,
+    }
+
 if __name__ == "__main__":
     calibration_points = [
         (1, 1, 0),
@@ -45,7 +224,11 @@ if __name__ == "__main__":
     ]
     initial_guess = [1.5, 0, 0, 0]
 
-    calibrated_params = calibrate_system(calibration_points, measured_angles, initial_guess)
+    fit = calibrate_system_least_squares(calibration_points, measured_angles, initial_guess)
+    calibrated_params = fit["params"]
+    print(f"Fit RMS error over {fit['n_points']} points: {fit['rms_error']:.3f} deg")
+    for name, value, stddev in zip(PARAM_NAMES, calibrated_params, fit["stddev"]):
+        print(f"  {name}: {value:.4f} +/- {stddev:.4f}")
     
     # Save calibration results
     calibration_results = {
@@ -54,7 +237,31 @@ if __name__ == "__main__":
         "initial_tilt": calibrated_params[2],
         "initial_roll": calibrated_params[3]
     }
-    
+
+    # The straight-ray fit absorbs the water's drop into the mount angles; a ballistic fit separates them
+    ballistic_fit = calibrate_system_ballistic(calibration_points, measured_angles, calibrated_params)
+    print(f"Ballistic fit RMS error: {ballistic_fit['rms_error']:.3f} deg "
+          f"(nozzle velocity {ballistic_fit['params'][4]:.2f} m/s, drag {ballistic_fit['params'][5]:.4f} 1/m)")
+    # Six parameters always fit 2N residuals at least as well as four; only switch if the gain pays for them
+    n_residuals = 2 * fit["n_points"]
+    straight_aic = corrected_aic(fit["rms_error"], n_residuals, len(PARAM_NAMES))
+    ballistic_aic = corrected_aic(ballistic_fit["rms_error"], n_residuals, len(BALLISTIC_PARAM_NAMES))
+    print(f"AICc straight {straight_aic:.2f}, ballistic {ballistic_aic:.2f}")
+    if ballistic_fit["at_bounds"]:
+        print("Keeping the straight-ray fit: the ballistic fit has parameters pinned at a bound")
+    elif ballistic_aic >= straight_aic:
+        print("Keeping the straight-ray fit: the ballistic fit's extra parameters are not justified by the data")
+    else:
+        height, initial_pan, initial_tilt, initial_roll, nozzle_velocity, drag = ballistic_fit["params"]
+        calibration_results = {
+            "height": height,
+            "initial_pan": initial_pan,
+            "initial_tilt": initial_tilt,
+            "initial_roll": initial_roll,
+            "nozzle_velocity": nozzle_velocity,
+            "drag": drag,
+        }
+
     with open("calibration_results.json", "w") as f:
         json.dump(calibration_results, f)
     
@@ -7,6 +7,19 @@ def pixel_to_meter(pixel_x, pixel_y, perspective_transform):
     meter_x, meter_y, _ = meter_homogeneous.ravel() / meter_homogeneous[2]
     return meter_x, meter_y
 
+def pixels_to_meters(pixels, perspective_transform):
+    """
+    Vectorized pixel_to_meter for many points at once.
+
+    :param pixels: array-like of shape (N, 2) holding (pixel_x, pixel_y) pairs
+    :param perspective_transform: 3x3 homography from pixels to floor coordinates
+    :return: array of shape (N, 2) holding (meter_x, meter_y) pairs
+    """
+    pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+    M = np.asarray(perspective_transform, dtype=np.float64)
+    projected = pixels @ M[:, :2].T + M[:, 2]
+    return projected[:, :2] / projected[:, 2:3]
+
 def rotation_matrix(roll, pitch, yaw):
     """
     Create a rotation matrix from roll, pitch, and yaw angles.
@@ -60,4 +73,82 @@ def calculate_pan_tilt(x, y, z, params):
     pan_angle = np.arctan2(y_rot, x_rot)
     tilt_angle = np.arctan2(np.sqrt(x_rot**2 + y_rot**2), -z_rot) - np.pi/2
     
-    return np.degrees(pan_angle), np.degrees(tilt_angle)
\ No newline at end of file
+    return np.degrees(pan_angle), np.degrees(tilt_angle)
+
+def calculate_pan_tilt_batch(points, params):
+    """
+    Vectorized calculate_pan_tilt for many target points at once.
+
+    :param points: array-like of shape (N, 3) holding (x, y, z), or (N, 2) for points on the floor (z = 0)
+    :param params: list of [height, initial_pan, initial_tilt, initial_roll]
+    :return: array of shape (N, 2) holding (pan_angle, tilt_angle) in degrees
+    """
+    return CalibratedTransform(params).pan_tilt(points)
+
+class CalibratedTransform:
+    """
+    Calibrated mapping from floor points (or pixels) to sprayer pan/tilt angles.
+
+    The rotation matrix depends only on the calibration, so it is built once here
+    instead of on every call like calculate_pan_tilt does.
+    """
+
+    def __init__(self, params, perspective_transform=None, undistorter=None, ballistics=None):
+        """
+        :param params: list of [height, initial_pan, initial_tilt, initial_roll]
+        :param perspective_transform: optional 3x3 homography from pixels to floor coordinates
+        :param undistorter: optional Undistorter applied to raw pixels before the homography
+        :param ballistics: optional BallisticTable; aims along the stream's launch direction instead of a straight ray
+        """
+        self.params = [float(p) for p in params]
+        h, init_pan, init_tilt, init_roll = self.params
+        self.height = h
+        # Row vectors times R equal R.T applied to column vectors
+        self.R = rotation_matrix(np.radians(init_roll), np.radians(init_tilt), np.radians(init_pan))
+        self.perspective_transform = perspective_transform
+        self.undistorter = undistorter
+        self.ballistics = ballistics
+
+    @classmethod
+    def from_results(cls, calibration_results, perspective_transform=None, undistorter=None, ballistics=None):
+        """
+        Build a transform from the dict stored in calibration_results.json.
+        """
+        return cls([calibration_results["height"],
+                    calibration_results["initial_pan"],
+                    calibration_results["initial_tilt"],
+                    calibration_results["initial_roll"]], perspective_transform, undistorter, ballistics)
+
+    def pan_tilt(self, points):
+        """
+        :param points: array-like of shape (N, 3) holding (x, y, z), or (N, 2) for points on the floor (z = 0)
+        :return: array of shape (N, 2) holding (pan_angle, tilt_angle) in degrees
+        """
+        points = np.asarray(points, dtype=np.float64)
+        points = points.reshape(-1, points.shape[-1])
+        target_vectors = np.empty((len(points), 3))
+        target_vectors[:, :2] = points[:, :2]
+        target_vectors[:, 2] = (points[:, 2] if points.shape[1] > 2 else 0.0) - self.height
+        if self.ballistics is not None:
+            # Same azimuth, but tilted to the launch elevation whose arc comes down on the target
+            horizontal = np.hypot(target_vectors[:, 0], target_vectors[:, 1])
+            elevation = self.ballistics.elevation(horizontal, target_vectors[:, 2])
+            target_vectors[:, :2] *= (np.cos(elevation) / np.maximum(horizontal, 1e-9))[:, None]
+            target_vectors[:, 2] = np.sin(elevation)
+
+        rotated = target_vectors @ self.R
+        x_rot, y_rot, z_rot = rotated[:, 0], rotated[:, 1], rotated[:, 2]
+
+        angles = np.empty((len(points), 2))
+        angles[:, 0] = np.arctan2(y_rot, x_rot)
+        angles[:, 1] = np.arctan2(np.hypot(x_rot, y_rot), -z_rot) - np.pi/2
+        return np.degrees(angles, out=angles)
+
+    def pixels_to_pan_tilt(self, pixels):
+        """
+        :param pixels: array-like of shape (N, 2) holding raw (pixel_x, pixel_y) pairs
+        :return: array of shape (N, 2) holding (pan_angle, tilt_angle) in degrees
+        """
+        if self.undistorter is not None:
+            pixels = self.undistorter.points(pixels)
+        return self.pan_tilt(pixels_to_meters(pixels, self.perspective_transform))
@@ -0,0 +1,191 @@
+import hashlib
+import os
+
+import numpy as np
+
+GRAVITY = 9.81
+# Bump when the table layout or the integration changes so stale caches are rebuilt
+BALLISTIC_TABLE_VERSION = 1
+
+
+def simulate_trajectories(elevations, velocity, drag, dt=0.005, max_time=10.0, min_z=-10.0):
+    """
+    Integrate water-stream trajectories for many launch elevations at once.
+
+    The stream is treated as a point mass with quadratic air drag,
+    dv/dt = -g z - drag * |v| v, integrated with fixed-step RK4 in the
+    vertical plane through the target.
+
+    :param elevations: array of launch angles above horizontal in radians
+    :param velocity: nozzle exit velocity in m/s
+    :param drag: quadratic drag coefficient in 1/m (0 for a vacuum parabola)
+    :param dt: integration step in seconds
+    :param max_time: stop integrating after this many seconds
+    :param min_z: stop once every trajectory has dropped below this height relative to the nozzle
+    :return: tuple of (x, z) arrays of shape (steps, len(elevations)), horizontal distance and height from the nozzle
+    """
+    elevations = np.asarray(elevations, dtype=np.float64)
+    state = np.zeros((4, len(elevations)))
+    state[2] = velocity * np.cos(elevations)
+    state[3] = velocity * np.sin(elevations)
+
+    def derivative(s):
+        speed = np.hypot(s[2], s[3])
+        return np.stack([s[2], s[3], -drag * speed * s[2], -GRAVITY - drag * speed * s[3]])
+
+    xs = [state[0].copy()]
+    zs = [state[1].copy()]
+    for _ in range(int(max_time / dt)):
+        k1 = derivative(state)
+        k2 = derivative(state + dt / 2 * k1)
+        k3 = derivative(state + dt / 2 * k2)
+        k4 = derivative(state + dt * k3)
+        state = state + dt / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        xs.append(state[0].copy())
+        zs.append(state[1].copy())
+        if state[1].max() < min_z:
+            break
+    return np.array(xs), np.array(zs)
+
+
+def landing_ranges(xs, zs, heights):
+    """
+    Horizontal distance at which each trajectory comes down through each height.
+
+    :param xs: horizontal distances from simulate_trajectories, shape (steps, n)
+    :param zs: heights from simulate_trajectories, shape (steps, n)
+    :param heights: target heights relative to the nozzle, shape (m,)
+    :return: array of shape (m, n), NaN where a trajectory never reaches that height
+    """
+    steps, n = zs.shape
+    columns = np.arange(n)
+    ranges = np.full((len(heights), n), np.nan)
+    for i, height in enumerate(heights):
+        above = zs >= height
+        # Last step still at or above the height; the descending crossing is between it and the next step
+        last = steps - 1 - np.argmax(above[::-1], axis=0)
+        valid = above.any(axis=0) & (last < steps - 1)
+        last = np.minimum(last, steps - 2)
+        z0, z1 = zs[last, columns], zs[last + 1, columns]
+        x0, x1 = xs[last, columns], xs[last + 1, columns]
+        fraction = np.clip((z0 - height) / np.where(z0 != z1, z0 - z1, 1.0), 0.0, 1.0)
+        ranges[i] = np.where(valid, x0 + (x1 - x0) * fraction, np.nan)
+    return ranges
+
+
+class BallisticTable:
+    """
+    Precomputed (target height, range) -> launch elevation for one nozzle.
+
+    Each row covers one target height relative to the nozzle and holds the
+    flat-trajectory elevation that lands the stream at each range. Targets
+    beyond the nozzle's reach get the maximum-range elevation. Lookups
+    interpolate bilinearly, so aiming many targets needs no root finding.
+    """
+
+    def __init__(self, table, heights, range_step, params):
+        """
+        :param table: array of shape (len(heights), n_ranges) holding elevations in radians
+        :param heights: ascending target heights relative to the nozzle in meters
+        :param range_step: spacing in meters between table columns, starting at 0
+        :param params: (nozzle_height, velocity, drag) the table was built for
+        """
+        self.table = np.asarray(table)
+        self.heights = np.asarray(heights, dtype=np.float64)
+        self.range_step = float(range_step)
+        self.params = tuple(float(p) for p in params)
+        self.max_range_index = self.table.shape[1] - 1
+
+    @classmethod
+    def build(cls, nozzle_height, velocity, drag, range_step=0.02, n_heights=16, height_margin=2.0,
+              n_elevations=721, dt=0.005):
+        """
+        Integrate one trajectory per launch elevation and invert range(elevation) for every table height.
+
+        :param nozzle_height: nozzle height above the floor in meters
+        :param velocity: nozzle exit velocity in m/s
+        :param drag: quadratic drag coefficient in 1/m
+        :param range_step: table spacing in meters
+        :param n_heights: number of target heights, spanning the floor to height_margin above the nozzle
+        :param n_elevations: launch elevations simulated between straight down and straight up
+        :return: BallisticTable
+        """
+        elevations = np.linspace(-np.pi / 2, np.pi / 2, n_elevations)[1:-1]
+        heights = np.linspace(-nozzle_height - height_margin / 2, height_margin, n_heights)
+        xs, zs = simulate_trajectories(elevations, velocity, drag, dt=dt, min_z=heights[0])
+        ranges = landing_ranges(xs, zs, heights)
+
+        max_range = np.nanmax(ranges) if np.isfinite(ranges).any() else range_step
+        grid = np.arange(0.0, max_range + range_step, range_step)
+        table = np.empty((len(heights), len(grid)))
+        for i, row in enumerate(ranges):
+            reachable = np.flatnonzero(np.isfinite(row))
+            if len(reachable) == 0:
+                table[i] = np.nan
+                continue
+            # Flat branch only: from the lowest elevation that reaches this height up to the one with the longest range
+            first = reachable[0]
+            peak = first + np.nanargmax(row[first:])
+            branch_ranges = np.maximum.accumulate(np.nan_to_num(row[first:peak + 1], nan=0.0))
+            table[i] = np.interp(grid, branch_ranges, elevations[first:peak + 1])
+        # Heights nothing reaches take the row below, so lookups never return NaN
+        for i in range(1, len(heights)):
+            if np.isnan(table[i]).all():
+                table[i] = table[i - 1]
+        return cls(table.astype(np.float32), heights, range_step, (nozzle_height, velocity, drag))
+
+    @classmethod
+    def load_or_build(cls, nozzle_height, velocity, drag, cache_dir='.'):
+        """
+        Load a cached table for these parameters, otherwise build and cache it next to the calibration.
+
+        :return: BallisticTable
+        """
+        params = (float(nozzle_height), float(velocity), float(drag))
+        h = hashlib.sha1(f"v{BALLISTIC_TABLE_VERSION}:".encode())
+        h.update(np.asarray(params, dtype=np.float64).tobytes())
+        path = os.path.join(cache_dir, f"ballistic_table_{h.hexdigest()[:16]}.npz")
+
+        if os.path.exists(path):
+            try:
+                data = np.load(path)
+                return cls(data['table'], data['heights'], float(data['range_step']), params)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ignoring unreadable ballistic table {path}: {e}")
+
+        table = cls.build(*params)
+        try:
+            tmp_path = path + ".tmp.npz"
+            np.savez(tmp_path, table=table.table, heights=table.heights, range_step=table.range_step)
+            os.replace(tmp_path, path)
+            print(f"Ballistic table saved to {path}")
+        except OSError as e:
+            print(f"Failed to cache ballistic table: {e}")
+        return table
+
+    @classmethod
+    def from_results(cls, calibration_results, cache_dir='.'):
+        """
+        :return: BallisticTable for the nozzle in calibration_results.json, or None if it was fitted without one
+        """
+        if "nozzle_velocity" not in calibration_results:
+            return None
+        return cls.load_or_build(calibration_results["height"], calibration_results["nozzle_velocity"],
+                                 calibration_results.get("drag", 0.0), cache_dir)
+
+    def elevation(self, ranges, heights):
+        """
+        :param ranges: array of horizontal distances from the nozzle in meters
+        :param heights: array of target heights relative to the nozzle in meters
+        :return: array of launch elevations in radians
+        """
+        gx = np.clip(np.asarray(ranges, dtype=np.float64) / self.range_step, 0, self.max_range_index)
+        gy = np.interp(heights, self.heights, np.arange(len(self.heights)))
+        c0 = np.minimum(gx.astype(np.intp), max(self.max_range_index - 1, 0))
+        r0 = np.minimum(gy.astype(np.intp), len(self.heights) - 2)
+        c1 = np.minimum(c0 + 1, self.max_range_index)
+        fx = gx - c0
+        fy = gy - r0
+        top = self.table[r0, c0] + (self.table[r0, c1] - self.table[r0, c0]) * fx
+        bottom = self.table[r0 + 1, c0] + (self.table[r0 + 1, c1] - self.table[r0 + 1, c0]) * fx
+        return top + (bottom - top) * fy
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import cv2
+
+from watergun.common.metrics import METRICS
+
+def is_live_source(source):
+    """
+    :return: True for cameras and streams, False for video files, which end instead of dropping out
+    """
+    return isinstance(source, int) or "://" in str(source) or str(source).startswith("/dev/")
+
+class FrameGrabber:
+    """
+    Read frames from a cv2.VideoCapture source on a background thread.
+
+    Only the newest frame is kept. Each frame is stamped with its capture time
+    (time.monotonic) and a sequence number, so consumers can skip work on frames
+    they have already seen and measure how old a frame is. Frames that are
+    overwritten before anyone reads them are counted as dropped. Cameras and
+    streams are reopened when they stop delivering frames; a video file ends,
+    after which wait() returns no frame.
+    """
+
+    def __init__(self, video_source=0, reconnect_delay=1.0):
+        """
+        :param video_source: camera index, video file path or stream URL
+        :param reconnect_delay: seconds to wait before reopening a source that stopped delivering frames
+        """
+        self.video_source = video_source
+        self.reconnect_delay = reconnect_delay
+        self._open()
+        METRICS.milestone("camera_opened")
+
+        self._lock = threading.Lock()
+        self._new_frame = threading.Condition(self._lock)
+        self._frame = None
+        self._timestamp = 0.0
+        self._seq = 0
+        self._last_read_seq = 0
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        # Optional threading.Event set on every new frame, for consumers waiting on several grabbers at once
+        self.frame_event = None
+
+        self._running = False
+        self._thread = None
+
+    def _open(self):
+        self.vid = cv2.VideoCapture(self.video_source)
+        self.frame_width = int(self.vid.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.frame_height = int(self.vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
+
+    def _close(self):
+        self.vid.release()
+
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="FrameGrabber", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        self._close()
+
+    def _run(self):
+        while self._running:
+            read_start = time.perf_counter()
+            ret, frame = self.vid.read()
+            if not ret and not is_live_source(self.video_source):
+                # End of file: let wait() return None once the last frame has been read
+                with self._lock:
+                    self._running = False
+                    self._new_frame.notify_all()
+                return
+            if not ret:
+                # Network streams drop out; reopen instead of spinning on a dead capture
+                self.vid.release()
+                time.sleep(self.reconnect_delay)
+                if self._running:
+                    self.vid = cv2.VideoCapture(self.video_source)
+                continue
+
+            timestamp = time.monotonic()
+            METRICS.record("capture", time.perf_counter() - read_start)
+            self._publish(frame, timestamp)
+
+    def _publish(self, frame, timestamp):
+        with self._lock:
+            if self._seq > self._last_read_seq:
+                self.frames_dropped += 1
+            self._frame = frame
+            self._timestamp = timestamp
+            self._seq += 1
+            self.frames_captured += 1
+            self._new_frame.notify_all()
+        if self.frame_event is not None:
+            self.frame_event.set()
+
+    def read(self):
+        """
+        Return the newest frame without blocking.
+
+        :return: tuple of (frame, timestamp, seq); frame is None until the first capture
+        """
+        with self._lock:
+            self._last_read_seq = self._seq
+            return self._frame, self._timestamp, self._seq
+
+    def wait(self, after_seq=0, timeout=None):
+        """
+        Block until a frame newer than after_seq is available.
+
+        :param after_seq: sequence number of the last frame the caller processed
+        :param timeout: maximum seconds to wait, None to wait forever
+        :return: tuple of (frame, timestamp, seq); frame is None on timeout or after stop()
+        """
+        with self._lock:
+            self._new_frame.wait_for(lambda: self._seq > after_seq or not self._running, timeout)
+            if self._seq <= after_seq:
+                return None, 0.0, self._seq
+            self._last_read_seq = self._seq
+            return self._frame, self._timestamp, self._seq
+
+    def jpeg(self, seq):
+        """
+        :return: the source's own JPEG bytes for frame seq, or None if it has none (cv2.VideoCapture decodes
+                 internally), so a recorder has to encode the frame itself
+        """
+        return None
+
+    def stats(self):
+        return {
+            "captured": self.frames_captured,
+            "dropped": self.frames_dropped,
+            "seq": self._seq,
+        }
@@ -0,0 +1,59 @@
+import numpy as np
+
+
+class DetectionFilter:
+    """
+    Turn detector results into the (N, 6) float32 array the trackers take.
+
+    Each result's boxes are copied to the host once as x1, y1, x2, y2, conf,
+    cls rows and filtered with NumPy masks on area, confidence and class,
+    instead of touching the tensors box by box. Rows are written into a
+    buffer that is reused (and grown when needed) across calls, so the array
+    returned by one call is overwritten by the next.
+    """
+
+    def __init__(self, frame_width, frame_height, min_area_fraction=0.003, max_area_fraction=0.9,
+                 min_confidence=0.0, classes=None):
+        """
+        :param frame_width: width of the camera frames in pixels
+        :param frame_height: height of the camera frames in pixels
+        :param min_area_fraction: smallest box area kept, as a fraction of the frame
+        :param max_area_fraction: largest box area kept, as a fraction of the frame
+        :param min_confidence: lowest detector confidence kept
+        :param classes: iterable of class ids to keep, None for all
+        """
+        total_area = frame_width * frame_height
+        self.min_area = min_area_fraction * total_area
+        self.max_area = max_area_fraction * total_area
+        self.min_confidence = min_confidence
+        self.classes = None if classes is None else np.asarray(list(classes), dtype=np.float32)
+        self.buffer = np.empty((64, 6), dtype=np.float32)
+
+    def __call__(self, results):
+        """
+        :param results: iterable of ultralytics Results (anything with boxes.data)
+        :return: float32 array of shape (M, 6), a view into the reused buffer
+        """
+        count = 0
+        for r in results:
+            data = r.boxes.data.cpu().numpy()
+            if len(data) == 0:
+                continue
+            data = data[:, :6]
+
+            area = (data[:, 2] - data[:, 0]) * (data[:, 3] - data[:, 1])
+            keep = (area >= self.min_area) & (area <= self.max_area)
+            if self.min_confidence > 0:
+                keep &= data[:, 4] >= self.min_confidence
+            if self.classes is not None:
+                keep &= np.isin(data[:, 5], self.classes)
+
+            kept = np.count_nonzero(keep)
+            if count + kept > len(self.buffer):
+                grown = np.empty((max(2 * len(self.buffer), count + kept), 6), dtype=np.float32)
+                grown[:count] = self.buffer[:count]
+                self.buffer = grown
+            np.compress(keep, data, axis=0, out=self.buffer[count:count + kept])
+            count += kept
+
+        return self.buffer[:count]
@@ -1,41 +1,178 @@
-import cv2 
-import os 
-def draw_crosshair_on_floor():
-    pass
+from collections import OrderedDict
+import cv2
+import numpy as np
+import os
+
+CROSSHAIR_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets', 'crosshair.png')
+
 def load_image(file_path, max_size=100):
     img = cv2.imread(file_path, cv2.IMREAD_UNCHANGED)
     if img is None:
         print(f"Failed to load image: {file_path}")
         return None
-    
+
     h, w = img.shape[:2]
     if max(h, w) > max_size:
         scale = max_size / max(h, w)
         img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
         print(f"Resized image to fit within {max_size}x{max_size}")
-    
+
     return img
 
-crosshair_img = load_image('/Users/walkenz1/Projects/WatGn/WaterGun/assets/crosshair.png')
-def draw_crosshair(frame, center_x, center_y):
-    ch_height, ch_width = crosshair_img.shape[:2]
-    x_offset = int(center_x - ch_width // 2)
-    y_offset = int(center_y - ch_height // 2)
+def premultiply(img):
+    """
+    Split a BGR(A) image into premultiplied BGR and 3-channel inverse alpha, both uint8.
+
+    Blending is then frame * inv_alpha / 255 + premultiplied, which needs no
+    per-channel loop or float conversion of the frame.
+    """
+    if img.shape[2] == 4:
+        alpha = img[:, :, 3:4]
+    else:
+        alpha = np.full(img.shape[:2] + (1,), 255, dtype=np.uint8)
+    alpha3 = np.repeat(alpha, 3, axis=2)
+    premultiplied = cv2.multiply(np.ascontiguousarray(img[:, :, :3]), alpha3, scale=1 / 255.0)
+    return premultiplied, 255 - alpha3
 
+def blend(frame, x_offset, y_offset, premultiplied, inv_alpha):
+    """
+    Composite a premultiplied sprite onto frame in place with its top-left corner at (x_offset, y_offset).
+    Parts of the sprite outside the frame are clipped.
+    """
+    sprite_height, sprite_width = premultiplied.shape[:2]
     x_start = max(0, x_offset)
     y_start = max(0, y_offset)
-    x_end = min(frame.shape[1], x_offset + ch_width)
-    y_end = min(frame.shape[0], y_offset + ch_height)
+    x_end = min(frame.shape[1], x_offset + sprite_width)
+    y_end = min(frame.shape[0], y_offset + sprite_height)
+    if x_end <= x_start or y_end <= y_start:
+        return frame
+
+    sprite_rows = slice(y_start - y_offset, y_end - y_offset)
+    sprite_cols = slice(x_start - x_offset, x_end - x_offset)
+    roi = frame[y_start:y_end, x_start:x_end]
+    # uint8 fixed point: saturating multiply-with-scale then add, both SIMD in OpenCV
+    roi[:] = cv2.add(cv2.multiply(roi, inv_alpha[sprite_rows, sprite_cols], scale=1 / 255.0),
+                     premultiplied[sprite_rows, sprite_cols])
+    return frame
+
+class CrosshairCompositor:
+    """
+    Draws the crosshair sprite onto frames.
+
+    The image is loaded on first use, from CROSSHAIR_FILE in the environment
+    or the copy shipped in watergun/assets. Premultiplied sprites are cached
+    per scale, and sprites warped onto the floor plane are cached per offset,
+    so a steady aim point costs one small blend per frame.
+    """
+
+    def __init__(self, file_path=None, max_size=100, warp_cache_size=256):
+        """
+        :param file_path: crosshair image with alpha, defaults to $CROSSHAIR_FILE or the packaged asset
+        :param max_size: longest side in pixels of the sprite at scale 1.0
+        :param warp_cache_size: number of floor-warped sprites to keep
+        """
+        self.file_path = file_path
+        self.max_size = max_size
+        self.warp_cache_size = warp_cache_size
+        self._image = None
+        self._load_failed = False
+        self._sprites = {}
+        self._warped = OrderedDict()
+
+    @property
+    def image(self):
+        if self._image is None and not self._load_failed:
+            path = self.file_path or os.getenv('CROSSHAIR_FILE')
+            if not path or not os.path.exists(path):
+                path = CROSSHAIR_FILE
+            self._image = load_image(path, self.max_size)
+            self._load_failed = self._image is None
+        return self._image
+
+    def sprite(self, scale=1.0):
+        """
+        :return: tuple of (premultiplied BGR, inverse alpha) for the crosshair at this scale, or None without an image
+        """
+        sprite = self._sprites.get(scale)
+        if sprite is None:
+            img = self.image
+            if img is None:
+                return None
+            if scale != 1.0:
+                img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            sprite = self._sprites[scale] = premultiply(img)
+        return sprite
+
+    def draw(self, frame, center_x, center_y, scale=1.0):
+        sprite = self.sprite(scale)
+        if sprite is None:
+            return frame
+        premultiplied, inv_alpha = sprite
+        ch_height, ch_width = premultiplied.shape[:2]
+        return blend(frame, int(center_x - ch_width // 2), int(center_y - ch_height // 2), premultiplied, inv_alpha)
+
+    def draw_on_floor(self, frame, floor_corners, offset_x=0, offset_y=0, scale=1.0):
+        """
+        Draw the crosshair lying on the floor plane, as if the whole frame were projected onto floor_corners
+        with the crosshair at its centre shifted by (offset_x, offset_y) pixels.
+
+        Only the sprite is warped, into the small bounding box where it lands,
+        and the result is cached for this offset.
+        """
+        h, w = frame.shape[:2]
+        key = (w, h, int(offset_x), int(offset_y), scale, np.asarray(floor_corners).tobytes())
+        warped = self._warped.get(key)
+        if warped is None:
+            warped = self._warp_to_floor(w, h, floor_corners, int(offset_x), int(offset_y), scale)
+            self._warped[key] = warped
+            if len(self._warped) > self.warp_cache_size:
+                self._warped.popitem(last=False)
+        else:
+            self._warped.move_to_end(key)
+        if warped is not None:
+            blend(frame, *warped)
+        return frame
+
+    def _warp_to_floor(self, w, h, floor_corners, offset_x, offset_y, scale):
+        sprite = self.sprite(scale)
+        if sprite is None:
+            return None
+        premultiplied, inv_alpha = sprite
+        ch_height, ch_width = premultiplied.shape[:2]
+
+        # Same mapping as warping a full-frame canvas with the sprite centred on it
+        dst_pts = np.asarray(floor_corners, dtype=np.float32)
+        src_pts = np.array([[0, 0], [w-1, 0], [w-1, h-1], [0, h-1]], dtype=np.float32)
+        src_pts += dst_pts.mean(axis=0) - src_pts.mean(axis=0) + np.array([offset_x, offset_y], dtype=np.float32)
+        M = cv2.getPerspectiveTransform(src_pts, dst_pts)
+        sprite_to_canvas = np.array([[1, 0, (w - ch_width) // 2], [0, 1, (h - ch_height) // 2], [0, 0, 1]],
+                                    dtype=np.float64)
+        A = M @ sprite_to_canvas
+
+        corners = np.array([[[0, 0], [ch_width, 0], [ch_width, ch_height], [0, ch_height]]], dtype=np.float64)
+        landed = cv2.perspectiveTransform(corners, A)[0]
+        x0, y0 = np.maximum(np.floor(landed.min(axis=0)).astype(int), 0)
+        x1, y1 = np.minimum(np.ceil(landed.max(axis=0)).astype(int) + 1, [w, h])
+        if x1 <= x0 or y1 <= y0:
+            return None
+
+        A = np.array([[1, 0, -x0], [0, 1, -y0], [0, 0, 1]], dtype=np.float64) @ A
+        # Warp premultiplied colour and alpha together so the edges interpolate correctly
+        premultiplied_bgra = np.dstack([premultiplied, 255 - inv_alpha[:, :, :1]])
+        warped = cv2.warpPerspective(premultiplied_bgra, A, (int(x1 - x0), int(y1 - y0)))
+        warped_inv_alpha = np.repeat(255 - warped[:, :, 3:4], 3, axis=2)
+        return int(x0), int(y0), np.ascontiguousarray(warped[:, :, :3]), warped_inv_alpha
+
+_compositor = None
 
-    ch_x_start = x_start - x_offset
-    ch_y_start = y_start - y_offset
-    ch_x_end = ch_x_start + (x_end - x_start)
-    ch_y_end = ch_y_start + (y_end - y_start)
+def get_compositor():
+    global _compositor
+    if _compositor is None:
+        _compositor = CrosshairCompositor()
+    return _compositor
 
-    if x_end > x_start and y_end > y_start:
-        alpha_s = crosshair_img[ch_y_start:ch_y_end, ch_x_start:ch_x_end, 3] / 255.0
-        alpha_l = 1.0 - alpha_s
+def draw_crosshair(frame, center_x, center_y, scale=1.0):
+    return get_compositor().draw(frame, center_x, center_y, scale)
 
-        for c in range(0, 3):
-            frame[y_start:y_end, x_start:x_end, c] = (alpha_s * crosshair_img[ch_y_start:ch_y_end, ch_x_start:ch_x_end, c] +
-                                                        alpha_l * frame[y_start:y_end, x_start:x_end, c])
+def draw_crosshair_on_floor(frame, floor_corners, offset_x=0, offset_y=0, scale=1.0):
+    return get_compositor().draw_on_floor(frame, floor_corners, offset_x, offset_y, scale)
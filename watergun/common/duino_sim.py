@@ -0,0 +1,154 @@
+import math
+import os
+import select
+import threading
+import time
+import tty
+
+from watergun.common.protocol import ACK_BYTE, READY_BYTE, CommandDecoder
+from watergun.common.serial_transport import ARDUINO_RX_BUFFER
+
+# Mirrors the #defines in duino/duino.ino
+PAN_GEAR_RATIO = 1.0
+TILT_GEAR_RATIO = 1.0
+PAN_ZERO_OFFSET = 0
+TILT_ZERO_OFFSET = 0.0
+MIN_ANGLE = 0
+MAX_ANGLE = 180
+
+
+def _constrain(value, low, high):
+    return max(low, min(high, value))
+
+
+def _firmware_round(angle):
+    # handleFrame() rounds centidegrees half away from zero with integer math
+    centidegrees = int(round(angle * 100))
+    return int(math.copysign((abs(centidegrees) + 50) // 100, centidegrees))
+
+
+class DuinoSimulator:
+    """
+    Python model of duino/duino.ino for testing the serial path without hardware.
+
+    It parses binary frames and ASCII lines the way the firmware does, clamps
+    servo angles, tracks the H-bridge pins, and replies with READY_BYTE and
+    ACK_BYTE. attach_pty() serves it on a pseudo-terminal, so a SerialTransport
+    or the sprayer server can open it like a real /dev/ttyACM0. Every applied
+    command is recorded in `actuations` with the time it took effect.
+    """
+
+    def __init__(self, send_acks=True):
+        self.send_acks = send_acks
+        self.decoder = CommandDecoder()
+
+        self.pan_servo = 90
+        self.tilt_servo = 90
+        self.h_bridge_direction = True
+        self.h_bridge_pins = (0, 0)
+        self.last_trigger = False
+        self.last_red_button = False
+
+        self.actuations = []
+        self.stats = {"commands": 0, "rx_overflow_bytes": 0}
+
+        self._master_fd = None
+        self._slave_fd = None
+        self._thread = None
+        self._running = False
+
+    def handle_bytes(self, data):
+        """
+        Feed received bytes through the firmware's parser.
+
+        :return: bytes the firmware would send back
+        """
+        reply = bytearray()
+        stale = self.decoder.stats["stale"]
+        commands = self.decoder.feed(data)
+        if self.send_acks:
+            # The firmware acknowledges stale frames it drops too, so the host's in-flight count stays in step
+            reply.extend(bytes([ACK_BYTE]) * (self.decoder.stats["stale"] - stale))
+        for command in commands:
+            if command.seq is None:
+                # ASCII lines go through (int)atof(), which truncates
+                pan, tilt = int(command.pan), int(command.tilt)
+            else:
+                pan, tilt = _firmware_round(command.pan), _firmware_round(command.tilt)
+            self.update_outputs(pan, tilt, command.trigger, command.red_button)
+            self.actuations.append((time.monotonic(), self.pan_servo, self.tilt_servo,
+                                    self.h_bridge_pins, command.seq, command.timestamp_ms))
+            self.stats["commands"] += 1
+            if self.send_acks:
+                reply.append(ACK_BYTE)
+        return bytes(reply)
+
+    def update_outputs(self, pan_angle, tilt_angle, trigger, red_button):
+        self.pan_servo = int(_constrain(pan_angle * PAN_GEAR_RATIO + PAN_ZERO_OFFSET, MIN_ANGLE, MAX_ANGLE))
+        self.tilt_servo = int(_constrain(tilt_angle * TILT_GEAR_RATIO + TILT_ZERO_OFFSET, MIN_ANGLE, MAX_ANGLE))
+
+        if red_button and not self.last_red_button:
+            self.h_bridge_direction = not self.h_bridge_direction
+            self._update_h_bridge()
+        self.last_red_button = red_button
+
+        if trigger and not self.last_trigger:
+            self._update_h_bridge()
+        elif not trigger and self.last_trigger:
+            self.h_bridge_pins = (0, 0)
+        self.last_trigger = trigger
+
+    def _update_h_bridge(self):
+        self.h_bridge_pins = (1, 0) if self.h_bridge_direction else (0, 1)
+
+    def attach_pty(self, baudrate=115200, boot_time=0.0):
+        """
+        Serve the simulator on a new pseudo-terminal.
+
+        :param baudrate: wire speed to emulate; each byte costs 10 bit times
+        :param boot_time: seconds before READY_BYTE is sent, like the Arduino bootloader
+        :return: path of the pty to open as the serial port
+        """
+        self._master_fd, self._slave_fd = os.openpty()
+        tty.setraw(self._master_fd)
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, args=(baudrate, boot_time),
+                                        name="DuinoSimulator", daemon=True)
+        self._thread.start()
+        return os.ttyname(self._slave_fd)
+
+    def _serve(self, baudrate, boot_time):
+        byte_time = 10.0 / baudrate
+        booted_at = time.monotonic() + boot_time
+        booted = False
+        while self._running:
+            timeout = max(0.0, booted_at - time.monotonic()) if not booted else 0.05
+            readable, _, _ = select.select([self._master_fd], [], [], timeout)
+            if not booted and time.monotonic() >= booted_at:
+                booted = True
+                os.write(self._master_fd, bytes([READY_BYTE]))
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master_fd, 4096)
+            except OSError:
+                break
+            if not booted:
+                continue  # The bootloader eats anything sent before the sketch starts
+            if len(data) > ARDUINO_RX_BUFFER:
+                # Bytes that arrived faster than loop() drained them overflow the 64-byte buffer
+                self.stats["rx_overflow_bytes"] += len(data) - ARDUINO_RX_BUFFER
+                data = data[:ARDUINO_RX_BUFFER]
+            time.sleep(len(data) * byte_time)
+            reply = self.handle_bytes(data)
+            if reply:
+                os.write(self._master_fd, reply)
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+        for fd in (self._master_fd, self._slave_fd):
+            if fd is not None:
+                os.close(fd)
+        self._master_fd = self._slave_fd = None
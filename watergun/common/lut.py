@@ -0,0 +1,141 @@
+import hashlib
+import os
+
+import numpy as np
+
+# Bump when the table layout or the math behind it changes so stale caches are rebuilt
+LUT_VERSION = 1
+
+
+def calibration_hash(transform, frame_width, frame_height, step):
+    """
+    Hash everything a pan/tilt table depends on.
+
+    :param transform: CalibratedTransform with a perspective transform attached
+    :param frame_width: width of the camera frame in pixels
+    :param frame_height: height of the camera frame in pixels
+    :param step: pixel spacing between table samples
+    :return: hex digest used to key the cache file
+    """
+    h = hashlib.sha1()
+    h.update(f"v{LUT_VERSION}:{frame_width}x{frame_height}:{step}:".encode())
+    h.update(np.asarray(transform.params, dtype=np.float64).tobytes())
+    h.update(np.asarray(transform.perspective_transform, dtype=np.float64).tobytes())
+    if transform.ballistics is not None:
+        h.update(np.asarray(transform.ballistics.params, dtype=np.float64).tobytes())
+    if transform.undistorter is not None:
+        h.update(transform.undistorter.camera_matrix.tobytes())
+        h.update(transform.undistorter.dist_coeffs.tobytes())
+    return h.hexdigest()[:16]
+
+
+class PanTiltTable:
+    """
+    Precomputed pixel -> (pan, tilt) table for one camera/sprayer calibration.
+
+    With step=1 every pixel has its own entry and a lookup is a single index.
+    Lens undistortion, when the transform has it, is folded into the table,
+    so aiming at a raw pixel costs the same with or without it.
+    With a larger step the table holds a grid of samples and lookups
+    interpolate bilinearly between the four surrounding samples.
+    """
+
+    def __init__(self, table, step=1):
+        """
+        :param table: array of shape (rows, cols, 2) holding (pan, tilt) in degrees
+        :param step: pixel spacing between table samples
+        """
+        # A plain ndarray view of a memmap still reads from the mapped file but indexes without np.memmap overhead
+        self.table = np.asarray(table)
+        self.step = step
+        self.max_row = table.shape[0] - 1
+        self.max_col = table.shape[1] - 1
+
+    @classmethod
+    def build(cls, transform, frame_width, frame_height, step=1):
+        """
+        Evaluate the transform on a pixel grid in one vectorized pass.
+
+        :param transform: CalibratedTransform with a perspective transform attached
+        :return: PanTiltTable
+        """
+        xs = np.arange(0, frame_width - 1 + step, step, dtype=np.float64)
+        ys = np.arange(0, frame_height - 1 + step, step, dtype=np.float64)
+        grid = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 2)
+        table = transform.pixels_to_pan_tilt(grid).astype(np.float32)
+        return cls(table.reshape(len(ys), len(xs), 2), step)
+
+    @classmethod
+    def load_or_build(cls, transform, frame_width, frame_height, step=1, cache_dir=None):
+        """
+        Memory-map a cached table if one matches the calibration, otherwise build and cache it.
+
+        :param cache_dir: directory for cached tables, defaults to $PAN_TILT_LUT_DIR or models/
+        :return: PanTiltTable
+        """
+        cache_dir = cache_dir or os.getenv('PAN_TILT_LUT_DIR', 'models')
+        key = calibration_hash(transform, frame_width, frame_height, step)
+        path = os.path.join(cache_dir, f"pan_tilt_lut_{key}.npy")
+
+        if os.path.exists(path):
+            try:
+                return cls(np.load(path, mmap_mode='r'), step)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable pan/tilt table {path}: {e}")
+
+        lut = cls.build(transform, frame_width, frame_height, step)
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = path + ".tmp.npy"
+            np.save(tmp_path, lut.table)
+            os.replace(tmp_path, path)
+            print(f"Pan/tilt table saved to {path}")
+        except OSError as e:
+            print(f"Failed to cache pan/tilt table: {e}")
+        return lut
+
+    def lookup(self, pixel_x, pixel_y):
+        """
+        :return: tuple of (pan_angle, tilt_angle) in degrees
+        """
+        if self.step == 1:
+            # Plain indexing; going through lookup_many's array machinery costs ~30x more for one point
+            col = min(max(int(round(pixel_x)), 0), self.max_col)
+            row = min(max(int(round(pixel_y)), 0), self.max_row)
+            pan, tilt = self.table[row, col].tolist()
+            return pan, tilt
+        pan, tilt = self.lookup_many([(pixel_x, pixel_y)])[0]
+        return float(pan), float(tilt)
+
+    def lookup_many(self, pixels):
+        """
+        :param pixels: array-like of shape (N, 2) holding (pixel_x, pixel_y) pairs
+        :return: array of shape (N, 2) holding (pan_angle, tilt_angle) in degrees
+        """
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+        if self.step == 1:
+            cols = np.clip(np.rint(pixels[:, 0]).astype(np.intp), 0, self.max_col)
+            rows = np.clip(np.rint(pixels[:, 1]).astype(np.intp), 0, self.max_row)
+            return np.asarray(self.table[rows, cols], dtype=np.float64)
+
+        gx = np.clip(pixels[:, 0] / self.step, 0, self.max_col)
+        gy = np.clip(pixels[:, 1] / self.step, 0, self.max_row)
+        c0 = np.minimum(gx.astype(np.intp), self.max_col - 1)
+        r0 = np.minimum(gy.astype(np.intp), self.max_row - 1)
+        fx = (gx - c0)[:, None]
+        fy = (gy - r0)[:, None]
+
+        q00 = np.asarray(self.table[r0, c0], dtype=np.float64)
+        q01 = np.asarray(self.table[r0, c0 + 1], dtype=np.float64)
+        q10 = np.asarray(self.table[r0 + 1, c0], dtype=np.float64)
+        q11 = np.asarray(self.table[r0 + 1, c0 + 1], dtype=np.float64)
+
+        # Pan wraps at +/-180; bring the neighbours onto the same branch as q00 before blending
+        for q in (q01, q10, q11):
+            q[:, 0] = q00[:, 0] + (q[:, 0] - q00[:, 0] + 180) % 360 - 180
+
+        top = q00 + (q01 - q00) * fx
+        bottom = q10 + (q11 - q10) * fx
+        result = top + (bottom - top) * fy
+        result[:, 0] = (result[:, 0] + 180) % 360 - 180
+        return result
@@ -0,0 +1,212 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+STAGES = ("capture", "inference", "tracking", "transform", "send", "display")
+# Upper bucket bounds in seconds, ten per decade from 0.1ms to 1s so quantile estimates stay within ~25%;
+# anything slower lands in the overflow bucket
+BUCKET_BOUNDS = tuple(round(10 ** (e / 10), 7) for e in range(-40, 1))
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram.
+
+    Several threads can record the same stage (one capture thread per
+    camera, one sender thread per sprayer), so updates take a lock; it is
+    uncontended in the common single-writer case.
+    """
+
+    def __init__(self, bounds=BUCKET_BOUNDS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        bucket = bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def snapshot(self):
+        """
+        :return: tuple of (bucket counts, count, sum)
+        """
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    def quantile(self, q):
+        """
+        Estimate a quantile by linear interpolation inside the bucket that contains it.
+
+        :return: seconds, or None without samples
+        """
+        counts, count, _ = self.snapshot()
+        if count == 0:
+            return None
+        rank = q * count
+        seen = 0
+        for i, n in enumerate(counts):
+            if n and seen + n >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.bounds[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+
+class Metrics:
+    """
+    Per-stage timing histograms for the capture -> inference -> tracking -> transform -> send -> display path.
+
+    Shared process-wide as METRICS. Stages are timed with time.perf_counter
+    via record() or the timer() context manager. summary() feeds the debug
+    overlay and the periodic log line, and prometheus() feeds the optional
+    HTTP endpoint.
+
+    Startup milestones (first frame, models warmed, first aim, ...) are
+    recorded once each by milestone(), in seconds since METRICS was created,
+    which is early in process startup since watergun.__main__ imports it first.
+    """
+
+    def __init__(self, stages=STAGES, bounds=BUCKET_BOUNDS):
+        self.bounds = bounds
+        self.histograms = {stage: Histogram(bounds) for stage in stages}
+        self.started = time.monotonic()
+        self.milestones = {}
+        self.last_log_time = self.started
+        self._server = None
+
+    def histogram(self, stage):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms.setdefault(stage, Histogram(self.bounds))
+        return histogram
+
+    def record(self, stage, seconds):
+        self.histogram(stage).record(seconds)
+
+    def timer(self, stage):
+        return _StageTimer(self.histogram(stage))
+
+    def milestone(self, name):
+        """
+        Record and print the first time startup reaches `name`; later calls for the same name do nothing.
+
+        :return: seconds since startup when the milestone was first reached
+        """
+        elapsed = self.milestones.get(name)
+        if elapsed is None:
+            elapsed = self.milestones.setdefault(name, time.monotonic() - self.started)
+            print(f"Startup: {name} after {elapsed:.2f}s")
+        return elapsed
+
+    def summary(self):
+        """
+        :return: dict of stage -> dict with count, mean, p50 and p99 in milliseconds, for stages with samples
+        """
+        summary = {}
+        for stage, histogram in self.histograms.items():
+            _, count, total = histogram.snapshot()
+            if count:
+                summary[stage] = {
+                    "count": count,
+                    "mean_ms": total / count * 1000,
+                    "p50_ms": histogram.quantile(0.5) * 1000,
+                    "p99_ms": histogram.quantile(0.99) * 1000,
+                }
+        return summary
+
+    def summary_line(self):
+        return " ".join(f"{stage}={s['p50_ms']:.1f}/{s['p99_ms']:.1f}ms"
+                        for stage, s in self.summary().items()) or "no samples"
+
+    def maybe_log(self, interval):
+        """
+        Print a one-line p50/p99 summary if at least `interval` seconds passed since the last one.
+        """
+        now = time.monotonic()
+        if interval > 0 and now - self.last_log_time >= interval:
+            self.last_log_time = now
+            print(f"Stage timings p50/p99: {self.summary_line()}")
+
+    def prometheus(self):
+        """
+        :return: all histograms in the Prometheus text exposition format
+        """
+        lines = ["# HELP watergun_stage_seconds Time spent per pipeline stage.",
+                 "# TYPE watergun_stage_seconds histogram"]
+        for stage, histogram in self.histograms.items():
+            counts, count, total = histogram.snapshot()
+            cumulative = 0
+            for bound, n in zip(histogram.bounds, counts):
+                cumulative += n
+                lines.append(f'watergun_stage_seconds_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            lines.append(f'watergun_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'watergun_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'watergun_stage_seconds_count{{stage="{stage}"}} {count}')
+        if self.milestones:
+            lines += ["# HELP watergun_startup_seconds Seconds from startup until each milestone was reached.",
+                      "# TYPE watergun_startup_seconds gauge"]
+            for name, elapsed in list(self.milestones.items()):
+                lines.append(f'watergun_startup_seconds{{milestone="{name}"}} {elapsed:.3f}')
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serve prometheus() at http://host:port/metrics from a daemon thread. Binds to localhost by default.
+
+        :return: the bound (host, port)
+        """
+        if self._server is not None:
+            return self._server.server_address
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+        print(f"Metrics served at http://{host}:{self._server.server_address[1]}/metrics")
+        return self._server.server_address
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _StageTimer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+
+METRICS = Metrics()
@@ -0,0 +1,237 @@
+import http.client
+import os
+import time
+import urllib.request
+
+import cv2
+import numpy as np
+
+from watergun.common.capture import FrameGrabber
+from watergun.common.metrics import METRICS
+
+# Decode flags for each supported downscale; libjpeg skips the work for the dropped resolution
+DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+def decode_jpeg(jpeg, scale=1):
+    """
+    :param jpeg: JPEG bytes
+    :param scale: 1, 2, 4 or 8; the frame is decoded at 1/scale of its width and height
+    :return: BGR frame
+    """
+    if scale not in DECODE_FLAGS:
+        raise ValueError(f"Unsupported decode scale {scale}, expected one of {sorted(DECODE_FLAGS)}")
+    frame = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), DECODE_FLAGS[scale])
+    if frame is None:
+        raise ValueError("Corrupt JPEG")
+    return frame
+
+
+def is_mjpeg_url(source):
+    return isinstance(source, str) and source.startswith(("http://", "https://"))
+
+
+class MJPEGReader(FrameGrabber):
+    """
+    FrameGrabber for multipart MJPEG over HTTP that never decodes frames nobody reads.
+
+    The background thread parses the multipart stream itself and only keeps
+    the newest part's JPEG bytes, so stale frames cost a memory copy rather
+    than a full decode. read() and wait() decode on demand, once per frame,
+    optionally at 1/2, 1/4 or 1/8 scale with libjpeg's reduced-size decode,
+    which is several times cheaper than decoding at full size and resizing.
+    frame_width and frame_height are the decoded size. Dropped connections
+    are reopened after `reconnect_delay`.
+    """
+
+    def __init__(self, url, scale=1, reconnect_delay=1.0, timeout=5.0):
+        """
+        :param url: stream URL, e.g. http://192.168.1.161:8000/stream.mjpg
+        :param scale: decode frames at 1/scale resolution, one of 1, 2, 4, 8
+        :param reconnect_delay: seconds to wait before reconnecting a dropped stream
+        :param timeout: socket timeout in seconds
+        """
+        if scale not in DECODE_FLAGS:
+            raise ValueError(f"Unsupported decode scale {scale}, expected one of {sorted(DECODE_FLAGS)}")
+        self.scale = scale
+        self.timeout = timeout
+        self.reconnects = 0
+        self.bytes_received = 0
+        self._response = None
+        self._boundary = None
+        self._at_part_headers = False
+        self._decoded_seq = 0
+        self._decoded = None
+        self._decoded_jpeg = None
+        super().__init__(url, reconnect_delay)
+
+    def _open(self):
+        # Like cv2.VideoCapture, connect up front and look at the first frame to learn the frame size
+        self.vid = None
+        self.frame_width = self.frame_height = 0
+        try:
+            self._connect()
+            jpeg = self._next_part()
+            if jpeg is not None:
+                self.frame_height, self.frame_width = decode_jpeg(jpeg, self.scale).shape[:2]
+        except (OSError, ValueError, http.client.HTTPException) as e:
+            print(f"Failed to open MJPEG stream {self.video_source}: {e}")
+            self._disconnect()
+
+    def _close(self):
+        self._disconnect()
+
+    def _connect(self):
+        self._response = urllib.request.urlopen(self.video_source, timeout=self.timeout)
+        content_type = self._response.headers.get_content_type()
+        boundary = self._response.headers.get_param("boundary")
+        if not content_type.startswith("multipart/") or not boundary:
+            self._disconnect()
+            raise ValueError(f"Not a multipart stream: {content_type}")
+        # Some servers put the leading dashes in the header, most don't
+        self._boundary = boundary.encode() if boundary.startswith("--") else b"--" + boundary.encode()
+        self._at_part_headers = False
+
+    def _disconnect(self):
+        if self._response is not None:
+            try:
+                self._response.close()
+            except OSError:
+                pass
+            self._response = None
+
+    def _next_part(self):
+        """
+        Read the next part from the stream.
+
+        :return: the part's body (JPEG bytes), or None if the stream ended
+        """
+        response = self._response
+        if not self._at_part_headers:
+            # Skip to the boundary; anything before it is a preamble or the previous part's trailing CRLF
+            while True:
+                line = response.readline()
+                if not line:
+                    return None
+                if line.rstrip().startswith(self._boundary):
+                    break
+
+        length = None
+        while True:
+            line = response.readline()
+            if not line:
+                return None
+            line = line.strip()
+            if not line:
+                break
+            name, _, value = line.partition(b":")
+            if name.strip().lower() == b"content-length":
+                length = int(value)
+
+        if length is not None:
+            data = response.read(length)
+            self._at_part_headers = False
+            self.bytes_received += len(data)
+            return data if len(data) == length else None
+
+        # Without a Content-Length the part runs until the next boundary line
+        chunks = []
+        while True:
+            line = response.readline()
+            if not line:
+                return None
+            if line.rstrip().startswith(self._boundary):
+                self._at_part_headers = True
+                break
+            chunks.append(line)
+        data = b"".join(chunks)
+        if data.endswith(b"\r\n"):
+            data = data[:-2]
+        self.bytes_received += len(data)
+        return data
+
+    def _run(self):
+        while self._running:
+            read_start = time.perf_counter()
+            try:
+                if self._response is None:
+                    self._connect()
+                jpeg = self._next_part()
+                if jpeg is None:
+                    raise ConnectionError("stream ended")
+            except (OSError, ValueError, http.client.HTTPException):
+                # Network streams drop out; reconnect instead of spinning on a dead socket
+                self._disconnect()
+                time.sleep(self.reconnect_delay)
+                self.reconnects += 1
+                continue
+            METRICS.record("capture", time.perf_counter() - read_start)
+            self._publish(jpeg, time.monotonic())
+
+    def _decode(self, jpeg, seq):
+        # read() and wait() come from one consumer thread, so a one-entry cache needs no lock
+        if jpeg is None:
+            return None
+        if seq != self._decoded_seq:
+            with METRICS.timer("decode"):
+                try:
+                    self._decoded = decode_jpeg(jpeg, self.scale)
+                except ValueError:
+                    self._decoded = None
+            self._decoded_seq = seq
+            self._decoded_jpeg = jpeg
+        return self._decoded
+
+    def read(self):
+        """
+        Decode and return the newest frame without blocking.
+
+        :return: tuple of (frame, timestamp, seq); frame is None until the first capture
+        """
+        jpeg, timestamp, seq = super().read()
+        return self._decode(jpeg, seq), timestamp, seq
+
+    def wait(self, after_seq=0, timeout=None):
+        jpeg, timestamp, seq = super().wait(after_seq, timeout)
+        return self._decode(jpeg, seq), timestamp, seq
+
+    def read_jpeg(self):
+        """
+        :return: tuple of (JPEG bytes, timestamp, seq) of the newest frame, without decoding it
+        """
+        return super().read()
+
+    def jpeg(self, seq):
+        """
+        :return: the received JPEG bytes of frame seq if it was the last one decoded, None otherwise or when
+                 decoding at reduced scale (the bytes would not match the frame size)
+        """
+        if self.scale != 1 or seq != self._decoded_seq:
+            return None
+        return self._decoded_jpeg
+
+    def stats(self):
+        stats = super().stats()
+        stats["reconnects"] = self.reconnects
+        stats["bytes"] = self.bytes_received
+        return stats
+
+
+def open_grabber(source):
+    """
+    Open a frame grabber for a camera, file or stream.
+
+    With MJPEG_READER=1, http(s) sources use MJPEGReader, decoded at
+    1/MJPEG_DECODE_SCALE resolution; everything else uses FrameGrabber.
+    Floor corners are in the pixels of the frames they were clicked on, so
+    keep the scale the same between picking them and tracking. The grabber
+    is not started.
+    """
+    if is_mjpeg_url(source) and os.getenv('MJPEG_READER', '0') == '1':
+        return MJPEGReader(source, scale=int(os.getenv('MJPEG_DECODE_SCALE', 1)))
+    return FrameGrabber(source)
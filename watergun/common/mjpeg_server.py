@@ -0,0 +1,142 @@
+"""
+Local MJPEG test server, a stand-in for the Pi camera's stream.mjpg.
+
+    python -m watergun.common.mjpeg_server recording.mp4 --fps 30 --port 8000
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import cv2
+
+
+def encode_frames(frames, quality=90):
+    """
+    :param frames: iterable of BGR frames
+    :return: list of JPEG bytes
+    """
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    jpegs = []
+    for frame in frames:
+        ok, jpeg = cv2.imencode(".jpg", frame, params)
+        if ok:
+            jpegs.append(jpeg.tobytes())
+    return jpegs
+
+
+def read_video(path, max_frames=None):
+    vid = cv2.VideoCapture(path)
+    frames = []
+    while max_frames is None or len(frames) < max_frames:
+        ret, frame = vid.read()
+        if not ret:
+            break
+        frames.append(frame)
+    vid.release()
+    return frames
+
+
+class MJPEGTestServer:
+    """
+    Serve a loop of JPEG frames as multipart/x-mixed-replace, the way the Pi's picamera server does.
+
+    Frames are encoded once up front so serving costs no CPU beyond the
+    socket writes. Every client gets its own paced loop. `drop_after` closes
+    each connection after that many frames, to exercise reconnects, and
+    `content_length=False` leaves out the per-part Content-Length header that
+    some cameras omit.
+    """
+
+    def __init__(self, jpegs, fps=30.0, host="127.0.0.1", port=0, boundary="FRAME", content_length=True,
+                 drop_after=None):
+        """
+        :param jpegs: list of JPEG bytes, e.g. from encode_frames()
+        :param fps: frames per second per client, 0 to send as fast as the socket allows
+        :param port: port to listen on, 0 for any free port
+        :param drop_after: close each connection after this many frames, None to stream forever
+        """
+        if not jpegs:
+            raise ValueError("No frames to serve")
+        self.jpegs = jpegs
+        self.fps = fps
+        self.boundary = boundary
+        self.content_length = content_length
+        self.drop_after = drop_after
+        self.frames_sent = 0
+        self.connections = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/stream.mjpg"):
+                    self.send_error(404)
+                    return
+                server.connections += 1
+                self.send_response(200)
+                self.send_header("Age", "0")
+                self.send_header("Cache-Control", "no-cache, private")
+                self.send_header("Pragma", "no-cache")
+                self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={server.boundary}")
+                self.end_headers()
+                server._stream(self.wfile)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/stream.mjpg"
+
+    def _stream(self, wfile):
+        interval = 1.0 / self.fps if self.fps > 0 else 0.0
+        next_time = time.monotonic()
+        sent = 0
+        try:
+            while self.drop_after is None or sent < self.drop_after:
+                jpeg = self.jpegs[sent % len(self.jpegs)]
+                headers = f"--{self.boundary}\r\nContent-Type: image/jpeg\r\n"
+                if self.content_length:
+                    headers += f"Content-Length: {len(jpeg)}\r\n"
+                wfile.write(headers.encode() + b"\r\n" + jpeg + b"\r\n")
+                sent += 1
+                self.frames_sent += 1
+                if interval:
+                    next_time += interval
+                    time.sleep(max(0.0, next_time - time.monotonic()))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="MJPEGTestServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a video file as an MJPEG stream")
+    parser.add_argument("video", help="Video file whose frames are looped")
+    parser.add_argument("--fps", type=float, default=30.0, help="Frames per second, 0 for unthrottled")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality")
+    args = parser.parse_args()
+
+    server = MJPEGTestServer(encode_frames(read_video(args.video), args.quality), fps=args.fps, host=args.host,
+                             port=args.port).start()
+    print(f"Serving {len(server.jpegs)} frames at {server.url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.close()
@@ -0,0 +1,190 @@
+"""
+Sprayer command wire formats.
+
+Binary frame (version 1, 16 bytes, little-endian):
+
+    offset  size  field
+    0       1     magic (0xA5)
+    1       1     version (1)
+    2       2     sequence number (uint16, wraps)
+    4       4     client timestamp in ms (uint32, wraps)
+    8       2     pan in centidegrees (int16)
+    10      2     tilt in centidegrees (int16)
+    12      1     flags (bit 0 trigger, bit 1 red button)
+    13      1     reserved (0)
+    14      2     Fletcher-16 checksum of bytes 0-13
+
+The ASCII format "pan,tilt,trigger,red_button\\n" is still accepted everywhere
+as a fallback. The magic byte is not printable ASCII, so a decoder can tell
+the two apart from the first byte of each message.
+
+The firmware talks back with single bytes: READY_BYTE once after boot and
+ACK_BYTE after each command it applied.
+"""
+import struct
+import time
+from collections import namedtuple
+
+MAGIC = 0xA5
+VERSION = 1
+FRAME_SIZE = 16
+
+FLAG_TRIGGER = 0x01
+FLAG_RED_BUTTON = 0x02
+
+READY_BYTE = ord("R")
+ACK_BYTE = ord("K")
+
+_BODY = struct.Struct("<BBHIhhBB")
+_CHECKSUM = struct.Struct("<H")
+
+Command = namedtuple("Command", ["pan", "tilt", "trigger", "red_button", "seq", "timestamp_ms"])
+
+
+def fletcher16(data):
+    sum1 = 0
+    sum2 = 0
+    for byte in data:
+        sum1 = (sum1 + byte) % 255
+        sum2 = (sum2 + sum1) % 255
+    return (sum2 << 8) | sum1
+
+
+def timestamp_ms():
+    return int(time.monotonic() * 1000) & 0xFFFFFFFF
+
+
+def _centidegrees(angle):
+    return max(-32768, min(32767, int(round(angle * 100))))
+
+
+def encode_command(pan, tilt, trigger, red_button=False, seq=0, timestamp=None):
+    """
+    Pack a command into a binary frame.
+
+    :param pan: pan angle in degrees
+    :param tilt: tilt angle in degrees
+    :param trigger: truthy to open the valve
+    :param red_button: truthy to flip the H-bridge direction
+    :param seq: sequence number, taken modulo 2**16
+    :param timestamp: client timestamp in ms, defaults to the monotonic clock
+    :return: FRAME_SIZE bytes
+    """
+    if timestamp is None:
+        timestamp = timestamp_ms()
+    flags = (FLAG_TRIGGER if trigger else 0) | (FLAG_RED_BUTTON if red_button else 0)
+    body = _BODY.pack(MAGIC, VERSION, seq & 0xFFFF, timestamp & 0xFFFFFFFF,
+                      _centidegrees(pan), _centidegrees(tilt), flags, 0)
+    return body + _CHECKSUM.pack(fletcher16(body))
+
+
+def encode_ascii_command(pan, tilt, trigger, red_button=False):
+    """
+    Format a command in the legacy "pan,tilt,trigger,red_button" line format.
+    """
+    return f"{pan},{tilt},{1 if trigger else 0},{1 if red_button else 0}\n".encode()
+
+
+def decode_frame(frame):
+    """
+    :param frame: FRAME_SIZE bytes
+    :return: Command, or None if the magic, version or checksum don't match
+    """
+    magic, version, seq, timestamp, pan, tilt, flags, _ = _BODY.unpack_from(frame)
+    if magic != MAGIC or version != VERSION:
+        return None
+    if _CHECKSUM.unpack_from(frame, _BODY.size)[0] != fletcher16(frame[:_BODY.size]):
+        return None
+    return Command(pan / 100.0, tilt / 100.0, bool(flags & FLAG_TRIGGER), bool(flags & FLAG_RED_BUTTON),
+                   seq, timestamp)
+
+
+def decode_ascii_line(line):
+    """
+    :param line: bytes of one "pan,tilt,trigger,red_button" line without the newline
+    :return: Command with seq and timestamp_ms set to None, or None if the line is malformed
+    """
+    # Like the firmware, only printable lines are parsed, so frame garbage can't become angles
+    if any(b != 0x0D and not 0x20 <= b <= 0x7E for b in line):
+        return None
+    try:
+        fields = line.decode("ascii").strip().split(",")
+        pan, tilt = float(fields[0]), float(fields[1])
+        trigger = len(fields) > 2 and int(float(fields[2])) != 0
+        red_button = len(fields) > 3 and int(float(fields[3])) != 0
+    except (UnicodeDecodeError, ValueError, IndexError):
+        return None
+    return Command(pan, tilt, trigger, red_button, None, None)
+
+
+def seq_newer(seq, last_seq):
+    """
+    True if seq comes after last_seq, allowing for 16-bit wraparound.
+    """
+    return 0 < ((seq - last_seq) & 0xFFFF) < 0x8000
+
+
+class CommandDecoder:
+    """
+    Incremental decoder for a byte stream that may mix binary frames and ASCII lines.
+
+    TCP and serial reads can split or merge messages, so bytes are buffered
+    until a whole message is available. Corrupt frames are skipped by
+    resynchronising on the next magic byte or newline. Binary commands whose
+    sequence number is not newer than the last one are counted and dropped;
+    sequence number 0 always starts a new session so a restarted sender is
+    not mistaken for a stale one.
+    """
+
+    def __init__(self, drop_stale=True):
+        self.drop_stale = drop_stale
+        self.buffer = bytearray()
+        self.last_seq = None
+        self.stats = {"binary": 0, "ascii": 0, "corrupt": 0, "stale": 0}
+
+    def feed(self, data):
+        """
+        :param data: bytes just received
+        :return: list of Commands completed by this data, oldest first
+        """
+        self.buffer += data
+        commands = []
+        buf = self.buffer
+        while buf:
+            if buf[0] == MAGIC:
+                if len(buf) < FRAME_SIZE:
+                    break
+                command = decode_frame(bytes(buf[:FRAME_SIZE]))
+                if command is None:
+                    self.stats["corrupt"] += 1
+                    del buf[0]
+                    continue
+                del buf[:FRAME_SIZE]
+                if (self.drop_stale and self.last_seq is not None and command.seq != 0
+                        and not seq_newer(command.seq, self.last_seq)):
+                    self.stats["stale"] += 1
+                    continue
+                self.last_seq = command.seq
+                self.stats["binary"] += 1
+                commands.append(command)
+            else:
+                end = buf.find(b"\n")
+                magic = buf.find(bytes([MAGIC]))
+                if 0 <= magic and (end < 0 or magic < end):
+                    # Garbage in front of a binary frame
+                    self.stats["corrupt"] += 1
+                    del buf[:magic]
+                    continue
+                if end < 0:
+                    break
+                line = bytes(buf[:end])
+                del buf[:end + 1]
+                if not line.strip():
+                    continue
+                command = decode_ascii_line(line)
+                if command is None:
+                    self.stats["corrupt"] += 1
+                    continue
+                self.stats["ascii"] += 1
+                commands.append(command)
+        return commands
@@ -0,0 +1,67 @@
+import cv2
+import numpy as np
+
+
+class FloorROI:
+    """
+    Crop frames to the floor polygon before running the detector.
+
+    The sprayer can only hit targets standing on the floor, so pixels outside
+    the floor polygon's bounding box are wasted inference work. People's feet
+    are on the floor but the rest of them is above it, so `padding` grows the
+    box (mostly useful upwards) to keep whole bodies in view.
+    """
+
+    def __init__(self, floor_corners, frame_width, frame_height, padding=0, mask=False):
+        """
+        :param floor_corners: array of shape (N, 2) with the floor polygon in pixels
+        :param frame_width: width of the camera frame in pixels
+        :param frame_height: height of the camera frame in pixels
+        :param padding: pixels added around the polygon's bounding box
+        :param mask: if True, blank out pixels outside the (padded) polygon as well
+        """
+        corners = np.asarray(floor_corners, dtype=np.int32).reshape(-1, 2)
+        x, y, w, h = cv2.boundingRect(corners)
+        self.x0 = max(0, x - padding)
+        self.y0 = max(0, y - padding)
+        self.x1 = min(frame_width, x + w + padding)
+        self.y1 = min(frame_height, y + h + padding)
+
+        self.mask = None
+        if mask:
+            polygon = corners - [self.x0, self.y0]
+            self.mask = np.zeros((self.y1 - self.y0, self.x1 - self.x0, 1), dtype=np.uint8)
+            cv2.fillPoly(self.mask, [polygon], 1)
+            if padding:
+                kernel = np.ones((2 * padding + 1, 2 * padding + 1), dtype=np.uint8)
+                self.mask = cv2.dilate(self.mask, kernel)[:, :, None]
+            self._masked = None
+
+    @property
+    def offset(self):
+        return self.x0, self.y0
+
+    def crop(self, frame):
+        """
+        :param frame: full camera frame
+        :return: view (or masked copy) of the region the detector should see
+        """
+        roi = frame[self.y0:self.y1, self.x0:self.x1]
+        if self.mask is None:
+            return roi
+        if self._masked is None or self._masked.shape != roi.shape:
+            self._masked = np.empty_like(roi)
+        np.multiply(roi, self.mask, out=self._masked)
+        return self._masked
+
+    def to_frame(self, dets):
+        """
+        Shift detections from crop coordinates back to full-frame coordinates, in place.
+
+        :param dets: array of shape (N, >=4) with x1, y1, x2, y2 in the first columns
+        :return: the same array
+        """
+        if len(dets):
+            dets[:, [0, 2]] += self.x0
+            dets[:, [1, 3]] += self.y0
+        return dets
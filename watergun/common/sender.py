@@ -0,0 +1,185 @@
+import socket
+import threading
+import time
+
+from watergun.common.metrics import METRICS
+from watergun.common.protocol import encode_ascii_command, encode_command
+
+
+def parse_address(address):
+    """
+    :param address: "host:port" or ":port"
+    :return: (host, port), with host defaulting to localhost
+    """
+    host, _, port = str(address).rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+class CommandSender:
+    """
+    Send sprayer commands from a background thread.
+
+    The caller never blocks on the network: submit() only replaces the pending
+    command, so if the socket is slow the older command is coalesced away and
+    the newest one wins. Commands within `deadband` degrees of the last sent
+    one (with the same trigger state) are not sent at all. The thread
+    reconnects with exponential backoff whenever the connection drops.
+
+    Commands submitted with the capture time of their frame update
+    `latency`, a smoothed capture-to-wire delay in seconds.
+    """
+
+    def __init__(self, protocol="binary", deadband=0.0, min_backoff=0.5, max_backoff=10.0, logger=None,
+                 latency_smoothing=0.1):
+        """
+        :param protocol: "binary" for sequenced frames, "ascii" for the legacy text lines
+        :param deadband: minimum pan or tilt change in degrees worth sending
+        :param min_backoff: first reconnect delay in seconds
+        :param max_backoff: longest reconnect delay in seconds
+        :param logger: optional logger that receives each sent command
+        :param latency_smoothing: weight of the newest sample in the `latency` moving average
+        """
+        self.protocol = protocol
+        self.deadband = deadband
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.logger = logger
+        self.latency_smoothing = latency_smoothing
+
+        self.address = None
+        self.status = "Disconnected"
+        self.stats = {"sent": 0, "coalesced": 0, "deadband": 0, "dropped": 0, "reconnects": 0}
+        self.latency = None
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = None
+        self._last_sent = None
+        self._reconnect = False
+        self._socket = None
+        self._seq = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="CommandSender", daemon=True)
+        self._thread.start()
+
+    def connect(self, host, port):
+        """
+        Point the sender at a (new) sprayer address; the thread connects in the background.
+        """
+        with self._lock:
+            self.address = (host, int(port))
+            self._reconnect = True
+            self.status = "Connecting"
+            self._wakeup.notify()
+
+    def submit(self, pan_angle, tilt_angle, trigger, captured_at=None):
+        """
+        Queue a command without blocking. Replaces any command not yet sent.
+
+        :param captured_at: time.monotonic() capture time of the frame the command was computed from
+        """
+        with self._lock:
+            if self._pending is not None:
+                # Without a live connection the replaced command was never going out; that is a drop, not
+                # coalescing behind a slow socket
+                if self.address is None or self._socket is None or self._reconnect:
+                    self.stats["dropped"] += 1
+                else:
+                    self.stats["coalesced"] += 1
+            self._pending = (pan_angle, tilt_angle, 1 if trigger else 0, captured_at)
+            self._wakeup.notify()
+
+    def close(self):
+        with self._lock:
+            self._running = False
+            self._wakeup.notify()
+        self._thread.join(timeout=2.0)
+        self._close_socket()
+
+    def _close_socket(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
+
+    def _within_deadband(self, command):
+        if self._last_sent is None or command[2] != self._last_sent[2]:
+            return False
+        return (abs(command[0] - self._last_sent[0]) < self.deadband and
+                abs(command[1] - self._last_sent[1]) < self.deadband)
+
+    def _encode(self, command):
+        pan_angle, tilt_angle, trigger = command[:3]
+        if self.protocol == "ascii":
+            return encode_ascii_command(pan_angle, tilt_angle, trigger)
+        data = encode_command(pan_angle, tilt_angle, trigger, seq=self._seq)
+        self._seq = (self._seq + 1) & 0xFFFF
+        return data
+
+    def _open(self, address):
+        sock = socket.create_connection(address, timeout=2.0)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _run(self):
+        backoff = self.min_backoff
+        while True:
+            with self._lock:
+                self._wakeup.wait_for(lambda: not self._running or self._reconnect or
+                                      (self._pending is not None and self.address is not None))
+                if not self._running:
+                    return
+                address = self.address
+                reconnect = self._reconnect
+                self._reconnect = False
+                command = self._pending
+                self._pending = None
+
+            if reconnect or self._socket is None:
+                self._close_socket()
+                try:
+                    self._socket = self._open(address)
+                    # Start a new sequence so the receiver doesn't treat us as stale
+                    self._seq = 0
+                    self._last_sent = None
+                    self.status = "Connected"
+                    backoff = self.min_backoff
+                except OSError as e:
+                    self.status = f"Connection failed: {e}"
+                    self.stats["reconnects"] += 1
+                    if command is not None:
+                        self.stats["dropped"] += 1
+                    with self._lock:
+                        # Sleep out the backoff unless someone asks for a new address or we are closing
+                        self._wakeup.wait_for(lambda: not self._running or self._reconnect, backoff)
+                        if self.address == address:
+                            self._reconnect = True
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+
+            if command is None:
+                continue
+            if self._within_deadband(command):
+                self.stats["deadband"] += 1
+                continue
+
+            try:
+                # The "send" stage is encode plus the socket write, timed here on the sender thread
+                with METRICS.timer("send"):
+                    self._socket.sendall(self._encode(command))
+                self._last_sent = command
+                self.stats["sent"] += 1
+                if command[3] is not None:
+                    latency = time.monotonic() - command[3]
+                    self.latency = latency if self.latency is None else \
+                        self.latency + self.latency_smoothing * (latency - self.latency)
+                if self.logger:
+                    self.logger.info(f"{command[0]},{command[1]},{command[2]}")
+            except OSError as e:
+                self.status = f"Connection lost: {e}"
+                self.stats["dropped"] += 1
+                self._close_socket()
+                with self._lock:
+                    self._reconnect = True
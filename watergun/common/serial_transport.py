@@ -0,0 +1,132 @@
+import threading
+import time
+
+from watergun.common.protocol import ACK_BYTE, READY_BYTE
+
+# The Arduino Uno's hardware serial receive buffer
+ARDUINO_RX_BUFFER = 64
+
+
+class SerialTransport:
+    """
+    Non-blocking, coalescing writer for the Arduino serial link.
+
+    write() only replaces the pending command and returns immediately; a
+    background thread puts it on the wire once the link has room, so commands
+    that pile up while the link is busy are coalesced and the newest wins.
+
+    Opening the port resets most Arduinos, and anything sent during the
+    bootloader's ~2 s is lost. Instead of sleeping, the writer holds commands
+    until the firmware announces itself with READY_BYTE, or `ready_timeout`
+    passes for firmware that doesn't.
+
+    With `ack=True` the firmware's ACK_BYTE after each command is used for flow
+    control: no more bytes are in flight than fit in the Arduino's receive
+    buffer. Without acks the writer waits for the OS output queue to drain.
+    """
+
+    def __init__(self, port, baudrate=115200, ack=False, ready_timeout=2.5, ack_timeout=0.5, ser=None):
+        """
+        :param port: serial device or pyserial URL, e.g. /dev/ttyACM0
+        :param baudrate: serial baud rate
+        :param ack: use firmware acks for flow control
+        :param ready_timeout: seconds to wait for READY_BYTE before writing anyway
+        :param ack_timeout: seconds after which unacknowledged bytes are assumed lost
+        :param ser: already opened pyserial-like object, mainly for tests
+        """
+        if ser is None:
+            import serial
+            ser = serial.serial_for_url(port, baudrate, timeout=0.05, write_timeout=0)
+        self.serial = ser
+        self.ack = ack
+        self.ack_timeout = ack_timeout
+        self.ready_deadline = time.monotonic() + ready_timeout
+
+        self.ready = False
+        self.stats = {"written": 0, "coalesced": 0, "bytes": 0, "acks": 0, "ack_timeouts": 0}
+        self.ack_rtt = 0.0
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._pending = None
+        self._in_flight = []  # (bytes, send time) of commands not acknowledged yet
+        self._running = True
+
+        self._reader = threading.Thread(target=self._read_loop, name="SerialTransportReader", daemon=True)
+        self._writer = threading.Thread(target=self._write_loop, name="SerialTransportWriter", daemon=True)
+        self._reader.start()
+        self._writer.start()
+
+    def write(self, data):
+        """
+        Queue one whole command without blocking. Replaces any command not yet written.
+        """
+        with self._lock:
+            if self._pending is not None:
+                self.stats["coalesced"] += 1
+            self._pending = bytes(data)
+            self._wakeup.notify_all()
+
+    def close(self):
+        with self._lock:
+            self._running = False
+            self._wakeup.notify_all()
+        self._writer.join(timeout=1.0)
+        self._reader.join(timeout=1.0)
+        self.serial.close()
+
+    def _bytes_in_flight(self):
+        return sum(len(data) for data, _ in self._in_flight)
+
+    def _can_write(self, data, now):
+        if not self.ready and now < self.ready_deadline:
+            return False
+        if self.ack:
+            if self._in_flight and now - self._in_flight[0][1] > self.ack_timeout:
+                self.stats["ack_timeouts"] += 1
+                self._in_flight.clear()
+            return self._bytes_in_flight() + len(data) <= ARDUINO_RX_BUFFER
+        return getattr(self.serial, "out_waiting", 0) == 0
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                while self._running:
+                    now = time.monotonic()
+                    if self._pending is not None and self._can_write(self._pending, now):
+                        break
+                    # Poll briefly: the OS output queue and the ready/ack timeouts don't notify us
+                    self._wakeup.wait(0.002 if self._pending is not None else None)
+                if not self._running:
+                    return
+                data = self._pending
+                self._pending = None
+                if self.ack:
+                    self._in_flight.append((data, now))
+            try:
+                self.serial.write(data)
+                self.stats["written"] += 1
+                self.stats["bytes"] += len(data)
+            except Exception as e:
+                print(f"Serial write failed: {e}")
+
+    def _read_loop(self):
+        while self._running:
+            try:
+                data = self.serial.read(max(1, getattr(self.serial, "in_waiting", 0)))
+            except Exception:
+                if self._running:
+                    time.sleep(0.05)
+                continue
+            if not data:
+                continue
+            now = time.monotonic()
+            with self._lock:
+                if READY_BYTE in data:
+                    self.ready = True
+                for _ in range(data.count(ACK_BYTE)):
+                    self.stats["acks"] += 1
+                    if self._in_flight:
+                        _, sent_at = self._in_flight.pop(0)
+                        self.ack_rtt = now - sent_at
+                self._wakeup.notify_all()
@@ -0,0 +1,393 @@
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from watergun.common.capture import FrameGrabber
+
+# Bump when the file layout changes so old sessions are rejected instead of misread
+SESSION_VERSION = 1
+SESSION_FILE = "session.json"
+
+FRAME_DTYPE = np.dtype([("offset", "<i8"), ("length", "<i4"), ("timestamp", "<f8")])
+DETECTION_DTYPE = np.dtype([("frame", "<i4"), ("box", "<f4", 4), ("conf", "<f4"), ("cls", "<f4")])
+TRACK_DTYPE = np.dtype([("frame", "<i4"), ("box", "<f4", 4), ("track_id", "<i4"), ("conf", "<f4"), ("cls", "<f4")])
+COMMAND_DTYPE = np.dtype([("frame", "<i4"), ("pan", "<f8"), ("tilt", "<f8"), ("trigger", "u1"), ("lead_time", "<f8")])
+
+
+def is_session(path):
+    return os.path.isfile(os.path.join(str(path), SESSION_FILE))
+
+
+def _save_array(path, array):
+    tmp_path = path + ".tmp.npy"
+    np.save(tmp_path, array)
+    os.replace(tmp_path, path)
+
+
+def _load_array(path, dtype):
+    # np.memmap cannot map an empty file, so empty arrays are read normally
+    array = np.load(path, mmap_mode="r")
+    return array if len(array) else np.empty(0, dtype=dtype)
+
+
+class SessionRecorder:
+    """
+    Record what the tracking pipeline saw and did, for offline replay.
+
+    A session is a directory holding:
+
+    * frames.jpg - every frame as JPEG, concatenated; the camera's own bytes
+      when the grabber has them (MJPEGReader at full scale, SessionPlayer),
+      so replay sees exactly the pixels the live run did
+    * frames.npy - offset, length and capture timestamp of each frame
+    * detections.npy, tracks.npy, commands.npy - one row per detection,
+      track and emitted command, tagged with the frame index
+    * session.json - frame size, source and counts
+
+    The .npy files are memory-mapped when read back. Frames without JPEG
+    bytes are encoded on a background thread so the live loop only pays for
+    a queue put; if the encoder falls `queue_size` frames behind the loop
+    waits rather than drop a frame, because replay must see exactly what the
+    pipeline saw. A frame that fails to encode is stored empty and replays
+    black, keeping every later frame index intact. The index and row arrays
+    are written on close().
+    """
+
+    def __init__(self, path, frame_width, frame_height, source=None, jpeg_quality=95, queue_size=64):
+        """
+        :param path: session directory, created if missing
+        :param frame_width: width of the camera frames in pixels
+        :param frame_height: height of the camera frames in pixels
+        :param source: where the frames came from, stored for reference
+        :param jpeg_quality: cv2.IMWRITE_JPEG_QUALITY for the stored frames
+        :param queue_size: frames buffered for the encoder thread
+        """
+        self.path = str(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.source = None if source is None else str(source)
+        self.jpeg_quality = jpeg_quality
+
+        self.frame_count = 0
+        self._frames = []
+        self._detections = []
+        self._tracks = []
+        self._commands = []
+        self._frame_file = open(os.path.join(self.path, "frames.jpg"), "wb")
+        self._offset = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._encode, name="SessionRecorder", daemon=True)
+        self._thread.start()
+        print(f"Recording session to {self.path}")
+
+    @property
+    def frame_index(self):
+        """
+        :return: index of the last recorded frame, -1 before the first
+        """
+        return self.frame_count - 1
+
+    def frame(self, frame, timestamp, jpeg=None):
+        """
+        Queue a frame for storing. The frame must not be modified afterwards.
+
+        :param timestamp: capture time of the frame (time.monotonic)
+        :param jpeg: the camera's JPEG bytes for the frame, stored as they are instead of re-encoding the frame
+        :return: index of the frame in the session
+        """
+        self._queue.put((frame, timestamp, jpeg))
+        self.frame_count += 1
+        return self.frame_count - 1
+
+    def detections(self, detections):
+        """
+        :param detections: (N, 6) array of x1, y1, x2, y2, conf, cls for the last recorded frame
+        """
+        detections = np.asarray(detections)
+        rows = np.zeros(len(detections), dtype=DETECTION_DTYPE)
+        if len(rows):
+            rows["frame"] = self.frame_index
+            rows["box"] = detections[:, :4]
+            rows["conf"] = detections[:, 4]
+            rows["cls"] = detections[:, 5]
+            self._detections.append(rows)
+
+    def tracks(self, tracks):
+        """
+        :param tracks: (N, >=7) tracker output of x1, y1, x2, y2, track_id, conf, cls for the last recorded frame
+        """
+        tracks = np.asarray(tracks)
+        if tracks.ndim != 2 or len(tracks) == 0:
+            return
+        rows = np.zeros(len(tracks), dtype=TRACK_DTYPE)
+        rows["frame"] = self.frame_index
+        rows["box"] = tracks[:, :4]
+        rows["track_id"] = tracks[:, 4]
+        rows["conf"] = tracks[:, 5]
+        rows["cls"] = tracks[:, 6] if tracks.shape[1] > 6 else -1
+        self._tracks.append(rows)
+
+    def command(self, pan_angle, tilt_angle, trigger, lead_time=0.0):
+        """
+        Record a command emitted for the last recorded frame.
+
+        :param lead_time: seconds the target was led by, so a replay can aim with the same lead
+        """
+        self._commands.append((self.frame_index, pan_angle, tilt_angle, trigger, lead_time))
+
+    def _encode(self):
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality]
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            frame, timestamp, jpeg = item
+            if jpeg is None:
+                # Raising here would stop the thread and leave the live loop blocked on a full queue
+                try:
+                    ok, encoded = cv2.imencode(".jpg", frame, params)
+                except cv2.error:
+                    ok = False
+                if ok:
+                    jpeg = encoded.data
+                else:
+                    print(f"Failed to encode session frame {len(self._frames)}, storing it empty")
+                    jpeg = b""
+            self._frame_file.write(jpeg)
+            self._frames.append((self._offset, len(jpeg), timestamp))
+            self._offset += len(jpeg)
+
+    def close(self):
+        """
+        Finish encoding and write the index, row arrays and session.json.
+        """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._frame_file.close()
+
+        _save_array(os.path.join(self.path, "frames.npy"), np.array(self._frames, dtype=FRAME_DTYPE))
+        for name, rows, dtype in (("detections", self._detections, DETECTION_DTYPE),
+                                  ("tracks", self._tracks, TRACK_DTYPE)):
+            _save_array(os.path.join(self.path, f"{name}.npy"),
+                        np.concatenate(rows) if rows else np.empty(0, dtype=dtype))
+        _save_array(os.path.join(self.path, "commands.npy"), np.array(self._commands, dtype=COMMAND_DTYPE))
+
+        meta = {
+            "version": SESSION_VERSION,
+            "frame_width": self.frame_width,
+            "frame_height": self.frame_height,
+            "source": self.source,
+            "frames": len(self._frames),
+            "commands": len(self._commands),
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        with open(os.path.join(self.path, SESSION_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+        print(f"Session saved to {self.path}: {len(self._frames)} frames, {len(self._commands)} commands")
+
+
+class SessionReader:
+    """
+    Memory-mapped view of a recorded session.
+
+    Rows for a frame are found by binary search on the frame column, so
+    reading any frame's detections, tracks or commands does not load the
+    whole session.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(os.path.join(self.path, SESSION_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != SESSION_VERSION:
+            raise ValueError(f"{self.path} is session version {self.meta.get('version')}, "
+                             f"expected {SESSION_VERSION}")
+        self.frame_width = self.meta["frame_width"]
+        self.frame_height = self.meta["frame_height"]
+
+        self.index = _load_array(os.path.join(self.path, "frames.npy"), FRAME_DTYPE)
+        jpeg_path = os.path.join(self.path, "frames.jpg")
+        self.data = np.memmap(jpeg_path, dtype=np.uint8, mode="r") if os.path.getsize(jpeg_path) \
+            else np.empty(0, dtype=np.uint8)
+        self.detections = _load_array(os.path.join(self.path, "detections.npy"), DETECTION_DTYPE)
+        self.tracks = _load_array(os.path.join(self.path, "tracks.npy"), TRACK_DTYPE)
+        self.commands = _load_array(os.path.join(self.path, "commands.npy"), COMMAND_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def timestamps(self):
+        return self.index["timestamp"]
+
+    def jpeg(self, i):
+        """
+        :return: the stored JPEG bytes of frame i, as a view into the mapped file
+        """
+        offset, length = int(self.index[i]["offset"]), int(self.index[i]["length"])
+        return self.data[offset:offset + length]
+
+    def frame(self, i):
+        """
+        :return: frame i decoded to BGR; black if it failed to encode while recording
+        """
+        jpeg = self.jpeg(i)
+        if len(jpeg) == 0:
+            return np.zeros((self.frame_height, self.frame_width, 3), dtype=np.uint8)
+        return cv2.imdecode(np.asarray(jpeg), cv2.IMREAD_COLOR)
+
+    @staticmethod
+    def _rows(rows, i):
+        frames = rows["frame"]
+        return rows[np.searchsorted(frames, i, "left"):np.searchsorted(frames, i, "right")]
+
+    def frame_detections(self, i):
+        return self._rows(self.detections, i)
+
+    def frame_tracks(self, i):
+        return self._rows(self.tracks, i)
+
+    def frame_commands(self, i):
+        return self._rows(self.commands, i)
+
+    def lead_time(self, i):
+        """
+        :return: lead time recorded with frame i's command, or None if frame i sent nothing
+        """
+        commands = self.frame_commands(i)
+        return float(commands["lead_time"][0]) if len(commands) else None
+
+
+class SessionPlayer(FrameGrabber):
+    """
+    FrameGrabber that plays back a recorded session instead of a camera.
+
+    Frames carry sequence number index + 1. With `realtime` they are
+    published at the recorded pace, stamped with the time they are published
+    (the recorded timestamps moved onto this process's clock, so frame ages
+    and latencies are real), and, like a live camera, frames the consumer is
+    too slow for are dropped. Otherwise they carry their recorded capture
+    timestamps and every frame is decoded as soon as the previous one has
+    been read, so replay runs as fast as the consumer allows and sees every
+    frame; latencies measured against those timestamps mean nothing.
+    """
+
+    def __init__(self, path, realtime=False):
+        self.reader = SessionReader(path)
+        self.realtime = realtime
+        self._frame_taken = None
+        super().__init__(path)
+        self._frame_taken = threading.Condition(self._lock)
+
+    def _open(self):
+        self.vid = None
+        self.frame_width = self.reader.frame_width
+        self.frame_height = self.reader.frame_height
+
+    def _close(self):
+        pass
+
+    def _run(self):
+        timestamps = self.reader.timestamps
+        start = time.monotonic()
+        for i in range(len(self.reader)):
+            if not self._running:
+                return
+            if self.realtime:
+                timestamp = start + float(timestamps[i] - timestamps[0])
+                delay = timestamp - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                timestamp = float(timestamps[i])
+                with self._lock:
+                    self._frame_taken.wait_for(lambda: self._last_read_seq >= self._seq or not self._running)
+            self._publish(self.reader.frame(i), timestamp)
+        # Let wait() return None once the last frame has been read
+        with self._lock:
+            self._running = False
+            self._new_frame.notify_all()
+
+    def jpeg(self, seq):
+        """
+        :return: the recorded JPEG bytes of frame seq, so re-recording a replay stores identical frames
+        """
+        if not 1 <= seq <= len(self.reader):
+            return None
+        return bytes(self.reader.jpeg(seq - 1))
+
+    def stop(self):
+        self._running = False
+        if self._frame_taken is not None:
+            with self._lock:
+                self._frame_taken.notify_all()
+        super().stop()
+
+    def read(self):
+        result = super().read()
+        with self._lock:
+            self._frame_taken.notify_all()
+        return result
+
+    def wait(self, after_seq=0, timeout=None):
+        result = super().wait(after_seq, timeout)
+        with self._lock:
+            self._frame_taken.notify_all()
+        return result
+
+
+def diff_commands(recorded, replayed, frames=None, tolerance=1e-6):
+    """
+    Compare the commands of a replay against a recording, frame by frame.
+
+    :param recorded: COMMAND_DTYPE rows from the recording
+    :param replayed: COMMAND_DTYPE rows from the replay
+    :param frames: frame indices the replay processed; recorded commands on other frames are ignored
+    :param tolerance: largest pan/tilt difference in degrees still counted as a match
+    :return: dict with compared/matched/mismatched/missing/extra counts, max pan and tilt error
+             and the first mismatching frame
+    """
+    if frames is not None:
+        recorded = recorded[np.isin(recorded["frame"], frames)]
+    recorded_by_frame = {int(r["frame"]): r for r in recorded}
+    replayed_by_frame = {int(r["frame"]): r for r in replayed}
+    common = sorted(recorded_by_frame.keys() & replayed_by_frame.keys())
+
+    pan_errors = np.array([abs(recorded_by_frame[f]["pan"] - replayed_by_frame[f]["pan"]) for f in common])
+    tilt_errors = np.array([abs(recorded_by_frame[f]["tilt"] - replayed_by_frame[f]["tilt"]) for f in common])
+    trigger_differs = np.array([recorded_by_frame[f]["trigger"] != replayed_by_frame[f]["trigger"] for f in common],
+                               dtype=bool)
+    mismatched = (pan_errors > tolerance) | (tilt_errors > tolerance) | trigger_differs if common \
+        else np.zeros(0, dtype=bool)
+    missing = sorted(recorded_by_frame.keys() - replayed_by_frame.keys())
+    extra = sorted(replayed_by_frame.keys() - recorded_by_frame.keys())
+    divergent = [common[i] for i in np.flatnonzero(mismatched)] + missing + extra
+
+    return {
+        "compared": len(common),
+        "matched": len(common) - int(np.count_nonzero(mismatched)),
+        "mismatched": int(np.count_nonzero(mismatched)),
+        "missing": len(missing),
+        "extra": len(extra),
+        "max_pan_error": float(pan_errors.max()) if common else 0.0,
+        "max_tilt_error": float(tilt_errors.max()) if common else 0.0,
+        "first_divergence": min(divergent) if divergent else None,
+    }
+
+
+def format_diff(diff):
+    line = (f"commands: {diff['matched']}/{diff['compared']} match, {diff['mismatched']} differ, "
+            f"{diff['missing']} missing, {diff['extra']} extra; "
+            f"max error pan {diff['max_pan_error']:.4f} tilt {diff['max_tilt_error']:.4f} deg")
+    if diff["first_divergence"] is not None:
+        line += f"; first divergence at frame {diff['first_divergence']}"
+    return line
@@ -0,0 +1,235 @@
+import numpy as np
+
+from watergun.common import pixels_to_meters
+
+
+class TrackPredictor:
+    """
+    Constant-velocity extrapolation of tracker output between detections.
+
+    Tracks are rows of [x1, y1, x2, y2, track_id, conf, ...] as returned by
+    the boxmot trackers. Each box's velocity (pixels per second) is estimated
+    from consecutive detections and smoothed so a single jittery box doesn't
+    fling the prediction across the frame.
+    """
+
+    def __init__(self, smoothing=0.5):
+        """
+        :param smoothing: weight of the newest velocity measurement, 1.0 means no smoothing
+        """
+        self.smoothing = smoothing
+        self.tracks = np.empty((0, 8))
+        self.velocities = np.empty((0, 4))
+        self.timestamp = None
+
+    def update(self, tracks, timestamp):
+        """
+        Record fresh tracker output.
+
+        :param tracks: array of shape (N, >=5) from the tracker
+        :param timestamp: capture time of the frame the tracks came from (seconds)
+        """
+        tracks = np.asarray(tracks, dtype=np.float64)
+        if tracks.ndim != 2 or len(tracks) == 0:
+            self.tracks = np.empty((0, 8))
+            self.velocities = np.empty((0, 4))
+            self.timestamp = timestamp
+            return
+
+        velocities = np.zeros((len(tracks), 4))
+        if self.timestamp is not None and len(self.tracks) > 0 and timestamp > self.timestamp:
+            dt = timestamp - self.timestamp
+            previous_ids = self.tracks[:, 4]
+            for i, track_id in enumerate(tracks[:, 4]):
+                match = np.flatnonzero(previous_ids == track_id)
+                if len(match):
+                    j = match[0]
+                    measured = (tracks[i, :4] - self.tracks[j, :4]) / dt
+                    velocities[i] = self.smoothing * measured + (1 - self.smoothing) * self.velocities[j]
+
+        self.tracks = tracks
+        self.velocities = velocities
+        self.timestamp = timestamp
+
+    def predict(self, timestamp):
+        """
+        :param timestamp: time to extrapolate the last tracks to (seconds)
+        :return: array shaped like the last tracks with boxes moved along their velocity
+        """
+        if self.timestamp is None or len(self.tracks) == 0:
+            return self.tracks
+        predicted = self.tracks.copy()
+        predicted[:, :4] += self.velocities * (timestamp - self.timestamp)
+        return predicted
+
+
+class DetectionScheduler:
+    """
+    Decide on which frames the detector and tracker run.
+
+    Detection runs every `every_n` frames, and earlier when there are no
+    tracks to extrapolate, when the weakest track's confidence drops below
+    `min_confidence`, or when `max_interval` seconds have passed since the
+    last detection. The `stats` dict counts how often each path ran.
+    """
+
+    def __init__(self, every_n=1, min_confidence=0.0, max_interval=None):
+        """
+        :param every_n: run detection at least once every this many frames
+        :param min_confidence: re-detect when any track's confidence is below this
+        :param max_interval: re-detect when this many seconds passed since the last detection, None to disable
+        """
+        self.every_n = max(1, int(every_n))
+        self.min_confidence = min_confidence
+        self.max_interval = max_interval
+        self.frames_since_detect = self.every_n
+        self.last_detect_time = None
+        self.stats = {"detect": 0, "predict": 0, "cadence": 0, "no_tracks": 0, "low_confidence": 0, "timeout": 0}
+
+    def should_detect(self, tracks, timestamp):
+        """
+        :param tracks: current tracks, shaped like the tracker output
+        :param timestamp: capture time of the frame being processed (seconds)
+        :return: True if the detector should run on this frame
+        """
+        reason = None
+        if self.frames_since_detect >= self.every_n:
+            reason = "cadence"
+        elif len(tracks) == 0:
+            reason = "no_tracks"
+        elif self.min_confidence > 0 and np.min(np.asarray(tracks)[:, 5]) < self.min_confidence:
+            reason = "low_confidence"
+        elif self.max_interval is not None and timestamp - self.last_detect_time >= self.max_interval:
+            reason = "timeout"
+
+        if reason is None:
+            self.frames_since_detect += 1
+            self.stats["predict"] += 1
+            return False
+
+        self.frames_since_detect = 1
+        self.last_detect_time = timestamp
+        self.stats["detect"] += 1
+        self.stats[reason] += 1
+        return True
+
+
+class RingBuffer:
+    """
+    Fixed-size buffer of the last `capacity` rows, stored in one preallocated NumPy array.
+    """
+
+    def __init__(self, capacity, width):
+        self.data = np.zeros((capacity, width))
+        self.capacity = capacity
+        self.count = 0
+        self.head = 0
+
+    def push(self, row):
+        self.data[self.head] = row
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def values(self):
+        """
+        :return: array of shape (count, width), oldest row first
+        """
+        if self.count < self.capacity:
+            return self.data[:self.count]
+        return np.roll(self.data, -self.head, axis=0)
+
+    def last(self):
+        return self.data[(self.head - 1) % self.capacity]
+
+
+class LeadPredictor:
+    """
+    Predict where a target's feet will be when the water gets there.
+
+    Every detection pushes each track's foot point, mapped onto the floor
+    plane, into that track's ring buffer. Velocity is the least-squares
+    slope of the samples from the last `window` seconds. Velocity is
+    estimated on the floor rather than in pixels because constant speed on
+    the floor is not constant speed in perspective.
+    """
+
+    def __init__(self, perspective_transform, inverse_perspective_transform, undistorter=None, history=16,
+                 window=0.5, stale_after=1.0):
+        """
+        :param perspective_transform: 3x3 homography from (undistorted) pixels to floor coordinates
+        :param inverse_perspective_transform: 3x3 homography from floor coordinates back to (undistorted) pixels
+        :param undistorter: optional Undistorter if the homographies live in undistorted pixels
+        :param history: samples kept per track
+        :param window: seconds of history used for the velocity estimate
+        :param stale_after: forget tracks not seen for this many seconds
+        """
+        self.perspective_transform = np.asarray(perspective_transform, dtype=np.float64)
+        self.inverse_perspective_transform = np.asarray(inverse_perspective_transform, dtype=np.float64)
+        self.undistorter = undistorter
+        self.history = history
+        self.window = window
+        self.stale_after = stale_after
+        self.buffers = {}
+
+    def to_floor(self, pixels):
+        if self.undistorter is not None:
+            pixels = self.undistorter.points(pixels)
+        return pixels_to_meters(pixels, self.perspective_transform)
+
+    def to_pixels(self, points):
+        # The inverse homography has the same form, so the same vectorized projection applies
+        pixels = pixels_to_meters(points, self.inverse_perspective_transform)
+        if self.undistorter is not None:
+            pixels = self.undistorter.distort_points(pixels)
+        return pixels
+
+    def update(self, tracks, timestamp):
+        """
+        Record the foot points of freshly detected tracks.
+
+        :param tracks: array of shape (N, >=5) from the tracker
+        :param timestamp: capture time of the frame the tracks came from (seconds)
+        """
+        tracks = np.asarray(tracks, dtype=np.float64)
+        if tracks.ndim == 2 and len(tracks):
+            feet = np.stack([(tracks[:, 0] + tracks[:, 2]) / 2, tracks[:, 3]], axis=1)
+            for track_id, point in zip(tracks[:, 4].astype(int), self.to_floor(feet)):
+                buffer = self.buffers.get(track_id)
+                if buffer is None:
+                    buffer = self.buffers[track_id] = RingBuffer(self.history, 3)
+                buffer.push((timestamp, point[0], point[1]))
+
+        for track_id in [i for i, b in self.buffers.items() if timestamp - b.last()[0] > self.stale_after]:
+            del self.buffers[track_id]
+
+    def velocity(self, track_id):
+        """
+        :return: floor velocity (vx, vy) per second, zero with fewer than two recent samples
+        """
+        buffer = self.buffers.get(track_id)
+        if buffer is None or buffer.count < 2:
+            return np.zeros(2)
+        samples = buffer.values()
+        samples = samples[samples[:, 0] >= samples[-1, 0] - self.window]
+        t = samples[:, 0] - samples[:, 0].mean()
+        spread = np.dot(t, t)
+        if len(samples) < 2 or spread <= 0:
+            return np.zeros(2)
+        return t @ (samples[:, 1:] - samples[:, 1:].mean(axis=0)) / spread
+
+    def predict(self, track_id, pixel_x, pixel_y, observed_at, timestamp):
+        """
+        Move a track's foot pixel along its floor velocity to `timestamp`.
+
+        :param pixel_x: foot pixel x, e.g. from the (extrapolated) track box
+        :param pixel_y: foot pixel y
+        :param observed_at: time the foot pixel corresponds to
+        :param timestamp: when the water should arrive, on the same clock as update()
+        :return: (pixel_x, pixel_y) of the predicted foot point in the raw frame
+        """
+        velocity = self.velocity(track_id)
+        if not velocity.any():
+            return pixel_x, pixel_y
+        floor = self.to_floor([(pixel_x, pixel_y)])[0] + velocity * (timestamp - observed_at)
+        lead_x, lead_y = self.to_pixels(floor)[0]
+        return int(lead_x), int(lead_y)
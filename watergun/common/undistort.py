@@ -0,0 +1,105 @@
+import cv2
+import numpy as np
+
+UNDISTORT_CRITERIA = (cv2.TERM_CRITERIA_COUNT + cv2.TERM_CRITERIA_EPS, 20, 1e-6)
+# OpenCV 4 exposes the criteria overload as undistortPointsIter; OpenCV 5 folds it into undistortPoints
+_undistort_points = getattr(cv2, 'undistortPointsIter', cv2.undistortPoints)
+
+class Undistorter:
+    """
+    Lens undistortion for individual points, with an optional precomputed remap for display.
+
+    Aiming only needs a handful of pixels per frame (the target's feet, the
+    floor corners), so those go through cv2.undistortPoints instead of
+    undistorting whole frames. Undistorted points keep the original camera
+    matrix, so they stay in the same pixel units as the raw frame.
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs):
+        """
+        :param camera_matrix: 3x3 intrinsic matrix from watergun.calibration.camera_distortion
+        :param dist_coeffs: distortion coefficients from the same calibration
+        """
+        self.camera_matrix = np.asarray(camera_matrix, dtype=np.float64).reshape(3, 3)
+        self.dist_coeffs = np.asarray(dist_coeffs, dtype=np.float64).ravel()
+        self._maps = {}
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Read the dict saved by camera_distortion.calibrate_camera.
+
+        :return: Undistorter, or None if the file is missing or unreadable
+        """
+        try:
+            data = np.load(file_path, allow_pickle=True).item()
+            undistorter = cls(data['camera_matrix'], data['dist_coeffs'])
+            print(f"Camera calibration loaded from {file_path}")
+            return undistorter
+        except Exception as e:
+            print(f"Failed to load camera calibration: {e}")
+            return None
+
+    def points(self, pixels):
+        """
+        :param pixels: array-like of shape (N, 2) holding raw (pixel_x, pixel_y) pairs
+        :return: array of shape (N, 2) holding undistorted pixel coordinates
+        """
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 1, 2)
+        if len(pixels) == 0:
+            return pixels.reshape(0, 2)
+        # The default 5 iterations leave tenths of a pixel of error near the edges of wide-angle lenses
+        return _undistort_points(pixels, self.camera_matrix, self.dist_coeffs, R=np.eye(3), P=self.camera_matrix,
+                                 criteria=UNDISTORT_CRITERIA).reshape(-1, 2)
+
+    def distort_points(self, pixels):
+        """
+        Inverse of points(): map undistorted pixel coordinates back to raw frame pixels.
+        """
+        pixels = np.asarray(pixels, dtype=np.float64).reshape(-1, 2)
+        if len(pixels) == 0:
+            return pixels
+        normalized = cv2.convertPointsToHomogeneous(pixels) @ np.linalg.inv(self.camera_matrix).T
+        projected, _ = cv2.projectPoints(normalized.reshape(-1, 3), np.zeros(3), np.zeros(3),
+                                         self.camera_matrix, self.dist_coeffs)
+        return projected.reshape(-1, 2)
+
+    def boxes(self, boxes):
+        """
+        Undistort the four corners of each box and return their axis-aligned bounds.
+
+        :param boxes: array-like of shape (N, 4+) holding x1, y1, x2, y2 first; other columns are kept
+        :return: array of the same shape with undistorted box coordinates
+        """
+        boxes = np.array(boxes, dtype=np.float64).reshape(len(boxes), -1)
+        if len(boxes) == 0:
+            return boxes
+        x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+        corners = np.stack([x1, y1, x2, y1, x2, y2, x1, y2], axis=1).reshape(-1, 2)
+        corners = self.points(corners).reshape(-1, 4, 2)
+        boxes[:, :2] = corners.min(axis=1)
+        boxes[:, 2:4] = corners.max(axis=1)
+        return boxes
+
+    def display_maps(self, width, height, scale):
+        """
+        Remap tables that undistort a full-resolution frame straight into a width x height display buffer.
+
+        Built once per display size with cv2.initUndistortRectifyMap, in the
+        fixed-point format cv2.remap handles fastest.
+        """
+        key = (width, height, scale)
+        maps = self._maps.get(key)
+        if maps is None:
+            display_matrix = self.camera_matrix.copy()
+            display_matrix[:2] *= scale
+            maps = self._maps[key] = cv2.initUndistortRectifyMap(self.camera_matrix, self.dist_coeffs, None,
+                                                                 display_matrix, (width, height), cv2.CV_16SC2)
+        return maps
+
+    def remap(self, frame, width, height, scale, dst=None):
+        """
+        Undistort and scale a frame into a display buffer in a single remap.
+        """
+        map1, map2 = self.display_maps(width, height, scale)
+        return cv2.remap(frame, map1, map2, cv2.INTER_LINEAR, dst=dst)
@@ -0,0 +1,264 @@
+import hashlib
+import importlib.util
+import os
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+
+DETECTOR_WEIGHTS = 'models/yolov8n.pt'
+REID_WEIGHTS = 'models/osnet_x0_25_msmt17.pt'
+# Fastest first; "auto" picks the first one with a cached export
+BACKENDS = ("openvino", "onnx", "pytorch")
+# Bump when export settings change so stale artifacts are re-exported
+EXPORT_VERSION = 2
+REID_INPUT_SIZE = (256, 128)
+
+# Python package each exported format needs at runtime
+RUNTIMES = {"onnx": "onnxruntime", "openvino": "openvino"}
+
+
+def runtime_available(backend):
+    return backend == "pytorch" or importlib.util.find_spec(RUNTIMES[backend]) is not None
+
+
+def model_hash(path):
+    """
+    :return: first 16 hex digits of the SHA1 of the weights file
+    """
+    h = hashlib.sha1(f"v{EXPORT_VERSION}:".encode())
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:16]
+
+
+def artifact_path(weights, backend, imgsz, int8=False, cache_dir=None):
+    """
+    Where the export of `weights` for this backend, input size and precision is cached.
+
+    ONNX exports are single files; OpenVINO exports are directories, named with the
+    _openvino_model suffix both ultralytics and boxmot recognize.
+    """
+    if backend == "pytorch":
+        return weights
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    size = "x".join(str(s) for s in np.atleast_1d(imgsz))
+    name = f"{stem}_{model_hash(weights)}_{size}{'_int8' if int8 else ''}"
+    cache_dir = cache_dir or os.path.dirname(weights) or "."
+    return os.path.join(cache_dir, f"{name}.onnx" if backend == "onnx" else f"{name}_openvino_model")
+
+
+def write_calibration_images(source, out_dir, max_images=300):
+    """
+    Dump frames spread evenly over a recorded session or video as JPEG files for INT8 calibration.
+
+    :param source: session directory (see watergun.common.session) or video file
+    :return: number of images written
+    """
+    from watergun.common.session import SessionReader, is_session
+    os.makedirs(out_dir, exist_ok=True)
+    if is_session(source):
+        reader = SessionReader(source)
+        if len(reader) == 0:
+            return 0
+        # Session frames are already JPEG, so they are copied without decoding
+        indices = np.unique(np.linspace(0, len(reader) - 1, max_images).astype(int))
+        for n, i in enumerate(indices):
+            with open(os.path.join(out_dir, f"{n:05d}.jpg"), "wb") as f:
+                f.write(reader.jpeg(i).tobytes())
+        return len(indices)
+
+    vid = cv2.VideoCapture(source)
+    total = int(vid.get(cv2.CAP_PROP_FRAME_COUNT)) or max_images
+    wanted = set(np.linspace(0, total - 1, max_images).astype(int).tolist())
+    written = 0
+    index = 0
+    while written < max_images:
+        if index not in wanted:
+            if not vid.grab():
+                break
+        else:
+            ret, frame = vid.read()
+            if not ret:
+                break
+            cv2.imwrite(os.path.join(out_dir, f"{written:05d}.jpg"), frame)
+            written += 1
+        index += 1
+    vid.release()
+    return written
+
+
+def _calibration_dataset(source, work_dir, max_images):
+    """
+    :return: path of a YOLO dataset YAML over the calibration images; labels are not needed for calibration
+    """
+    images = os.path.join(work_dir, "images")
+    count = write_calibration_images(source, images, max_images)
+    if count == 0:
+        raise ValueError(f"No calibration frames in {source}")
+    data = os.path.join(work_dir, "calibration.yaml")
+    with open(data, "w") as f:
+        f.write(f"path: {work_dir}\ntrain: images\nval: images\nnames:\n  0: person\n")
+    return data
+
+
+def export_detector(weights=DETECTOR_WEIGHTS, backend="openvino", imgsz=640, int8=False, calibration=None,
+                    max_calibration_images=300, cache_dir=None):
+    """
+    Export the YOLO weights to a CPU runtime, or return the cached export.
+
+    :param backend: "onnx" or "openvino"
+    :param imgsz: detector input size the export is fixed to
+    :param int8: quantize to INT8 (OpenVINO only), calibrated on frames from `calibration`
+    :param calibration: session directory or video to draw INT8 calibration frames from
+    :return: path of the exported model
+    """
+    path = artifact_path(weights, backend, imgsz, int8, cache_dir)
+    if os.path.exists(path):
+        return path
+    if int8 and backend != "openvino":
+        raise ValueError("INT8 export is only supported for the openvino backend")
+    if int8 and calibration is None:
+        raise ValueError("INT8 export needs calibration frames (a recorded session or video)")
+
+    from ultralytics import YOLO
+    # Staged inside the cache directory so the finished export can be renamed into place atomically
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(path) or ".") as work_dir:
+        # ultralytics writes the export next to the weights, so export a private copy and move the result
+        staged = os.path.join(work_dir, os.path.basename(weights))
+        shutil.copy2(weights, staged)
+        # Dynamic shapes, INT8 included, so the multi-turret service can send batches of any size
+        options = {"format": backend, "imgsz": imgsz, "dynamic": True}
+        if int8:
+            options.update(int8=True, data=_calibration_dataset(calibration, os.path.join(work_dir, "calibration"),
+                                                                max_calibration_images))
+        exported = YOLO(staged).export(**options)
+        os.replace(exported, path)
+    print(f"Exported {weights} to {path}")
+    return path
+
+
+def _reid_module(tracker):
+    """
+    :return: the torch.nn.Module behind a boxmot tracker's ReID backend, or None if it is not a PyTorch backend
+    """
+    import torch
+    backend = getattr(tracker, 'model', None)
+    for candidate in (getattr(backend, 'model', None), backend):
+        if isinstance(candidate, torch.nn.Module):
+            return candidate
+    return None
+
+
+def export_reid(weights=REID_WEIGHTS, backend="openvino", cache_dir=None):
+    """
+    Export the OSNet ReID weights to ONNX, and from there to OpenVINO, or return the cached export.
+
+    boxmot picks its ONNX or OpenVINO ReID backend from the file name, so the
+    result can be passed to the tracker as model_weights.
+
+    :return: path of the exported model
+    """
+    path = artifact_path(weights, backend, REID_INPUT_SIZE, cache_dir=cache_dir)
+    if os.path.exists(path):
+        return path
+
+    import torch
+    from watergun.control.pipeline import load_tracker
+    # Always the PyTorch model: resolving the backend here would come straight back into this export
+    module = _reid_module(load_tracker(weights, backend="pytorch"))
+    if module is None:
+        raise ValueError(f"Could not find the PyTorch ReID model behind {weights}")
+    module.eval()
+
+    onnx_path = artifact_path(weights, "onnx", REID_INPUT_SIZE, cache_dir=cache_dir)
+    if not os.path.exists(onnx_path):
+        tmp_path = onnx_path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(module, torch.zeros(1, 3, *REID_INPUT_SIZE), tmp_path, input_names=["images"],
+                              output_names=["output"], dynamic_axes={"images": {0: "batch"}, "output": {0: "batch"}},
+                              opset_version=12)
+        os.replace(tmp_path, onnx_path)
+        print(f"Exported {weights} to {onnx_path}")
+    if backend == "onnx":
+        return onnx_path
+
+    import openvino as ov
+    tmp_dir = path + ".tmp"
+    os.makedirs(tmp_dir, exist_ok=True)
+    xml_name = os.path.basename(path)[:-len("_openvino_model")] + ".xml"
+    ov.save_model(ov.convert_model(onnx_path), os.path.join(tmp_dir, xml_name))
+    os.replace(tmp_dir, path)
+    print(f"Exported {weights} to {path}")
+    return path
+
+
+def select_backend(backend, weights, imgsz, int8=False, cache_dir=None):
+    """
+    Resolve INFERENCE_BACKEND to a concrete backend.
+
+    "auto" takes the fastest backend that has a cached export and an installed
+    runtime, without exporting anything; an explicit backend is used as given.
+
+    :return: backend name
+    """
+    if backend != "auto":
+        return backend
+    for candidate in BACKENDS:
+        if candidate == "pytorch":
+            return candidate
+        int8_options = (True, False) if int8 else (False,)
+        if runtime_available(candidate) and any(
+                os.path.exists(artifact_path(weights, candidate, imgsz, q, cache_dir)) for q in int8_options):
+            return candidate
+    return "pytorch"
+
+
+def resolve_detector(weights=DETECTOR_WEIGHTS, backend="pytorch", imgsz=640, int8=False, calibration=None):
+    """
+    :return: path of the detector weights to load for this backend, exporting them first if needed
+    """
+    if not os.path.exists(weights):
+        # Nothing to export; let the loader report the missing weights (or fetch them, as ultralytics does)
+        return weights
+    requested = backend
+    backend = select_backend(backend, weights, imgsz, int8)
+    if backend == "pytorch":
+        return weights
+    if not runtime_available(backend):
+        print(f"{RUNTIMES[backend]} is not installed, using the PyTorch detector")
+        return weights
+    int8 = int8 and backend == "openvino"
+    if int8 and not os.path.exists(artifact_path(weights, backend, imgsz, True)):
+        if requested == "auto":
+            # "auto" only loads what is cached, and select_backend found the float export
+            int8 = False
+        elif calibration is None:
+            print("INT8 export needs INT8_CALIBRATION frames, using the float export")
+            int8 = False
+    try:
+        return export_detector(weights, backend, imgsz, int8, calibration)
+    except (ValueError, ImportError, RuntimeError) as e:
+        print(f"Detector export failed, using the PyTorch detector: {e}")
+        return weights
+
+
+def resolve_reid(weights=REID_WEIGHTS, backend="pytorch"):
+    """
+    :return: path of the ReID weights to load for this backend, exporting them first if needed
+    """
+    if not os.path.exists(weights):
+        return weights
+    backend = select_backend(backend, weights, REID_INPUT_SIZE)
+    if backend == "pytorch":
+        return weights
+    if not runtime_available(backend):
+        print(f"{RUNTIMES[backend]} is not installed, using the PyTorch ReID model")
+        return weights
+    try:
+        return export_reid(weights, backend)
+    except (ValueError, ImportError, RuntimeError) as e:
+        print(f"ReID export failed, using the PyTorch ReID model: {e}")
+        return weights
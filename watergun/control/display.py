@@ -0,0 +1,149 @@
+import time
+import tkinter as tk
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+
+class CanvasDisplay:
+    """
+    Shows camera frames on a Tk canvas without rebuilding anything per frame.
+
+    The canvas holds a single image item backed by one PhotoImage. Each frame
+    is resized into a preallocated display-size buffer, overlays are drawn on
+    that buffer in display coordinates, and the result is converted into a
+    second preallocated RGB buffer and pasted into the PhotoImage. Buffers and
+    the PhotoImage are only reallocated when the canvas changes size.
+
+    With an Undistorter the resize is replaced by a remap that undistorts and
+    scales in one pass, and overlay coordinates are undistorted to match.
+    """
+
+    def __init__(self, canvas, frame_width, frame_height, max_fps=30.0, undistorter=None):
+        """
+        :param canvas: Tk canvas to draw on
+        :param frame_width: width of the camera frames in pixels
+        :param frame_height: height of the camera frames in pixels
+        :param max_fps: display refresh cap, independent of how often frames are processed (0 = uncapped)
+        :param undistorter: optional Undistorter to show lens-corrected frames
+        """
+        self.canvas = canvas
+        self.undistorter = undistorter
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.min_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.last_show_time = 0.0
+
+        self.scale_factor = 1.0
+        self.display_width = 0
+        self.display_height = 0
+        self.x_offset = 0
+        self.y_offset = 0
+        self.bgr = None
+        self.rgb = None
+        self.rgb_image = None
+        self.photo = None
+        self.image_item = None
+        self.stats = {"shown": 0, "skipped": 0}
+
+    def resize(self, canvas_width, canvas_height):
+        """
+        Fit the frame inside the canvas keeping its aspect ratio, reallocating buffers only if the size changed.
+        """
+        scale_factor = min(canvas_width / self.frame_width, canvas_height / self.frame_height)
+        display_width = max(1, int(self.frame_width * scale_factor))
+        display_height = max(1, int(self.frame_height * scale_factor))
+        self.scale_factor = scale_factor
+        self.x_offset = (canvas_width - display_width) // 2
+        self.y_offset = (canvas_height - display_height) // 2
+
+        if (display_width, display_height) != (self.display_width, self.display_height):
+            self.display_width = display_width
+            self.display_height = display_height
+            self.bgr = np.zeros((display_height, display_width, 3), dtype=np.uint8)
+            self.rgb = np.zeros((display_height, display_width, 4), dtype=np.uint8)
+            # Shares memory with self.rgb, so converting into the buffer updates the image with no copy. Pillow
+            # only maps 4-byte pixel modes onto a buffer; an "RGB" frombuffer would silently copy.
+            self.rgb_image = Image.frombuffer("RGBA", (display_width, display_height), self.rgb, "raw", "RGBA", 0, 1)
+            self.photo = ImageTk.PhotoImage(image=self.rgb_image)
+
+        if self.image_item is None:
+            self.image_item = self.canvas.create_image(self.x_offset, self.y_offset, image=self.photo, anchor=tk.NW)
+        else:
+            self.canvas.itemconfigure(self.image_item, image=self.photo)
+            self.canvas.coords(self.image_item, self.x_offset, self.y_offset)
+
+    def due(self, now=None):
+        """
+        :return: True if enough time has passed since the last shown frame
+        """
+        now = time.monotonic() if now is None else now
+        if now - self.last_show_time >= self.min_interval:
+            return True
+        self.stats["skipped"] += 1
+        return False
+
+    def prepare(self, frame):
+        """
+        Downscale (and with an undistorter, undistort) a camera frame into the display buffer.
+
+        :return: the display-size BGR buffer, ready for overlays in display coordinates
+        """
+        if self.bgr is None:
+            self.resize(self.canvas.winfo_width(), self.canvas.winfo_height())
+        if self.undistorter is not None:
+            self.undistorter.remap(frame, self.display_width, self.display_height, self.scale_factor, dst=self.bgr)
+            return self.bgr
+        interpolation = cv2.INTER_AREA if self.scale_factor < 1 else cv2.INTER_LINEAR
+        cv2.resize(frame, (self.display_width, self.display_height), dst=self.bgr, interpolation=interpolation)
+        return self.bgr
+
+    def show(self):
+        """
+        Convert the display buffer to RGBA in place and push it to the canvas image.
+        """
+        cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGBA, dst=self.rgb)
+        self.photo.paste(self.rgb_image)
+        self.last_show_time = time.monotonic()
+        self.stats["shown"] += 1
+
+    def points_to_display(self, points):
+        """
+        :param points: array-like of shape (N, 2) in raw frame coordinates
+        :return: int32 array of shape (N, 2) in display buffer coordinates
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.undistorter is not None:
+            points = self.undistorter.points(points)
+        return (points * self.scale_factor).astype(np.int32)
+
+    def boxes_to_display(self, boxes):
+        """
+        :param boxes: array-like of shape (N, 4+) holding x1, y1, x2, y2 in raw frame coordinates
+        :return: int32 array of shape (N, 4) in display buffer coordinates
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(len(boxes), -1)[:, :4]
+        if self.undistorter is not None:
+            boxes = self.undistorter.boxes(boxes)
+        return (boxes * self.scale_factor).astype(np.int32)
+
+    def to_display(self, x, y):
+        """
+        :return: (x, y) in display buffer coordinates for a point in frame coordinates
+        """
+        if self.undistorter is None:
+            return int(x * self.scale_factor), int(y * self.scale_factor)
+        x, y = self.points_to_display([(x, y)])[0]
+        return int(x), int(y)
+
+    def to_frame(self, canvas_x, canvas_y):
+        """
+        :return: (x, y) in frame coordinates for a point on the canvas, clamped to the frame
+        """
+        x = (canvas_x - self.x_offset) / self.scale_factor
+        y = (canvas_y - self.y_offset) / self.scale_factor
+        if self.undistorter is not None:
+            x, y = self.undistorter.distort_points([(x, y)])[0]
+        x, y = int(x), int(y)
+        return max(0, min(x, self.frame_width - 1)), max(0, min(y, self.frame_height - 1))
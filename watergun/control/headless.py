@@ -0,0 +1,164 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+from watergun.common.capture import is_live_source
+from watergun.common.metrics import METRICS
+from watergun.common.mjpeg import open_grabber
+from watergun.common.sender import CommandSender
+from watergun.common.session import COMMAND_DTYPE, SessionPlayer, SessionRecorder, diff_commands, format_diff, \
+    is_session
+from watergun.control.pipeline import TrackingPipeline
+
+STAGES = ("capture", "track", "aim", "send")
+
+
+def parse_source(source):
+    """
+    Camera indices arrive as strings from the command line; everything else is a path or URL.
+    """
+    return int(source) if str(source).isdigit() else source
+
+
+class StageTimer:
+    """
+    Accumulates wall time and call counts per pipeline stage.
+    """
+
+    def __init__(self, stages=STAGES):
+        self.totals = {stage: 0.0 for stage in stages}
+        self.counts = {stage: 0 for stage in stages}
+
+    def add(self, stage, seconds):
+        self.totals[stage] += seconds
+        self.counts[stage] += 1
+
+    def report(self, frames, elapsed):
+        lines = [f"{frames} frames in {elapsed:.2f}s ({frames / elapsed if elapsed else 0:.1f} FPS end to end)"]
+        for stage, total in self.totals.items():
+            count = self.counts[stage]
+            if count:
+                lines.append(f"  {stage:<8} {count / total if total else float('inf'):>9.1f} FPS "
+                             f"({total / count * 1000:.2f} ms avg over {count})")
+        return "\n".join(lines)
+
+
+def run(source, sprayer=None, realtime=False, max_frames=None, fire=False, target_hold_time=5.0, record=None):
+    """
+    Run capture -> detect -> track -> aim -> send without a GUI.
+
+    A recorded session directory as the source replays it: every frame with
+    its recorded timestamp and lead time, at the recorded pace with
+    `realtime`, and the commands are diffed against the recorded ones at the
+    end.
+
+    :param source: camera index, MJPEG/RTSP URL, video file or recorded session directory
+    :param sprayer: (host, port) of the sprayer server, or None to only compute angles
+    :param realtime: pace video files to their frame rate and drop stale frames from live sources;
+                     otherwise every frame is processed as fast as possible
+    :param max_frames: stop after this many frames
+    :param fire: open the valve while a target is tracked
+    :param target_hold_time: seconds to stay on one target before moving to the next
+    :param record: session directory to record frames, detections, tracks and commands into
+    :return: StageTimer with the per-stage totals
+    """
+    source = parse_source(source)
+    sender = None
+    if sprayer is not None:
+        sender = CommandSender(protocol=os.getenv('SPRAYER_PROTOCOL', 'binary'),
+                               deadband=float(os.getenv('SPRAYER_DEADBAND', 0.0)))
+        sender.connect(*sprayer)
+
+    # Sessions replay through their own grabber. Live sources get the latest-frame-wins grabber when paced;
+    # files and fast mode read every frame in order
+    grabber = None
+    session = None
+    if is_session(source):
+        grabber = SessionPlayer(source, realtime).start()
+        session = grabber.reader
+        frame_width, frame_height = grabber.frame_width, grabber.frame_height
+    elif realtime and is_live_source(source):
+        grabber = open_grabber(source).start()
+        frame_width, frame_height = grabber.frame_width, grabber.frame_height
+    else:
+        vid = cv2.VideoCapture(source)
+        frame_width = int(vid.get(cv2.CAP_PROP_FRAME_WIDTH))
+        frame_height = int(vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        fps = vid.get(cv2.CAP_PROP_FPS) or 30.0
+
+    pipeline = TrackingPipeline(frame_width, frame_height, sender)
+    # Unlike the GUI, there is nothing useful to do before the first detection, and replays must detect from frame 0
+    pipeline.wait_until_ready()
+    if record is not None:
+        pipeline.recorder = SessionRecorder(record, frame_width, frame_height, source)
+    timer = StageTimer()
+    frames = 0
+    last_seq = 0
+    # Session frame indices this replay processed, and (frame, pan, tilt, trigger, lead_time) rows it emitted
+    replayed_frames = []
+    replayed_commands = []
+    start = time.perf_counter()
+
+    try:
+        while max_frames is None or frames < max_frames:
+            t0 = time.perf_counter()
+            if grabber is not None:
+                frame, frame_time, last_seq = grabber.wait(last_seq, timeout=5.0)
+                if frame is None:
+                    break
+                if session is not None:
+                    lead_time = session.lead_time(last_seq - 1)
+                    pipeline.lead_time_override = lead_time if lead_time is not None else 0.0
+                    replayed_frames.append(last_seq - 1)
+            else:
+                if realtime:
+                    # Pace the file to its native frame rate
+                    delay = start + frames / fps - t0
+                    if delay > 0:
+                        time.sleep(delay)
+                        t0 = time.perf_counter()
+                ret, frame = vid.read()
+                if not ret:
+                    break
+                frame_time = time.monotonic()
+                METRICS.record("capture", time.perf_counter() - t0)
+            t1 = time.perf_counter()
+            timer.add("capture", t1 - t0)
+
+            pipeline.update_tracks(frame, frame_time, grabber.jpeg(last_seq) if grabber is not None else None)
+            target = pipeline.select_target(target_hold_time)
+            t2 = time.perf_counter()
+            timer.add("track", t2 - t1)
+
+            if target is not None:
+                pan, tilt = pipeline.aim(*target)
+                t3 = time.perf_counter()
+                timer.add("aim", t3 - t2)
+
+                pipeline.send(pan, tilt, 1 if fire else 0, frame_time)
+                timer.add("send", time.perf_counter() - t3)
+                if session is not None:
+                    replayed_commands.append((last_seq - 1, pan, tilt, 1 if fire else 0, pipeline.last_lead_time))
+
+            frames += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elapsed = time.perf_counter() - start
+        if grabber is not None:
+            grabber.stop()
+        else:
+            vid.release()
+        if sender is not None:
+            sender.close()
+        if pipeline.recorder is not None:
+            pipeline.recorder.close()
+
+    print(timer.report(frames, elapsed))
+    print(f"detection: {pipeline.detection_scheduler.stats}")
+    if session is not None:
+        commands = np.array(replayed_commands, dtype=COMMAND_DTYPE)
+        print(format_diff(diff_commands(session.commands, commands, frames=replayed_frames)))
+    return timer
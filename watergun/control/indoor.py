@@ -1,102 +1,69 @@
-from pathlib import Path
 import tkinter as tk
 from tkinter import ttk
-from PIL import Image, ImageTk
 import cv2
-import numpy as np
-import socket
 import time
-from boxmot import DeepOCSORT
-from ultralytics import YOLO
-import json
-from watergun.common import calculate_pan_tilt, pixel_to_meter
 import os
-import logging
-import sys
-import pygame
 from watergun.common.draw import draw_crosshair
+from watergun.common.metrics import METRICS
+from watergun.common.mjpeg import open_grabber
+from watergun.common.sender import CommandSender
+from watergun.common.session import SessionPlayer, SessionRecorder, is_session
+from watergun.control.display import CanvasDisplay
+from watergun.control.pipeline import TrackingPipeline, setup_logger
 
-
-
-def setup_logger():
-    logger = logging.getLogger('video_tracking_logger')
-    logger.setLevel(logging.INFO)
-    handler = logging.StreamHandler(sys.stdout)
-    formatter = logging.Formatter('%(asctime)s,%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
-    handler.setFormatter(formatter)
-    logger.addHandler(handler)
-    return logger
-
-def load_floor_corners(file_path, frame_width, frame_height):
-    try:
-        floor_corners = np.load(file_path)
-        src_pts = np.array([[0, 0], [frame_width-1, 0], [frame_width-1, frame_height-1], [0, frame_height-1]], dtype=np.float32)
-        dst_pts = floor_corners.astype(np.float32)
-        perspective_transform = cv2.getPerspectiveTransform(src_pts, dst_pts)
-        inverse_perspective_transform = cv2.getPerspectiveTransform(dst_pts, src_pts)
-        print("Floor corners loaded and perspective transform matrices calculated.")
-        return floor_corners, perspective_transform, inverse_perspective_transform
-    except Exception as e:
-        print(f"Failed to load floor corners: {e}")
-        return None, None, None
-    
 class VideoTrackingApp:
-    def __init__(self, window, video_source=0):
+    def __init__(self, window, video_source=0, record=None):
         self.window = window
         self.window.title("Sprayer Control App")
 
-        self.vid = cv2.VideoCapture(video_source)
-        self.frame_width = int(self.vid.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.frame_height = int(self.vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        # Frames are grabbed on a background thread; update() only ever sees the newest one.
+        # A recorded session directory plays back at its original pace instead of a camera.
+        if is_session(video_source):
+            self.vid = SessionPlayer(video_source, realtime=True).start()
+        else:
+            self.vid = open_grabber(video_source).start()
+        self.frame_width = self.vid.frame_width
+        self.frame_height = self.vid.frame_height
+        self.last_frame_seq = 0
+        self.last_frame_time = 0.0
 
         # Set maximum display dimensions
         self.max_display_width = 800
         self.max_display_height = 600
+        # Display refresh is capped separately from processing (DISPLAY_MAX_FPS, 0 = uncapped)
+        self.display_max_fps = float(os.getenv('DISPLAY_MAX_FPS', 30))
 
-        # Initialize display dimensions
-        self.display_width = self.max_display_width
-        self.display_height = self.max_display_height
-
-        # Calculate the initial scaling factor
-        self.update_scale_factor()
-
-        self.yolo_model = YOLO('models/yolov8n.pt')
-        self.tracker = DeepOCSORT(
-            model_weights=Path('models/osnet_x0_25_msmt17.pt'),
-            device='cpu',
-            fp16=False,
-        )
-
-        self.floor_corners, self.perspective_transform, self.inverse_perspective_transform = load_floor_corners(
-            os.getenv('FLOOR_CORNERS_FILE','assets/floor_corners.npy'), self.frame_width, self.frame_height)
-        with open("calibration_results.json", "r") as f:
-            self.calibration_results = json.load(f)
-
-        self.current_target_index = 0
-        self.tracks = []
         self.debug_mode = tk.BooleanVar(value=False)
         self.targeting_mode = tk.StringVar(value="cursor")
         self.firing_mode = tk.StringVar(value="toggle")
         self.target_hold_time = tk.DoubleVar(value=5.0)
         self.cursor_target = [self.frame_width // 2, self.frame_height // 2]
-        self.last_target_switch_time = 0
 
         self.sprayer_address = tk.StringVar(value="127.0.0.1")
         self.sprayer_port = tk.IntVar(value=1632)
         self.connection_status = tk.StringVar(value="Disconnected")
-        self.socket = None
         self.is_firing = False
+        self.target = None
         self.logger = setup_logger()
+        # The sender owns the socket on its own thread so the UI never waits on the network.
+        # SPRAYER_PROTOCOL is "binary" (sequenced frames) or "ascii" (legacy text lines).
+        self.sender = CommandSender(protocol=os.getenv('SPRAYER_PROTOCOL', 'binary'),
+                                    deadband=float(os.getenv('SPRAYER_DEADBAND', 0.0)),
+                                    logger=self.logger)
+        self.pipeline = TrackingPipeline(self.frame_width, self.frame_height, self.sender)
+        if record is not None:
+            self.pipeline.recorder = SessionRecorder(record, self.frame_width, self.frame_height, video_source)
 
         self.update_interval = 1.0 / 30  # 30 updates per second
         self.last_update_time = time.time()
 
+        # pygame is only imported once joystick mode is selected
         self.joystick = None
-        # if pygame.joystick.get_count() > 0:
-        #     self.joystick = pygame.joystick.Joystick(0)
-        #     self.joystick.init()
+        self.targeting_mode.trace_add("write", self.on_targeting_mode_change)
 
+        self.model_status = tk.StringVar(value="Loading")
         self.create_ui()
+        self.window.after_idle(METRICS.milestone, "ui_ready")
 
     def create_ui(self):
         self.window.columnconfigure(0, weight=1)
@@ -116,7 +83,12 @@ class VideoTrackingApp:
         control_frame = ttk.Frame(main_frame)
         control_frame.grid(row=0, column=1, padx=10, pady=10, sticky="n")
 
-        self.canvas = tk.Canvas(video_frame, width=self.display_width, height=self.display_height)
+        self.canvas = tk.Canvas(video_frame, width=self.max_display_width, height=self.max_display_height)
+        # UNDISTORT_DISPLAY=1 shows lens-corrected frames (needs UNDISTORT=1); aiming is corrected either way
+        display_undistorter = self.pipeline.undistorter if os.getenv('UNDISTORT_DISPLAY', '0') == '1' else None
+        self.display = CanvasDisplay(self.canvas, self.frame_width, self.frame_height, self.display_max_fps,
+                                     display_undistorter)
+        self.display.resize(self.max_display_width, self.max_display_height)
         self.canvas.grid(row=0, column=0, sticky="nsew")
         self.canvas.bind("<Configure>", self.on_canvas_resize)
         self.canvas.bind("<Motion>", self.on_mouse_move)
@@ -131,6 +103,9 @@ class VideoTrackingApp:
         ttk.Radiobutton(control_frame, text="Cursor", variable=self.targeting_mode, value="cursor").pack(anchor="w")
         ttk.Radiobutton(control_frame, text="Joystick", variable=self.targeting_mode, value="joystick").pack(anchor="w")
 
+        ttk.Label(control_frame, text="Detector:").pack(anchor="w", pady=5)
+        ttk.Label(control_frame, textvariable=self.model_status).pack(anchor="w")
+
         ttk.Label(control_frame, text="(Cursor) Firing Mode:").pack(anchor="w", pady=5)
         ttk.Radiobutton(control_frame, text="Toggle", variable=self.firing_mode, value="toggle").pack(anchor="w")
         ttk.Radiobutton(control_frame, text="Hold to Fire", variable=self.firing_mode, value="hold").pack(anchor="w")
@@ -151,6 +126,16 @@ class VideoTrackingApp:
 
         self.window.after(10, self.update)
 
+    def on_targeting_mode_change(self, *args):
+        if self.targeting_mode.get() == "joystick" and self.joystick is None:
+            import pygame
+            pygame.joystick.init()
+            if pygame.joystick.get_count() > 0:
+                self.joystick = pygame.joystick.Joystick(0)
+                self.joystick.init()
+            else:
+                print("No joystick found")
+
     def on_canvas_click(self, event):
         if self.targeting_mode.get() == "cursor":
             if self.firing_mode.get() == "toggle":
@@ -163,89 +148,60 @@ class VideoTrackingApp:
             self.is_firing = False
 
     def refresh_connection(self):
-        if self.socket:
-            self.socket.close()
-
-        try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.sprayer_address.get(), self.sprayer_port.get()))
-            self.connection_status.set("Connected")
-        except Exception as e:
-            self.connection_status.set(f"Connection failed: {str(e)}")
-            self.socket = None
-
-    def send_sprayer_command(self, pan_angle, tilt_angle, trigger):
-        if self.socket:
-            try:
-                data = f"{pan_angle},{tilt_angle},{trigger},0\n"  # 0 for red_button as it's not used
-                self.socket.sendall(data.encode())
-                self.logger.info(f"{pan_angle},{tilt_angle},{trigger}")
-            except Exception as e:
-                print(f"Error sending command: {str(e)}")
-                self.connection_status.set("Connection lost")
-                self.socket = None
-
-    def update_scale_factor(self):
-        # Calculate the scaling factor while maintaining aspect ratio
-        width_scale = self.display_width / self.frame_width
-        height_scale = self.display_height / self.frame_height
-        self.scale_factor = min(width_scale, height_scale)
-
-        # Update the actual display dimensions to maintain aspect ratio
-        self.display_width = int(self.frame_width * self.scale_factor)
-        self.display_height = int(self.frame_height * self.scale_factor)
+        self.sender.connect(self.sprayer_address.get(), self.sprayer_port.get())
+
+    def send_sprayer_command(self, pan_angle, tilt_angle, trigger, captured_at=None):
+        self.pipeline.send(pan_angle, tilt_angle, trigger, captured_at)
 
     def on_canvas_resize(self, event):
-        # Update the canvas size
-        self.display_width = event.width
-        self.display_height = event.height
-        
-        # Recalculate the scaling factor and update display dimensions
-        self.update_scale_factor()
+        # Refit the frame to the new canvas size; buffers are only reallocated when the fitted size changes
+        self.display.resize(event.width, event.height)
 
     def update(self):
-        ret, frame = self.vid.read()
-        if ret:
+        if self.connection_status.get() != self.sender.status:
+            self.connection_status.set(self.sender.status)
+        if self.model_status.get() == "Loading" and self.pipeline.models_ready.is_set():
+            self.model_status.set("Failed" if self.pipeline.load_error is not None else "Ready")
+
+        frame, frame_time, seq = self.vid.read()
+        if frame is not None and seq != self.last_frame_seq:
+            self.last_frame_seq = seq
+            self.last_frame_time = frame_time
             current_time = time.time()
             if current_time - self.last_update_time >= self.update_interval:
                 self.process_frame(frame)
                 self.last_update_time = current_time
 
-            if self.debug_mode.get():
-                self.draw_debug_info(frame)
-
-            # Resize the frame for display while maintaining aspect ratio
-            display_frame = cv2.resize(frame, (self.display_width, self.display_height))
-            
-            self.photo = ImageTk.PhotoImage(image=Image.fromarray(cv2.cvtColor(display_frame, cv2.COLOR_BGR2RGB)))
-            
-            # Calculate position to center the image on the canvas
-            x_position = (self.canvas.winfo_width() - self.display_width) // 2
-            y_position = (self.canvas.winfo_height() - self.display_height) // 2
-            
-            # Clear previous image and draw new one
-            self.canvas.delete("all")
-            self.canvas.create_image(x_position, y_position, image=self.photo, anchor=tk.NW)
+            if self.display.due():
+                self.show_frame(frame)
 
         self.window.after(10, self.update)
 
+    def show_frame(self, frame):
+        with METRICS.timer("display"):
+            self._show_frame(frame)
+
+    def _show_frame(self, frame):
+        # Overlays go on the downscaled copy, so the camera frame is never drawn on and each overlay costs display pixels
+        display_frame = self.display.prepare(frame)
+        if self.target is not None:
+            x, y = self.display.to_display(*self.target)
+            # Snap the sprite scale so window resizes don't fill the sprite cache with one entry per pixel width
+            draw_crosshair(display_frame, x, y, max(0.05, round(self.display.scale_factor * 20) / 20))
+        if self.debug_mode.get():
+            self.draw_debug_info(display_frame)
+        self.display.show()
+
     def on_mouse_move(self, event):
         if self.targeting_mode.get() == "cursor":
-            # Convert display coordinates to original frame coordinates
-            canvas_x = self.canvas.winfo_width()
-            canvas_y = self.canvas.winfo_height()
-            x_offset = (canvas_x - self.display_width) // 2
-            y_offset = (canvas_y - self.display_height) // 2
-            
-            x = int((event.x - x_offset) / self.scale_factor)
-            y = int((event.y - y_offset) / self.scale_factor)
-            
-            # Ensure coordinates are within frame boundaries
-            x = max(0, min(x, self.frame_width - 1))
-            y = max(0, min(y, self.frame_height - 1))
-            
-            self.cursor_target = [x, y]
+            # Convert display coordinates to original frame coordinates, clamped to the frame
+            self.cursor_target = list(self.display.to_frame(event.x, event.y))
     def process_frame(self, frame):
+        if isinstance(self.vid, SessionPlayer):
+            # Like headless replay, aim with the recorded lead instead of one computed from replay latency
+            lead_time = self.vid.reader.lead_time(self.last_frame_seq - 1)
+            self.pipeline.lead_time_override = lead_time if lead_time is not None else 0.0
+        self.pipeline.begin_frame(frame, self.last_frame_time, self.vid.jpeg(self.last_frame_seq))
         mode = self.targeting_mode.get()
         if mode == "automatic":
             target = self.process_automatic_mode(frame)
@@ -258,60 +214,18 @@ class VideoTrackingApp:
 
         if target:
             pixel_x, pixel_y, is_firing = target
-            draw_crosshair(frame, pixel_x, pixel_y)
-            meter_x, meter_y = pixel_to_meter(pixel_x, pixel_y, self.perspective_transform)
-            pan, tilt = calculate_pan_tilt(meter_x, meter_y, 0, 
-                                           [self.calibration_results["height"],
-                                            self.calibration_results["initial_pan"],
-                                            self.calibration_results["initial_tilt"],
-                                            self.calibration_results["initial_roll"]])
-            self.send_sprayer_command(pan, tilt, 1 if is_firing else 0)
-
-    def process_yolo_results(self, results):
-        dets = []
-        total_area = self.frame_width * self.frame_height
-        min_area = 0.003 * total_area  # 0.3% of total area
-        max_area = 0.9 * total_area    # 30% of total area
-
-        for r in results:
-            boxes = r.boxes
-            for box in boxes:
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                conf = box.conf[0].cpu().numpy()
-                cls = box.cls[0].cpu().numpy()
-                
-                # Calculate the area of the detection
-                area = (x2 - x1) * (y2 - y1)
-                
-                # Only include detections within the specified area range
-                if min_area <= area <= max_area:
-                    dets.append([x1, y1, x2, y2, conf, cls])
-
-        return np.array(dets)
-
-    def process_automatic_mode(self, frame):
-        results = self.yolo_model(frame, verbose=False)
-        dets = self.process_yolo_results(results)
-
-        if len(dets) > 0:
-            self.tracks = self.tracker.update(dets, frame)
+            self.target = (pixel_x, pixel_y)
+            pan, tilt = self.pipeline.aim(pixel_x, pixel_y)
+            self.send_sprayer_command(pan, tilt, 1 if is_firing else 0, self.last_frame_time)
         else:
-            self.tracks = self.tracker.update(np.empty((0, 6)), frame)
-
-        current_time = time.time()
-        if current_time - self.last_target_switch_time > self.target_hold_time.get():
-            self.current_target_index = (self.current_target_index + 1) % max(1, len(self.tracks))
-            self.last_target_switch_time = current_time
-
-        for i, track in enumerate(self.tracks):
-            x1, y1, x2, y2, track_id = track[:5]
-            center_x = int((x1 + x2) / 2)
-            bottom_y = int(y2)
+            self.target = None
 
-            if i == self.current_target_index:
-                return center_x, bottom_y, self.is_firing
-
-        return None
+    def process_automatic_mode(self, frame):
+        self.pipeline.update_tracks(frame, self.last_frame_time)
+        target = self.pipeline.select_target(self.target_hold_time.get())
+        if target is None:
+            return None
+        return target[0], target[1], self.is_firing
 
     def process_cursor_mode(self, frame):
         x, y = self.cursor_target
@@ -320,6 +234,7 @@ class VideoTrackingApp:
 
     def process_joystick_mode(self, frame):
         if self.joystick:
+            import pygame
             pygame.event.pump()
             x = -self.joystick.get_axis(0)
             y = -self.joystick.get_axis(1)
@@ -336,16 +251,42 @@ class VideoTrackingApp:
         return None
    
     def draw_debug_info(self, frame):
-        for i in range(4):
-            cv2.line(frame, tuple(self.floor_corners[i]), tuple(self.floor_corners[(i+1)%4]), (0, 255, 255), 2)
-
-        for track in self.tracks:
-            x1, y1, x2, y2, track_id = track[:5]
-            cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (0, 255, 0), 2)
-            cv2.putText(frame, f"ID: {int(track_id)}", (int(x1), int(y1) - 10),
+        """
+        Draw the floor outline, tracks and stats onto the display-size frame, in display coordinates.
+        """
+        if self.pipeline.floor_corners is not None:
+            floor = self.display.points_to_display(self.pipeline.floor_corners).reshape(-1, 1, 2)
+            cv2.polylines(frame, [floor], True, (0, 255, 255), 2)
+
+        tracks = self.pipeline.tracks
+        for track, box in zip(tracks, self.display.boxes_to_display(tracks) if len(tracks) else []):
+            x1, y1, x2, y2 = (int(v) for v in box)
+            track_id = track[4]
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(frame, f"ID: {int(track_id)}", (x1, y1 - 10),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
 
+        stats = self.vid.stats()
+        frame_age_ms = (time.monotonic() - self.last_frame_time) * 1000
+        cv2.putText(frame, f"Frame {stats['seq']} age {frame_age_ms:.0f}ms dropped {stats['dropped']}", (10, 20),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+        detect_stats = self.pipeline.detection_scheduler.stats
+        cv2.putText(frame, f"Detect {detect_stats['detect']} predict {detect_stats['predict']}", (10, 40),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+        display_stats = self.display.stats
+        send_stats = self.sender.stats
+        cv2.putText(frame, f"Sent {send_stats['sent']} coalesced {send_stats['coalesced']} "
+                           f"deadband {send_stats['deadband']} dropped {send_stats['dropped']}", (10, 60),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+        cv2.putText(frame, f"Shown {display_stats['shown']} skipped {display_stats['skipped']}", (10, 80),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+        for i, (stage, s) in enumerate(METRICS.summary().items()):
+            cv2.putText(frame, f"{stage:<9} p50 {s['p50_ms']:6.1f}ms p99 {s['p99_ms']:6.1f}ms", (10, 100 + 20 * i),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = VideoTrackingApp(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    app.vid.stop()
+    app.sender.close()
\ No newline at end of file
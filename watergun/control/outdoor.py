@@ -1,8 +1,10 @@
-import socket
+import asyncio
 import time
 import logging
 import sys
 import argparse
+from watergun.common.protocol import CommandDecoder, encode_ascii_command, encode_command
+from watergun.common.serial_transport import SerialTransport
 
 def setup_logger():
     logger = logging.getLogger('joystick_logger')
@@ -13,60 +15,168 @@ def setup_logger():
     logger.addHandler(handler)
     return logger
 
-def main(enable_logging):
-    # Set up socket server
-    HOST = '0.0.0.0'  # Listen on all available interfaces
-    PORT = 1632        # Port to listen on
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.bind((HOST, PORT))
-    server_socket.listen(1)
-    print(f"Server listening on {HOST}:{PORT}")
+class ClientState:
+    def __init__(self, name, priority):
+        self.name = name
+        self.priority = priority
+        self.decoder = CommandDecoder()
+        self.command = None
+        self.received_at = 0.0
+        self.forwarded = True
 
-    # Set up serial connection
-    # ser = serial.Serial('/dev/ttyACM0', 115200, timeout=1)
-    # time.sleep(2)  # Wait for the connection to establish
+class SprayerServer:
+    """
+    Accept sprayer commands from several TCP clients and forward one of them to serial at a fixed rate.
 
-    logger = None
-    if enable_logging:
-        logger = setup_logger()
+    Each listening port has a priority (e.g. the operator's joystick above the
+    auto-tracker). Only the latest command of each client is kept. On every
+    tick the fresh command with the highest priority wins, ties going to the
+    most recent one; a client's command goes stale after `client_timeout`
+    seconds so a silent operator hands control back to the tracker.
+    """
 
-    print("pan_angle,tilt_angle,trigger,red_button", file=sys.stderr)
+    def __init__(self, ports, rate=30, client_timeout=0.5, serial=None, serial_protocol="binary", logger=None):
+        """
+        :param ports: dict of {(host, port): priority}, higher priority wins
+        :param rate: serial updates per second
+        :param client_timeout: seconds after which a client's last command no longer counts
+        :param serial: SerialTransport (or anything with a non-blocking write(bytes)), or None to only log
+        :param serial_protocol: "binary" or "ascii" command format on the serial line
+        :param logger: optional logger that receives each forwarded command
+        """
+        self.ports = ports
+        self.rate = rate
+        self.client_timeout = client_timeout
+        self.serial = serial
+        self.serial_protocol = serial_protocol
+        self.logger = logger
+        self.clients = set()
+        self.servers = []
+        self.serial_seq = 0
+        self.stats = {"received": 0, "forwarded": 0, "ticks": 0, "late_ticks": 0, "clients": 0}
 
-    update_interval = 1.0 / 30  # 30 updates per second
-    last_update_time = time.time()
+    async def start(self):
+        for (host, port), priority in self.ports.items():
+            server = await asyncio.start_server(
+                lambda r, w, p=priority: self.handle_client(r, w, p), host, port)
+            self.servers.append(server)
+            for sock in server.sockets:
+                print(f"Server listening on {sock.getsockname()[0]}:{sock.getsockname()[1]} (priority {priority})")
 
-    try:
-        conn, addr = server_socket.accept()
-        print(f"Connected by {addr}")
+    def bound_ports(self):
+        return [sock.getsockname()[1] for server in self.servers for sock in server.sockets]
+
+    async def handle_client(self, reader, writer, priority):
+        addr = writer.get_extra_info('peername')
+        client = ClientState(f"{addr[0]}:{addr[1]}", priority)
+        self.clients.add(client)
+        self.stats["clients"] += 1
+        print(f"Connected by {addr} (priority {priority})")
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                commands = client.decoder.feed(data)
+                if commands:
+                    client.command = commands[-1]
+                    client.received_at = time.monotonic()
+                    client.forwarded = False
+                    self.stats["received"] += len(commands)
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.discard(client)
+            writer.close()
+            print(f"Disconnected {addr}")
+
+    def select_command(self, now):
+        fresh = [c for c in self.clients if c.command is not None and now - c.received_at <= self.client_timeout]
+        if not fresh:
+            return None
+        return max(fresh, key=lambda c: (c.priority, c.received_at))
+
+    def forward(self, command):
+        if self.serial_protocol == "ascii":
+            data = encode_ascii_command(round(command.pan), round(command.tilt),
+                                        command.trigger, command.red_button)
+        else:
+            data = encode_command(command.pan, command.tilt, command.trigger, command.red_button,
+                                  seq=self.serial_seq, timestamp=command.timestamp_ms)
+            self.serial_seq = (self.serial_seq + 1) & 0xFFFF
+        if self.serial is not None:
+            self.serial.write(data)
+        self.stats["forwarded"] += 1
+        if self.logger:
+            self.logger.info(f"{command.pan},{command.tilt},{int(command.trigger)},{int(command.red_button)}")
+
+    async def run(self):
+        await self.start()
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.rate
+        next_tick = loop.time()
         while True:
-            data = conn.recv(1024)
-            if not data:
-                break
+            # Schedule against absolute deadlines so the rate doesn't drift with processing time
+            next_tick += interval
+            delay = next_tick - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                self.stats["late_ticks"] += 1
+                next_tick = loop.time()
+            self.stats["ticks"] += 1
 
-            decoded_data = data.decode('utf-8').strip()
-            print(f"Received from client: {decoded_data}")
+            client = self.select_command(time.monotonic())
+            if client is not None and not client.forwarded:
+                self.forward(client.command)
+                client.forwarded = True
 
-            current_time = time.time()
-            if current_time - last_update_time >= update_interval:
-                # Send data over serial
-                # ser.write(data)
+    def close(self):
+        for server in self.servers:
+            server.close()
 
-                if logger:
-                    logger.info(decoded_data)
+def main(enable_logging, serial_protocol="binary", serial_port=None, baudrate=115200,
+         port=1632, operator_port=None, rate=30, client_timeout=0.5, serial_ack=False):
+    HOST = '0.0.0.0'  # Listen on all available interfaces
+    ports = {(HOST, port): 0}
+    if operator_port:
+        ports[(HOST, operator_port)] = 1
 
-                last_update_time = current_time
+    ser = SerialTransport(serial_port, baudrate, ack=serial_ack) if serial_port else None
 
+    logger = None
+    if enable_logging:
+        logger = setup_logger()
+
+    print("pan_angle,tilt_angle,trigger,red_button", file=sys.stderr)
+
+    server = SprayerServer(ports, rate=rate, client_timeout=client_timeout, serial=ser,
+                           serial_protocol=serial_protocol, logger=logger)
+    try:
+        asyncio.run(server.run())
     except KeyboardInterrupt:
         print("Exiting...", file=sys.stderr)
     finally:
-        if 'conn' in locals():
-            conn.close()
-        server_socket.close()
-        # ser.close()
+        server.close()
+        if ser is not None:
+            ser.close()
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Joystick data receiver server with 30 updates per second")
+    parser = argparse.ArgumentParser(description="Sprayer command server forwarding to serial at a fixed rate")
     parser.add_argument("--log", action="store_true", help="Enable logging to stdout")
+    parser.add_argument("--serial-protocol", choices=["binary", "ascii"], default="binary",
+                        help="Command format sent to the Arduino")
+    parser.add_argument("--serial-port", default=None, help="Serial device of the Arduino, e.g. /dev/ttyACM0")
+    parser.add_argument("--baud", type=int, default=115200, help="Serial baud rate")
+    parser.add_argument("--serial-ack", action="store_true",
+                        help="Use the firmware's acks for flow control")
+    parser.add_argument("--port", type=int, default=1632, help="Port for the auto-tracker")
+    parser.add_argument("--operator-port", type=int, default=None,
+                        help="Port whose clients take priority over --port")
+    parser.add_argument("--rate", type=float, default=30, help="Serial updates per second")
+    parser.add_argument("--client-timeout", type=float, default=0.5,
+                        help="Seconds before a silent client loses control")
     args = parser.parse_args()
 
-    main(args.log)
\ No newline at end of file
+    main(args.log, args.serial_protocol, args.serial_port, args.baud,
+         args.port, args.operator_port, args.rate, args.client_timeout, args.serial_ack)
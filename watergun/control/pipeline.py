@@ -0,0 +1,387 @@
+from pathlib import Path
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from watergun.common import CalibratedTransform
+from watergun.common.ballistics import BallisticTable
+from watergun.common.detections import DetectionFilter
+from watergun.common.lut import PanTiltTable
+from watergun.common.metrics import METRICS
+from watergun.common.roi import FloorROI
+from watergun.common.tracking import DetectionScheduler, LeadPredictor, TrackPredictor
+from watergun.common.undistort import Undistorter
+from watergun.control.backends import resolve_detector, resolve_reid
+
+
+def setup_logger():
+    logger = logging.getLogger('video_tracking_logger')
+    logger.setLevel(logging.INFO)
+    handler = logging.StreamHandler(sys.stdout)
+    formatter = logging.Formatter('%(asctime)s,%(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+    handler.setFormatter(formatter)
+    logger.addHandler(handler)
+    return logger
+
+def load_floor_corners(file_path, frame_width, frame_height, undistorter=None):
+    try:
+        floor_corners = np.load(file_path)
+        src_pts = np.array([[0, 0], [frame_width-1, 0], [frame_width-1, frame_height-1], [0, frame_height-1]], dtype=np.float32)
+        # The corners were clicked on raw frames; the homography lives in undistorted pixels when there is an undistorter
+        dst_pts = (floor_corners if undistorter is None else undistorter.points(floor_corners)).astype(np.float32)
+        perspective_transform = cv2.getPerspectiveTransform(src_pts, dst_pts)
+        inverse_perspective_transform = cv2.getPerspectiveTransform(dst_pts, src_pts)
+        print("Floor corners loaded and perspective transform matrices calculated.")
+        return floor_corners, perspective_transform, inverse_perspective_transform
+    except Exception as e:
+        print(f"Failed to load floor corners: {e}")
+        return None, None, None
+
+def detector_imgsz():
+    return int(os.getenv('INFERENCE_IMGSZ', 640))
+
+def load_detector(model_path='models/yolov8n.pt'):
+    """
+    INFERENCE_BACKEND picks the runtime: "pytorch", "onnx", "openvino", or "auto" (the default) for the fastest
+    export already cached in models/. Exports are made on first use, for INFERENCE_IMGSZ and, with
+    INFERENCE_INT8=1, quantized on frames from the INT8_CALIBRATION session or video.
+    """
+    # Deferred import: ultralytics pulls in torch, which alone takes seconds to import
+    from ultralytics import YOLO
+    path = resolve_detector(model_path, os.getenv('INFERENCE_BACKEND', 'auto'), detector_imgsz(),
+                            os.getenv('INFERENCE_INT8', '0') == '1', os.getenv('INT8_CALIBRATION'))
+    return YOLO(path, task='detect')
+
+def load_tracker(reid_weights='models/osnet_x0_25_msmt17.pt', backend=None):
+    """
+    :param backend: ReID runtime; by default REID_BACKEND (falling back to INFERENCE_BACKEND), picked the same
+                    way as for load_detector
+    """
+    from boxmot import DeepOCSORT
+    if backend is None:
+        backend = os.getenv('REID_BACKEND', os.getenv('INFERENCE_BACKEND', 'auto'))
+    return DeepOCSORT(
+        model_weights=Path(resolve_reid(reid_weights, backend)),
+        device='cpu',
+        fp16=False,
+    )
+
+class TrackingPipeline:
+    """
+    The detect -> track -> aim -> send steps, independent of where frames come from or whether anything is displayed.
+
+    VideoTrackingApp drives it from the Tk loop; watergun.control.headless
+    drives it from a plain loop.
+
+    The detector and tracker are loaded and warmed up with a dummy inference
+    on a background thread, so the window and camera come up meanwhile.
+    Until models_ready is set, frames are not detected on and there are no
+    tracks; aiming at a given pixel works from the start. Callers that need
+    detections from the first frame call wait_until_ready().
+    """
+
+    def __init__(self, frame_width, frame_height, sender=None, yolo_model=None, floor_corners_file=None,
+                 calibration_file=None, camera_calibration_file=None):
+        """
+        :param frame_width: width of the camera frames in pixels
+        :param frame_height: height of the camera frames in pixels
+        :param sender: CommandSender for the sprayer, or None to only compute angles
+        :param yolo_model: detector shared with other pipelines, loaded from models/yolov8n.pt in the background
+                           when None
+        :param floor_corners_file: floor corners for this camera, FLOOR_CORNERS_FILE when None
+        :param calibration_file: sprayer calibration for this camera, calibration_results.json when None
+        :param camera_calibration_file: lens calibration for this camera; when given the aiming path is
+                                        undistorted regardless of UNDISTORT
+        """
+        self.frame_width = frame_width
+        self.frame_height = frame_height
+        self.sender = sender
+
+        # Models load while the rest of the setup (floor, calibration, LUT) runs; warm-up waits for that setup
+        self.yolo_model = yolo_model
+        self.owns_detector = yolo_model is None
+        self.detector_imgsz = detector_imgsz()
+        self.tracker = None
+        self.models_ready = threading.Event()
+        self.load_error = None
+        self._configured = threading.Event()
+        threading.Thread(target=self._load_models, name="ModelLoader", daemon=True).start()
+
+        # UNDISTORT=1 corrects lens distortion on the aiming path; only points are undistorted, never whole frames
+        self.undistorter = None
+        if camera_calibration_file is not None:
+            self.undistorter = Undistorter.load(camera_calibration_file)
+        elif os.getenv('UNDISTORT', '0') == '1':
+            self.undistorter = Undistorter.load(os.getenv('CAMERA_CALIBRATION_FILE', 'dist_calibration_data.npy'))
+
+        self.floor_corners, self.perspective_transform, self.inverse_perspective_transform = load_floor_corners(
+            floor_corners_file or os.getenv('FLOOR_CORNERS_FILE','assets/floor_corners.npy'),
+            self.frame_width, self.frame_height, self.undistorter)
+        calibration_file = calibration_file or "calibration_results.json"
+        with open(calibration_file, "r") as f:
+            self.calibration_results = json.load(f)
+        # Calibrations fitted with a nozzle velocity aim along the water's arc; the range -> elevation table
+        # is cached next to the calibration file
+        self.ballistics = BallisticTable.from_results(self.calibration_results,
+                                                      os.path.dirname(os.path.abspath(calibration_file)))
+        # Optionally run the detector only on the floor's bounding box ("crop") or polygon ("mask")
+        self.floor_roi = None
+        roi_mode = os.getenv('FLOOR_ROI_INFERENCE', 'off')
+        if roi_mode in ("crop", "mask") and self.floor_corners is not None:
+            self.floor_roi = FloorROI(self.floor_corners, self.frame_width, self.frame_height,
+                                      padding=int(os.getenv('FLOOR_ROI_PADDING', 0)),
+                                      mask=roi_mode == "mask")
+        self.transform = CalibratedTransform.from_results(self.calibration_results, self.perspective_transform,
+                                                          self.undistorter, self.ballistics)
+        self.pan_tilt_table = PanTiltTable.load_or_build(self.transform, self.frame_width, self.frame_height,
+                                                         step=int(os.getenv('PAN_TILT_LUT_STEP', 1)))
+
+        # DETECT_CLASSES takes comma-separated COCO class ids, e.g. "0" for people or "0,15,16" to add cats and dogs
+        classes = os.getenv('DETECT_CLASSES')
+        self.detection_filter = DetectionFilter(
+            self.frame_width, self.frame_height,
+            min_confidence=float(os.getenv('DETECT_MIN_CONFIDENCE', 0.0)),
+            classes=[int(c) for c in classes.split(',')] if classes else None,
+        )
+
+        self.current_target_index = 0
+        self.last_target_switch_time = None
+        self.tracks = []
+        # Full detection every N frames, constant-velocity predictions in between
+        max_interval = os.getenv('REDETECT_MAX_INTERVAL')
+        self.detection_scheduler = DetectionScheduler(
+            every_n=int(os.getenv('DETECT_EVERY_N', 1)),
+            min_confidence=float(os.getenv('REDETECT_MIN_CONFIDENCE', 0.0)),
+            max_interval=float(max_interval) if max_interval else None,
+        )
+        self.track_predictor = TrackPredictor()
+        self.frame_time = None
+
+        # LEAD_TARGETING=1 aims where the target will be when the water arrives: the measured capture-to-send
+        # latency, plus ACTUATION_LATENCY for the server/serial/servo hops we cannot time, plus WATER_FLIGHT_TIME
+        self.lead_predictor = None
+        if os.getenv('LEAD_TARGETING', '0') == '1' and self.perspective_transform is not None:
+            self.lead_predictor = LeadPredictor(self.perspective_transform, self.inverse_perspective_transform,
+                                                self.undistorter)
+        self.actuation_latency = float(os.getenv('ACTUATION_LATENCY', 0.0))
+        self.water_flight_time = float(os.getenv('WATER_FLIGHT_TIME', 0.0))
+        self.latency = None
+        # Replays pin the lead time to what was recorded, and skip latency tracking, since their frame times are
+        # not this process's capture times
+        self.lead_time_override = None
+        # Lead applied to the target select_target last returned, and to the last command sent; a command
+        # that did not come from a led target (cursor, joystick, LEAD_TARGETING off) is sent with 0.0
+        self._target_lead_time = 0.0
+        self.last_lead_time = 0.0
+
+        # A SessionRecorder set here records every frame, detection, track and command
+        self.recorder = None
+
+        # Stage timings always go into METRICS; METRICS_PORT also serves them to Prometheus on localhost
+        self.metrics_log_interval = float(os.getenv('METRICS_LOG_INTERVAL', 60))
+        if os.getenv('METRICS_PORT'):
+            METRICS.serve(int(os.getenv('METRICS_PORT')))
+        self._configured.set()
+
+    def _load_models(self):
+        try:
+            if self.yolo_model is None:
+                self.yolo_model = load_detector()
+            self.tracker = load_tracker()
+            METRICS.milestone("models_loaded")
+            self._configured.wait()
+            self.warm_up()
+            METRICS.milestone("models_warmed")
+        except Exception as e:
+            # Reported by wait_until_ready(); the GUI keeps running with cursor and joystick aiming
+            self.load_error = e
+            print(f"Failed to load models: {e}")
+        finally:
+            self.models_ready.set()
+
+    def warm_up(self):
+        """
+        Run the detector, and the tracker's ReID model where it exposes one, once on a blank frame of the input size.
+
+        The first inference pays for lazy initialization (graph fusing, thread pools, kernel selection);
+        paying it here keeps it out of the first real frames. The tracker itself is not updated, so no
+        track is created. A shared detector is left to its owner, since it is not safe to call from
+        several loader threads at once.
+        """
+        blank = np.zeros((self.frame_height, self.frame_width, 3), dtype=np.uint8)
+        if self.owns_detector:
+            self.yolo_model(self.detector_input(blank), imgsz=self.detector_imgsz, verbose=False)
+        reid = getattr(self.tracker, 'model', None)
+        if hasattr(reid, 'get_features'):
+            reid.get_features(np.array([[0, 0, min(64, self.frame_width), min(128, self.frame_height)]]), blank)
+
+    def wait_until_ready(self, timeout=None):
+        """
+        Block until the models are loaded and warmed up.
+
+        :raises RuntimeError: if loading failed
+        """
+        self.models_ready.wait(timeout)
+        if self.load_error is not None:
+            raise RuntimeError(f"Model loading failed: {self.load_error}") from self.load_error
+
+    def process_yolo_results(self, results):
+        return self.detection_filter(results)
+
+    def detector_input(self, frame):
+        """
+        :return: the image the detector should see for this frame, cropped or masked to the floor ROI if enabled
+        """
+        return self.floor_roi.crop(frame) if self.floor_roi is not None else frame
+
+    def detections_from(self, results):
+        """
+        :param results: detector results for the image from detector_input()
+        :return: filtered (N, 6) detections in frame coordinates
+        """
+        detections = self.process_yolo_results(results)
+        return self.floor_roi.to_frame(detections) if self.floor_roi is not None else detections
+
+    def detect(self, frame):
+        with METRICS.timer("inference"):
+            results = self.yolo_model(self.detector_input(frame), imgsz=self.detector_imgsz, verbose=False)
+            return self.detections_from(results)
+
+    def begin_frame(self, frame, frame_time, jpeg=None):
+        """
+        Note the frame being processed; calling it again for the same frame does nothing.
+
+        :param frame: camera frame
+        :param frame_time: capture time of the frame (time.monotonic)
+        :param jpeg: the grabber's JPEG bytes for the frame (FrameGrabber.jpeg), recorded instead of re-encoding
+        """
+        if frame_time == self.frame_time:
+            return
+        self.frame_time = frame_time
+        METRICS.milestone("first_frame")
+        METRICS.maybe_log(self.metrics_log_interval)
+        if self.recorder is not None:
+            self.recorder.frame(frame, frame_time, jpeg)
+
+    def update_tracks(self, frame, frame_time, jpeg=None):
+        """
+        Run the detector and tracker, or extrapolate the last tracks, depending on the detection cadence.
+
+        :param frame: camera frame
+        :param frame_time: capture time of the frame (time.monotonic)
+        :param jpeg: the grabber's JPEG bytes for the frame, see begin_frame()
+        :return: current tracks
+        """
+        self.begin_frame(frame, frame_time, jpeg)
+        if not self.models_ready.is_set() or self.load_error is not None:
+            return self.extrapolate_tracks(frame_time)
+        if self.detection_scheduler.should_detect(self.tracks, frame_time):
+            return self.apply_detections(frame, frame_time, self.detect(frame))
+        return self.extrapolate_tracks(frame_time)
+
+    def apply_detections(self, frame, frame_time, dets):
+        """
+        Feed fresh detections for a frame to the tracker and the predictors.
+
+        :param dets: (N, 6) detections from detect() or detections_from()
+        :return: current tracks
+        """
+        METRICS.milestone("first_detection")
+        if self.recorder is not None:
+            self.recorder.detections(dets)
+        with METRICS.timer("tracking"):
+            if len(dets) > 0:
+                self.tracks = self.tracker.update(dets, frame)
+            else:
+                self.tracks = self.tracker.update(np.empty((0, 6)), frame)
+            self.track_predictor.update(self.tracks, frame_time)
+            if self.lead_predictor is not None:
+                self.lead_predictor.update(self.tracks, frame_time)
+        if self.recorder is not None:
+            self.recorder.tracks(self.tracks)
+        return self.tracks
+
+    def extrapolate_tracks(self, frame_time):
+        """
+        Move the last tracks along their velocity to frame_time instead of detecting.
+
+        :return: current tracks
+        """
+        with METRICS.timer("tracking"):
+            self.tracks = self.track_predictor.predict(frame_time)
+        if self.recorder is not None:
+            self.recorder.tracks(self.tracks)
+        return self.tracks
+
+    def select_target(self, target_hold_time):
+        """
+        Pick the track to aim at, cycling to the next one every target_hold_time seconds.
+
+        :return: (pixel_x, pixel_y) of the target's feet, led by lead_time() with LEAD_TARGETING,
+                 or None without tracks
+        """
+        # Frame time rather than wall time, so replays switch targets on the same frames as the recording
+        current_time = self.frame_time if self.frame_time is not None else time.monotonic()
+        if self.last_target_switch_time is None or current_time - self.last_target_switch_time > target_hold_time:
+            self.current_target_index = (self.current_target_index + 1) % max(1, len(self.tracks))
+            self.last_target_switch_time = current_time
+
+        self._target_lead_time = 0.0
+        for i, track in enumerate(self.tracks):
+            x1, y1, x2, y2, track_id = track[:5]
+            center_x = int((x1 + x2) / 2)
+            bottom_y = int(y2)
+
+            if i == self.current_target_index:
+                if self.lead_predictor is not None and self.frame_time is not None:
+                    self._target_lead_time = self.lead_time()
+                    return self.lead_predictor.predict(int(track_id), center_x, bottom_y, self.frame_time,
+                                                       self.frame_time + self._target_lead_time)
+                return center_x, bottom_y
+
+        return None
+
+    def aim(self, pixel_x, pixel_y):
+        """
+        :param pixel_x: x of a floor pixel in the raw (distorted) frame
+        :param pixel_y: y of a floor pixel in the raw (distorted) frame
+        :return: tuple of (pan_angle, tilt_angle) in degrees, with undistortion already folded into the table
+        """
+        with METRICS.timer("transform"):
+            return self.pan_tilt_table.lookup(pixel_x, pixel_y)
+
+    def lead_time(self):
+        """
+        :return: seconds between a frame's capture and the water landing
+        """
+        if self.lead_time_override is not None:
+            return self.lead_time_override
+        # The sender times capture-to-wire; without one (or before its first send) use capture-to-submit
+        latency = self.sender.latency if self.sender is not None and self.sender.latency is not None else self.latency
+        return (latency or 0.0) + self.actuation_latency + self.water_flight_time
+
+    def send(self, pan_angle, tilt_angle, trigger, captured_at=None):
+        """
+        :param captured_at: capture time (time.monotonic) of the frame the command was computed from
+        """
+        METRICS.milestone("first_aim")
+        if self.lead_time_override is not None:
+            # A replay's frame times come from the recording, so latency measured against them means nothing
+            captured_at = None
+        # Consumed by this command, so a later cursor or joystick command doesn't inherit it
+        self.last_lead_time = self._target_lead_time
+        self._target_lead_time = 0.0
+        if captured_at is not None:
+            latency = time.monotonic() - captured_at
+            self.latency = latency if self.latency is None else self.latency + 0.1 * (latency - self.latency)
+        if self.sender is not None:
+            # Only a queue put; the sender thread times the actual write as the "send" stage
+            self.sender.submit(pan_angle, tilt_angle, trigger, captured_at)
+        if self.recorder is not None:
+            self.recorder.command(pan_angle, tilt_angle, trigger, self.last_lead_time)
@@ -0,0 +1,196 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+from watergun.common.metrics import METRICS
+from watergun.common.mjpeg import open_grabber
+from watergun.common.sender import CommandSender, parse_address
+from watergun.control.headless import parse_source
+from watergun.control.pipeline import TrackingPipeline, detector_imgsz, load_detector
+
+
+class Turret:
+    """
+    One camera -> sprayer pair: its frame grabber, tracking pipeline (with its own tracker, floor corners and
+    calibration) and command sender.
+    """
+
+    def __init__(self, config, yolo_model):
+        """
+        :param config: dict with name, source and optionally sprayer ("host:port"), floor_corners, calibration,
+                       camera_calibration, fire and target_hold_time
+        :param yolo_model: detector shared by every turret
+        """
+        self.name = config.get("name", str(config["source"]))
+        self.fire = bool(config.get("fire", False))
+        self.target_hold_time = float(config.get("target_hold_time", 5.0))
+
+        self.sender = None
+        if config.get("sprayer"):
+            self.sender = CommandSender(protocol=os.getenv('SPRAYER_PROTOCOL', 'binary'),
+                                        deadband=float(os.getenv('SPRAYER_DEADBAND', 0.0)))
+            self.sender.connect(*parse_address(config["sprayer"]))
+
+        self.grabber = open_grabber(parse_source(config["source"]))
+        self.pipeline = TrackingPipeline(self.grabber.frame_width, self.grabber.frame_height, self.sender,
+                                         yolo_model=yolo_model,
+                                         floor_corners_file=config.get("floor_corners"),
+                                         calibration_file=config.get("calibration"),
+                                         camera_calibration_file=config.get("camera_calibration"))
+        self.last_seq = 0
+        self.frames = 0
+
+    def has_new_frame(self):
+        return self.grabber.stats()["seq"] != self.last_seq
+
+    def aim_and_send(self, frame_time):
+        target = self.pipeline.select_target(self.target_hold_time)
+        if target is not None:
+            pan, tilt = self.pipeline.aim(*target)
+            self.pipeline.send(pan, tilt, 1 if self.fire else 0, frame_time)
+
+    def close(self):
+        self.grabber.stop()
+        if self.sender is not None:
+            self.sender.close()
+
+
+class TurretService:
+    """
+    Drive several camera -> sprayer pairs from one process with one detector.
+
+    Every turret keeps its own grabber, tracker, calibration and sender, but
+    the YOLO model is loaded once. Each step gathers the newest frame from
+    every camera that has one, and the frames whose detection schedule says
+    "detect" go to the model as a single batched call; the others extrapolate
+    their tracks. Throughput then grows with batch efficiency rather than
+    with the number of processes fighting over the cores.
+
+    Cameras are not synchronized, so after the first new frame a step waits
+    up to `batch_window` seconds for the other cameras before running the
+    detector.
+    """
+
+    def __init__(self, turret_configs, model_path='models/yolov8n.pt', batch_window=0.01):
+        """
+        :param turret_configs: list of per-turret config dicts, see Turret
+        :param model_path: detector weights shared by every turret
+        :param batch_window: seconds to wait for the other cameras once one has a new frame
+        """
+        self.batch_window = batch_window
+        self.yolo_model = load_detector(model_path)
+        self.detector_imgsz = detector_imgsz()
+        self.turrets = [Turret(config, self.yolo_model) for config in turret_configs]
+        self.frame_ready = threading.Event()
+        for turret in self.turrets:
+            turret.grabber.frame_event = self.frame_ready
+        self.stats = {"steps": 0, "batches": 0, "batched_frames": 0, "frames": 0}
+
+    @classmethod
+    def from_file(cls, config_file):
+        """
+        :param config_file: JSON file with a "turrets" list and optionally "model" and "batch_window"
+        """
+        with open(config_file) as f:
+            config = json.load(f)
+        return cls(config["turrets"], config.get("model", 'models/yolov8n.pt'), config.get("batch_window", 0.01))
+
+    def start(self):
+        """
+        Start the cameras, wait for every turret's tracker, and warm the shared detector with one batch of blank
+        frames shaped like a real step.
+        """
+        for turret in self.turrets:
+            turret.grabber.start()
+        for turret in self.turrets:
+            turret.pipeline.wait_until_ready()
+        blanks = [turret.pipeline.detector_input(np.zeros((turret.grabber.frame_height, turret.grabber.frame_width, 3),
+                                                          dtype=np.uint8)) for turret in self.turrets]
+        self.yolo_model(blanks, imgsz=self.detector_imgsz, verbose=False)
+        METRICS.milestone("detector_warmed")
+        return self
+
+    def step(self, timeout=1.0):
+        """
+        Process the newest frame of every turret that has one, with one detector call for all of them.
+
+        :param timeout: seconds to wait for any camera to deliver a frame
+        :return: number of frames processed
+        """
+        if not self.frame_ready.wait(timeout):
+            return 0
+        deadline = time.monotonic() + self.batch_window
+        while True:
+            # Cleared before checking, so a frame arriving meanwhile sets it again
+            self.frame_ready.clear()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or all(turret.has_new_frame() for turret in self.turrets):
+                break
+            self.frame_ready.wait(remaining)
+
+        fresh = []
+        for turret in self.turrets:
+            frame, frame_time, seq = turret.grabber.read()
+            if frame is not None and seq != turret.last_seq:
+                turret.last_seq = seq
+                fresh.append((turret, frame, frame_time))
+        if not fresh:
+            return 0
+
+        to_detect = []
+        for turret, frame, frame_time in fresh:
+            turret.pipeline.begin_frame(frame, frame_time, turret.grabber.jpeg(turret.last_seq))
+            if turret.pipeline.detection_scheduler.should_detect(turret.pipeline.tracks, frame_time):
+                to_detect.append((turret, frame, frame_time))
+            else:
+                turret.pipeline.extrapolate_tracks(frame_time)
+                turret.aim_and_send(frame_time)
+
+        if to_detect:
+            with METRICS.timer("inference"):
+                results = self.yolo_model([turret.pipeline.detector_input(frame) for turret, frame, _ in to_detect],
+                                          imgsz=self.detector_imgsz, verbose=False)
+            for (turret, frame, frame_time), result in zip(to_detect, results):
+                turret.pipeline.apply_detections(frame, frame_time, turret.pipeline.detections_from([result]))
+                turret.aim_and_send(frame_time)
+            self.stats["batches"] += 1
+            self.stats["batched_frames"] += len(to_detect)
+
+        for turret, _, _ in fresh:
+            turret.frames += 1
+        self.stats["steps"] += 1
+        self.stats["frames"] += len(fresh)
+        return len(fresh)
+
+    def run(self, max_frames=None):
+        """
+        Step until interrupted, or until max_frames frames were processed across all turrets.
+        """
+        start = time.perf_counter()
+        try:
+            while max_frames is None or self.stats["frames"] < max_frames:
+                self.step()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            elapsed = time.perf_counter() - start
+            self.close()
+        print(self.report(elapsed))
+
+    def report(self, elapsed):
+        batches = self.stats["batches"]
+        lines = [f"{self.stats['frames']} frames from {len(self.turrets)} cameras in {elapsed:.2f}s "
+                 f"({self.stats['frames'] / elapsed if elapsed else 0:.1f} FPS total), "
+                 f"{batches} detector calls averaging {self.stats['batched_frames'] / batches if batches else 0:.2f} "
+                 f"frames"]
+        for turret in self.turrets:
+            lines.append(f"  {turret.name:<12} {turret.frames} frames, capture {turret.grabber.stats()}, "
+                         f"detection {turret.pipeline.detection_scheduler.stats}")
+        return "\n".join(lines)
+
+    def close(self):
+        for turret in self.turrets:
+            turret.close()